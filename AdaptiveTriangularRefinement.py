@@ -0,0 +1,202 @@
+import numpy as np
+from TransferOperators import makeTransferOperators
+import Timers
+
+# --------------------------------------------------------------------------
+# Local refinement of a triangular mesh by newest vertex bisection.
+#
+# Each element (v0,v1,v2) has a refinement edge, the edge (v1,v2) opposite
+# its first vertex. Bisecting the element at the midpoint m of that edge
+# produces the children (m,v2,v0) and (m,v0,v1), whose refinement edges are
+# again the edges opposite m. The children's vertex order makes m their
+# "newest vertex", so refined meshes can be passed back in for further
+# refinement.
+#
+# All three edges of each marked element are bisected, so a marked element
+# is split into four children like in uniform refinement. To keep the mesh
+# conforming, every element with a bisected edge must also have its
+# refinement edge bisected; this closure is repeated until no more edges
+# are added. Each unmarked element is then left alone or split into two,
+# three, or four children depending on which of its edges were bisected.
+#
+# The refinement edges of an arbitrary coarse mesh can be chosen as the
+# longest edge of each element with longestEdge=True, which keeps the
+# closure from spreading far. This should be used for the first adaptive
+# refinement of a mesh that didn't come from this refiner.
+#
+# Returns (fine, update, downdate) like UniformTriangularRefinement, with
+# the fine mesh as a CompressedMesh2D. The coarse vertices keep their
+# indices and the new vertices are numbered after them.
+# --------------------------------------------------------------------------
+
+@Timers.timed('AdaptiveTriangularRefinement')
+def AdaptiveTriangularRefinement(coarse, marked, longestEdge=False, verb=0):
+
+    from CompressedMesh2D import CompressedMesh2D
+
+    verts = np.asarray(coarse.verts, dtype=np.float64).reshape(-1,2)
+    elems = np.asarray(coarse.elems, dtype=np.int64).reshape(-1,3)
+    sides = np.sort(np.asarray(coarse.sides, dtype=np.int64).reshape(-1,2),
+                    axis=1)
+    sideLabels = np.asarray(coarse.sideLabels)
+    elemEdges = np.asarray(coarse.elemToEdgesMap, dtype=np.int64).reshape(-1,3)
+    numVerts = len(verts)
+    numElems = len(elems)
+
+    isMarked = markedElements(marked, numElems)
+
+    # Edge i of an element is (v_i, v_{i+1}), so the refinement edge is
+    # edge 1. Rotate the elements to put their longest edge there.
+    if longestEdge:
+        p = verts[elems]
+        lengths = np.sum((p[:,[1,2,0]] - p)**2, axis=2)
+        shift = (np.argmax(lengths, axis=1) + 2) % 3
+        rot = (shift[:,None] + np.arange(3)) % 3
+        elems = np.take_along_axis(elems, rot, axis=1)
+        elemEdges = np.take_along_axis(elemEdges, rot, axis=1)
+
+    # Bisect every edge of the marked elements, then close
+    edgeMarked = np.zeros(len(sides), dtype=bool)
+    edgeMarked[elemEdges[isMarked].ravel()] = True
+    while True:
+        touched = np.any(edgeMarked[elemEdges], axis=1)
+        missing = touched & ~edgeMarked[elemEdges[:,1]]
+        if not np.any(missing):
+            break
+        edgeMarked[elemEdges[missing,1]] = True
+
+    numNewVerts = int(np.sum(edgeMarked))
+    if verb>0:
+        print('refining %d marked elements: %d of %d elements touched, '
+            '%d new vertices' % (np.sum(isMarked), np.sum(touched), numElems,
+                                 numNewVerts))
+
+    # Midpoint vertices, numbered after the coarse vertices in edge order
+    bisected = np.flatnonzero(edgeMarked)
+    midVert = -np.ones(len(sides), dtype=np.int64)
+    midVert[bisected] = numVerts + np.arange(numNewVerts)
+
+    fineVerts = np.empty((numVerts + numNewVerts, 2))
+    fineVerts[:numVerts] = verts
+    fineVerts[numVerts:] = 0.5*(verts[sides[bisected,0]]
+                                + verts[sides[bisected,1]])
+
+    # Children of each element, tagged with their parent so they can be
+    # put in parent order
+    v0, v1, v2 = elems[:,0], elems[:,1], elems[:,2]
+    m = midVert[elemEdges[:,1]]
+    m1 = midVert[elemEdges[:,0]]
+    m2 = midVert[elemEdges[:,2]]
+    splitA = touched & (m1>=0)
+    splitB = touched & (m2>=0)
+
+    children = []
+    parents = []
+
+    def addChildren(mask, *corners):
+        children.append(np.column_stack([c[mask] for c in corners]))
+        parents.append(np.flatnonzero(mask))
+
+    addChildren(~touched, v0, v1, v2)
+    # Child (m,v0,v1), bisected at m1 if that edge is marked
+    addChildren(touched & ~splitA, m, v0, v1)
+    addChildren(splitA, m1, v1, m)
+    addChildren(splitA, m1, m, v0)
+    # Child (m,v2,v0), bisected at m2 if that edge is marked
+    addChildren(touched & ~splitB, m, v2, v0)
+    addChildren(splitB, m2, v0, m)
+    addChildren(splitB, m2, m, v2)
+
+    parents = np.concatenate(parents)
+    order = np.argsort(parents, kind='stable')
+    fineElems = np.concatenate(children)[order]
+
+    # Sides: the coarse sides that weren't bisected, the halves of those
+    # that were, and the new sides inside the coarse elements
+    kept = np.flatnonzero(~edgeMarked)
+    mid = midVert[bisected]
+    halves = np.column_stack([sides[bisected,0], mid, mid,
+                              sides[bisected,1]]).reshape(-1,2)
+    interior = np.concatenate([np.column_stack([m[touched], v0[touched]]),
+                               np.column_stack([m1[splitA], m[splitA]]),
+                               np.column_stack([m2[splitB], m[splitB]])])
+    fineSides = np.concatenate([sides[kept], halves, interior])
+    fineLabels = np.concatenate([sideLabels[kept],
+                                 np.repeat(sideLabels[bisected], 2),
+                                 np.zeros(len(interior),
+                                          dtype=sideLabels.dtype)])
+
+    fine = CompressedMesh2D(fineVerts, fineElems, fineSides, fineLabels)
+    Timers.count('refine.vertsCreated', numNewVerts)
+    Timers.count('refine.sidesCreated', len(halves) + len(interior))
+    Timers.count('refine.elemsCreated', len(fineElems) - np.sum(~touched))
+
+    # Coarse vertices are injected; midpoints average their edge's ends
+    rows = np.concatenate([np.arange(numVerts),
+                           np.repeat(mid, 2)])
+    cols = np.concatenate([np.arange(numVerts), sides[bisected].ravel()])
+    vals = np.concatenate([np.ones(numVerts), np.full(2*numNewVerts, 0.5)])
+    update, downdate = makeTransferOperators(numVerts + numNewVerts,
+        numVerts, rows, cols, vals)
+
+    return (fine, update, downdate)
+
+
+# Boolean mask of the marked elements. The marked elements can be given
+# either as a collection of element indices, such as the set used by
+# MPLMeshViewer, or as a boolean array over the elements.
+def markedElements(marked, numElems):
+    if isinstance(marked, (set, frozenset)):
+        marked = list(marked)
+    marked = np.asarray(marked)
+    if marked.dtype==bool:
+        if len(marked) != numElems:
+            raise ValueError('got %d marks for %d elements'
+                % (len(marked), numElems))
+        return marked
+    isMarked = np.zeros(numElems, dtype=bool)
+    isMarked[marked.astype(np.int64)] = True
+    return isMarked
+
+
+# ---------------------------------------------------------------------------
+# Test code: refine towards the corners of the hole in the oneHole mesh,
+# where the solution of Poisson's equation is singular.
+
+if __name__=='__main__':
+
+    from TriangleMeshReader import TriangleMeshReader
+    from UniformRefinementSequence import UniformRefinementSequence
+
+    mesh = TriangleMeshReader('TestMeshes/oneHole.1', bulk=True).getMesh()
+    corners = np.array([[0.5, 0.5], [1.5, 0.5], [1.5, 1.5], [0.5, 1.5]])
+
+    seq = UniformRefinementSequence(mesh, 1)
+    for level in range(8):
+        mesh = seq.mesh(seq.numLevels()-1)
+        centroids = np.mean(mesh.verts[mesh.elems], axis=1)
+        dist = np.min(np.linalg.norm(centroids[:,None,:] - corners[None,:,:],
+                                     axis=2), axis=1)
+        marked = np.flatnonzero(dist < 0.5**(level+1))
+        fine, up, down = AdaptiveTriangularRefinement(mesh, marked,
+            longestEdge=(level==0))
+        seq.addLevel(fine, up, down)
+
+        # The mesh must be conforming: interior sides have two elements,
+        # boundary sides one
+        counts = fine.connectedElemsForSide.counts()
+        conforming = np.all((counts==2) | ((counts==1) & (fine.sideLabels!=0)))
+        p = fine.verts[fine.elems]
+        area = 0.5*((p[:,1,0]-p[:,0,0])*(p[:,2,1]-p[:,0,1])
+                    - (p[:,2,0]-p[:,0,0])*(p[:,1,1]-p[:,0,1]))
+        print('level %d: %4d marked, %6d elements, conforming=%s, '
+            'min area %.3g' % (level+1, len(marked), len(fine.elems),
+                               conforming, area.min()))
+
+    # Linear functions are reproduced exactly by the update operators
+    f = 1.0 + 2.0*seq.mesh(0).verts[:,0] - seq.mesh(0).verts[:,1]
+    for i in range(seq.numLevels()-1):
+        f = seq.update(i)*f
+    v = seq.mesh(seq.numLevels()-1).verts
+    print('max interpolation error: %g'
+        % np.max(np.abs(f - (1.0 + 2.0*v[:,0] - v[:,1]))))
@@ -0,0 +1,117 @@
+import numpy as np
+
+# --------------------------------------------------------------------------
+# Index of the labeled sides of a mesh and their vertices, for applying
+# boundary conditions.
+#
+# For each label other than the interior label (0 by default, the label
+# given to interior sides by the meshers and refiners), the index holds
+# sorted int32 arrays of
+# --- the sides with that label: sides(label)
+# --- the distinct vertices of those sides: verts(label)
+# and the array of all side labels, sideLabels. vertsForLabels() gives the
+# vertices on several labels at once, such as all the Dirichlet parts of
+# the boundary.
+#
+# Meshes build their index on first use (mesh.boundaryIndex) and keep it.
+# The uniform refiners carry the index over to the fine mesh with
+# refine(), which maps each labeled side to its two children and adds the
+# midpoints to its vertices, so no level needs to search its sides again.
+# --------------------------------------------------------------------------
+
+class BoundaryIndex:
+
+    def __init__(self, sides, sideLabels, interiorLabel=0):
+        sides = np.asarray(sides, dtype=np.int64).reshape(-1,2)
+        self.sideLabels = np.asarray(sideLabels)
+        self.interiorLabel = interiorLabel
+        self.sideSets = {}
+        self.vertSets = {}
+
+        labeled = np.flatnonzero(self.sideLabels != interiorLabel)
+        if len(labeled)==0:
+            return
+        labels, inv = np.unique(self.sideLabels[labeled], return_inverse=True)
+        order = np.argsort(inv, kind='stable')
+        bounds = np.searchsorted(inv[order], np.arange(len(labels)+1))
+        for i,label in enumerate(labels):
+            if isinstance(label, np.generic):
+                label = label.item()
+            s = labeled[order[bounds[i]:bounds[i+1]]]
+            self.sideSets[label] = s.astype(np.int32)
+            self.vertSets[label] = np.unique(sides[s]).astype(np.int32)
+
+    # The labels in the index, sorted
+    def labels(self):
+        return sorted(self.sideSets.keys())
+
+    # Sorted indices of the sides with a label (empty if there are none)
+    def sides(self, label):
+        return self.sideSets.get(label, np.zeros(0, dtype=np.int32))
+
+    # Sorted indices of the vertices on sides with a label
+    def verts(self, label):
+        return self.vertSets.get(label, np.zeros(0, dtype=np.int32))
+
+    # Sorted indices of the vertices on sides with any of the given labels,
+    # or on any labeled side if labels is None
+    def vertsForLabels(self, labels=None):
+        if labels is None:
+            labels = self.labels()
+        sets = [self.verts(label) for label in labels]
+        if len(sets)==0:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate(sets))
+
+    # The index for a uniform refinement of this mesh. childSides is the
+    # (numCoarseSides, 2) array of the fine sides each coarse side is split
+    # into; oldToNewVertexMap and oldEdgeToNewVertMap give the fine indices
+    # of the coarse vertices and of the coarse sides' midpoints.
+    def refine(self, fineSideLabels, childSides, oldToNewVertexMap,
+               oldEdgeToNewVertMap):
+        fine = BoundaryIndex.__new__(BoundaryIndex)
+        fine.sideLabels = np.asarray(fineSideLabels)
+        fine.interiorLabel = self.interiorLabel
+        fine.sideSets = {}
+        fine.vertSets = {}
+        childSides = np.asarray(childSides)
+        oldToNewVertexMap = np.asarray(oldToNewVertexMap)
+        oldEdgeToNewVertMap = np.asarray(oldEdgeToNewVertMap)
+        for label, s in self.sideSets.items():
+            fine.sideSets[label] = np.sort(childSides[s].ravel()).astype(np.int32)
+            # The coarse vertices and the midpoints are all distinct
+            fine.vertSets[label] = np.sort(np.concatenate(
+                [oldToNewVertexMap[self.vertSets[label]],
+                 oldEdgeToNewVertMap[s]])).astype(np.int32)
+        return fine
+
+
+# ---------------------------------------------------------------------------
+# Test code
+
+if __name__=='__main__':
+
+    from UniformRectangleMesher import UniformRectangleMesher
+    from UniformTriangularRefinement import (UniformTriangularRefinement,
+        VectorizedUniformTriangularRefinement)
+
+    mesh = UniformRectangleMesher(0.0, 1.0, 3, 0.0, 1.0, 2)
+    for label in mesh.boundaryIndex.labels():
+        print('label %d: sides %s, verts %s' % (label,
+            mesh.boundaryIndex.sides(label).tolist(),
+            mesh.boundaryIndex.verts(label).tolist()))
+
+    # The carried index matches one built from scratch on every level
+    for refiner in (UniformTriangularRefinement,
+                    VectorizedUniformTriangularRefinement):
+        fine = mesh
+        for level in range(3):
+            fine, up, down = refiner(fine)
+            carried = fine.boundaryIndex
+            fresh = BoundaryIndex(fine.sides, fine.sideLabels)
+            same = carried.labels()==fresh.labels() and all(
+                np.array_equal(carried.sides(k), fresh.sides(k))
+                and np.array_equal(carried.verts(k), fresh.verts(k))
+                for k in fresh.labels())
+            print('%s level %d: index matches %s'
+                % (refiner.__name__, level+1, same))
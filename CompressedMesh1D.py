@@ -0,0 +1,77 @@
+import numpy as np
+from CompressedMesh2D import cofacetsCSR, _readOnly
+
+# --------------------------------------------------------------------------
+# An immutable 1D mesh with array-based storage, the 1D counterpart of
+# CompressedMesh2D. Build a mesh with LoadableMesh1D and call its compile()
+# method to produce one.
+#
+# --- verts: (numVerts,) float64 array of vertex positions
+# --- elems: (numElems, 2) int32 array of vertex indices, sorted in each row
+# --- vertLabels, elemLabels: int32 label arrays
+# --- connectedElemsForVert: cofacets in CSR form, computed on first use
+# --------------------------------------------------------------------------
+
+class CompressedMesh1D:
+
+    # Arrays that already have the right dtype are used without copying.
+    def __init__(self, verts, elems, vertLabels, elemLabels):
+        verts = np.asarray(verts, dtype=np.float64).reshape(-1)
+        elems = np.asarray(elems, dtype=np.int32).reshape(-1,2)
+        vertLabels = np.asarray(vertLabels, dtype=np.int32).reshape(-1)
+        elemLabels = np.asarray(elemLabels, dtype=np.int32).reshape(-1)
+
+        self.__dict__['dim'] = 1
+        self.__dict__['verts'] = _readOnly(verts)
+        self.__dict__['elems'] = _readOnly(elems)
+        self.__dict__['vertLabels'] = _readOnly(vertLabels)
+        self.__dict__['elemLabels'] = _readOnly(elemLabels)
+        self.__dict__['_vertCofacets'] = None
+
+    # The mesh is frozen: public attributes can't be rebound
+    def __setattr__(self, name, value):
+        raise AttributeError('CompressedMesh1D is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('CompressedMesh1D is immutable')
+
+    # For each vertex, the elements attached to it (CSR)
+    @property
+    def connectedElemsForVert(self):
+        if self._vertCofacets is None:
+            self.__dict__['_vertCofacets'] = cofacetsCSR(self.elems,
+                len(self.verts))
+        return self._vertCofacets
+
+    # Total memory held in the mesh's arrays, in bytes
+    def nbytes(self):
+        total = 0
+        for a in (self.verts, self.elems, self.vertLabels, self.elemLabels):
+            total += a.nbytes
+        if self._vertCofacets is not None:
+            total += self._vertCofacets.nbytes()
+        return total
+
+    # Dump the internal data
+    def dump(self):
+
+        print('Vertices: num=%d' % len(self.verts))
+        for v,cf,lb in zip(self.verts, self.connectedElemsForVert,
+                           self.vertLabels):
+            print('\t{:<10.3g} cofacets={:<8} label={}'.format(v,
+                str(cf.tolist()), lb))
+
+        print('Elements: num=%d' % len(self.elems))
+        for e,lb in zip(self.elems, self.elemLabels):
+            print('\t{:<20} label={}'.format(str(tuple(e.tolist())), lb))
+
+
+# ---------------------------------------------------------------------------
+# Test code
+
+if __name__=='__main__':
+
+    from LoadableMesh1D import FourElemLine
+
+    mesh = FourElemLine().compile()
+    mesh.dump()
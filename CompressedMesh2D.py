@@ -0,0 +1,344 @@
+import numpy as np
+
+# --------------------------------------------------------------------------
+# An immutable triangular mesh with compressed, array-based storage.
+#
+# The intended workflow is to build a mesh with LoadableMesh2D, which is
+# designed for ease of construction, and then call its compile() method
+# to produce a CompressedMesh2D for use. All data are stored in NumPy
+# arrays rather than in lists of Python tuples and sets:
+#
+# --- verts: (numVerts, 2) float64 array of vertex coordinates
+# --- elems: (numElems, 3) int32 array of vertex indices, CCW ordered
+# --- sides: (numSides, 2) int32 array of vertex indices, sorted in each row
+# --- elemToEdgesMap: (numElems, 3) int32 array of side indices. Entry
+#     [e,0] is side (a,b), [e,1] is side (b,c), [e,2] is side (c,a) for
+#     element (a,b,c), exactly as in LoadableMesh2D.
+# --- sideLabels: (numSides,) array of labels
+# --- connectedElemsForVert, connectedElemsForSide: cofacets stored in
+#     compressed sparse row (CSR) form. These are computed on first use.
+# --- sideToElems, elemNeighbors, isBoundarySide, boundarySides: fixed-width
+#     adjacency arrays (see sideElemPairs() and elemNeighborArray()), also
+#     computed on first use
+# --- boundaryIndex: a BoundaryIndex of the labeled sides and their
+#     vertices. It's built on first use unless it's given to the
+#     constructor, as the refiners do.
+#
+# The arrays are marked read-only and the attributes can't be reassigned.
+# --------------------------------------------------------------------------
+
+
+# Encode sorted vertex pairs (p,q) as single integers so that sides can
+# be searched with NumPy's sorting routines instead of a dictionary.
+def sideKeys(p, q, numVerts):
+    p = np.asarray(p, dtype=np.int64)
+    q = np.asarray(q, dtype=np.int64)
+    return np.minimum(p,q)*numVerts + np.maximum(p,q)
+
+
+# Look up the indices of sides (a,b) in an array of sorted sides. The
+# vertex pairs a, b don't need to be sorted. Raises RuntimeError if any
+# of the requested sides isn't in the array.
+def findSideIndices(sides, numVerts, a, b):
+    sides = np.asarray(sides).reshape(-1,2)
+    keys = sideKeys(sides[:,0], sides[:,1], numVerts)
+    order = np.argsort(keys, kind='stable')
+    sortedKeys = keys[order]
+
+    want = sideKeys(a, b, numVerts)
+    if want.size==0:
+        return np.zeros(want.shape, dtype=np.int64)
+
+    pos = np.searchsorted(sortedKeys, want)
+    found = pos<len(sortedKeys)
+    found[found] = sortedKeys[pos[found]]==want[found]
+    if not np.all(found):
+        bad = np.flatnonzero(~found.ravel())[0]
+        p = int(np.asarray(a).ravel()[bad])
+        q = int(np.asarray(b).ravel()[bad])
+        raise RuntimeError('side (%d,%d) not in mesh' % (min(p,q), max(p,q)))
+    return order[pos]
+
+
+# Build the elements-for-each-vertex connectivity in CSR form. The array
+# conn has one row per element (or side) listing the vertices (or the
+# sides) it touches, and numTargets is the number of vertices (sides).
+def cofacetsCSR(conn, numTargets):
+    conn = np.asarray(conn).reshape(len(conn), -1)
+    targets = conn.ravel()
+    owners = np.repeat(np.arange(conn.shape[0], dtype=np.int32),
+                       conn.shape[1])
+    order = np.argsort(targets, kind='stable')
+    counts = np.bincount(targets, minlength=numTargets)
+    offsets = np.zeros(numTargets+1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return CSRConnectivity(offsets, owners[order])
+
+
+# The elements on either side of each side, as a (numSides, 2) int32 array.
+# Column 0 holds the lower-numbered element and column 1 the other one, or
+# -1 for boundary sides. Raises RuntimeError if a side has more than two
+# elements.
+def sideElemPairs(elemEdges, numSides):
+    elemEdges = np.asarray(elemEdges, dtype=np.int64).reshape(-1,3)
+    flat = elemEdges.ravel()
+    owners = np.repeat(np.arange(len(elemEdges), dtype=np.int32), 3)
+    counts = np.bincount(flat, minlength=numSides)
+    if np.any(counts>2):
+        bad = np.flatnonzero(counts>2)[0]
+        raise RuntimeError('side %d has %d elements' % (bad, counts[bad]))
+
+    order = np.argsort(flat, kind='stable')
+    starts = np.zeros(numSides+1, dtype=np.int64)
+    np.cumsum(counts, out=starts[1:])
+    pairs = -np.ones((numSides, 2), dtype=np.int32)
+    has = counts>=1
+    pairs[has,0] = owners[order[starts[:-1][has]]]
+    two = counts==2
+    pairs[two,1] = owners[order[starts[:-1][two]+1]]
+    return pairs
+
+
+# The neighbors of each element, as a (numElems, 3) int32 array. Entry
+# [e,i] is the element across side elemEdges[e,i], or -1 on the boundary.
+def elemNeighborArray(elemEdges, pairs):
+    elemEdges = np.asarray(elemEdges, dtype=np.int64).reshape(-1,3)
+    p = pairs[elemEdges]                        # (numElems, 3, 2)
+    e = np.arange(len(elemEdges), dtype=np.int32)[:,None]
+    return np.where(p[:,:,0]==e, p[:,:,1], p[:,:,0])
+
+
+# A read-only list-of-arrays stored in compressed sparse row form. Item i is
+# the array indices[offsets[i]:offsets[i+1]]. This supports the same
+# indexing, len() and iteration idioms as the list-of-sets used in
+# LoadableMesh2D.
+class CSRConnectivity:
+
+    def __init__(self, offsets, indices):
+        self.offsets = _readOnly(np.asarray(offsets, dtype=np.int64))
+        self.indices = _readOnly(np.asarray(indices, dtype=np.int32))
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def __getitem__(self, i):
+        return self.indices[self.offsets[i]:self.offsets[i+1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # Number of entries in each row
+    def counts(self):
+        return np.diff(self.offsets)
+
+    def nbytes(self):
+        return self.offsets.nbytes + self.indices.nbytes
+
+
+# Return a read-only view of an array. The caller's array isn't affected.
+def _readOnly(a):
+    a = a.view()
+    a.flags.writeable = False
+    return a
+
+
+class CompressedMesh2D:
+
+    # Arrays that already have the right dtype are used without copying,
+    # so the mesh can be built on memory-mapped data. If sidesSorted is
+    # True, the vertices in each row of sides are assumed to be sorted.
+    def __init__(self, verts, elems, sides, sideLabels, elemToEdgesMap=None,
+                 sidesSorted=False, boundaryIndex=None):
+        verts = np.asarray(verts, dtype=np.float64).reshape(-1,2)
+        elems = np.asarray(elems, dtype=np.int32).reshape(-1,3)
+        sides = np.asarray(sides, dtype=np.int32).reshape(-1,2)
+        if not sidesSorted:
+            sides = np.sort(sides, axis=1)
+        sideLabels = np.asarray(sideLabels)
+        if sideLabels.dtype.kind in 'iub':
+            sideLabels = sideLabels.astype(np.int32, copy=False)
+
+        if len(sideLabels) != len(sides):
+            raise ValueError('got %d side labels for %d sides'
+                % (len(sideLabels), len(sides)))
+
+        # Find the edges of each element if they haven't been given
+        if elemToEdgesMap is None:
+            nv = len(verts)
+            a = elems[:,[0,1,2]].ravel()
+            b = elems[:,[1,2,0]].ravel()
+            elemToEdgesMap = findSideIndices(sides, nv, a, b).reshape(-1,3)
+        elemToEdgesMap = np.asarray(elemToEdgesMap, dtype=np.int32).reshape(-1,3)
+
+        self.__dict__['dim'] = 2
+        self.__dict__['verts'] = _readOnly(verts)
+        self.__dict__['elems'] = _readOnly(elems)
+        self.__dict__['sides'] = _readOnly(sides)
+        self.__dict__['sideLabels'] = _readOnly(sideLabels)
+        self.__dict__['elemToEdgesMap'] = _readOnly(elemToEdgesMap)
+
+        # Derived data, computed on demand
+        self.__dict__['_vertCofacets'] = None
+        self.__dict__['_sideCofacets'] = None
+        self.__dict__['_sideSets'] = None
+        self.__dict__['_sortedSideKeys'] = None
+        self.__dict__['_sideToElems'] = None
+        self.__dict__['_elemNeighbors'] = None
+        self.__dict__['_boundaryIndex'] = boundaryIndex
+
+    # The mesh is frozen: public attributes can't be rebound
+    def __setattr__(self, name, value):
+        raise AttributeError('CompressedMesh2D is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('CompressedMesh2D is immutable')
+
+    # For each vertex, the elements attached to it (CSR)
+    @property
+    def connectedElemsForVert(self):
+        if self._vertCofacets is None:
+            self.__dict__['_vertCofacets'] = cofacetsCSR(self.elems,
+                len(self.verts))
+        return self._vertCofacets
+
+    # For each side, the elements attached to it (CSR)
+    @property
+    def connectedElemsForSide(self):
+        if self._sideCofacets is None:
+            self.__dict__['_sideCofacets'] = cofacetsCSR(self.elemToEdgesMap,
+                len(self.sides))
+        return self._sideCofacets
+
+    # For each side, the elements on either side, -1 if none (numSides, 2)
+    @property
+    def sideToElems(self):
+        if self._sideToElems is None:
+            self.__dict__['_sideToElems'] = _readOnly(
+                sideElemPairs(self.elemToEdgesMap, len(self.sides)))
+        return self._sideToElems
+
+    # For each element, the neighbor across each of its sides, -1 if none
+    # (numElems, 3)
+    @property
+    def elemNeighbors(self):
+        if self._elemNeighbors is None:
+            self.__dict__['_elemNeighbors'] = _readOnly(
+                elemNeighborArray(self.elemToEdgesMap, self.sideToElems))
+        return self._elemNeighbors
+
+    # Whether each side is on the boundary
+    @property
+    def isBoundarySide(self):
+        return self.sideToElems[:,1] < 0
+
+    # Indices of the boundary sides
+    @property
+    def boundarySides(self):
+        return np.flatnonzero(self.isBoundarySide)
+
+    # Index of the labeled sides and their vertices
+    @property
+    def boundaryIndex(self):
+        if self._boundaryIndex is None:
+            from BoundaryIndex import BoundaryIndex
+            self.__dict__['_boundaryIndex'] = BoundaryIndex(self.sides,
+                self.sideLabels)
+        return self._boundaryIndex
+
+    # Side sets as a dictionary label -> sorted array of side indices
+    @property
+    def sideSets(self):
+        if self._sideSets is None:
+            sets = {}
+            if len(self.sideLabels)>0:
+                labels, inv = np.unique(self.sideLabels, return_inverse=True)
+                order = np.argsort(inv, kind='stable').astype(np.int32)
+                bounds = np.searchsorted(inv[order], np.arange(len(labels)+1))
+                for i,label in enumerate(labels):
+                    if isinstance(label, np.generic):
+                        label = label.item()
+                    sets[label] = _readOnly(order[bounds[i]:bounds[i+1]])
+            self.__dict__['_sideSets'] = sets
+        return self._sideSets
+
+    # Look up the index of side (a,b). Raises RuntimeError if there's
+    # no such side.
+    def sideIndex(self, a, b):
+        if self._sortedSideKeys is None:
+            keys = sideKeys(self.sides[:,0], self.sides[:,1], len(self.verts))
+            order = np.argsort(keys, kind='stable')
+            self.__dict__['_sortedSideKeys'] = (keys[order], order)
+        keys, order = self._sortedSideKeys
+        want = sideKeys(a, b, len(self.verts))
+        pos = np.searchsorted(keys, want)
+        if pos>=len(keys) or keys[pos]!=want:
+            raise RuntimeError('side (%d,%d) not in mesh' % (min(a,b), max(a,b)))
+        return int(order[pos])
+
+    # Look up the label for a side, given as a vertex pair
+    def getSideLabel(self, side):
+        label = self.sideLabels[self.sideIndex(side[0], side[1])]
+        if isinstance(label, np.generic):
+            label = label.item()
+        return label
+
+    # Total memory held in the mesh's arrays, in bytes
+    def nbytes(self):
+        total = 0
+        for a in (self.verts, self.elems, self.sides, self.sideLabels,
+                  self.elemToEdgesMap):
+            total += a.nbytes
+        for c in (self._vertCofacets, self._sideCofacets):
+            if c is not None:
+                total += c.nbytes()
+        for a in (self._sideToElems, self._elemNeighbors):
+            if a is not None:
+                total += a.nbytes
+        return total
+
+    # Dump the internal data
+    def dump(self):
+
+        print('Vertices: num=%d' % len(self.verts))
+        for v,cf in zip(self.verts, self.connectedElemsForVert):
+            print('\t', tuple(v.tolist()), ' cofacets=', cf.tolist())
+
+        print('Elements: num=%d' % len(self.elems))
+        for e in self.elems:
+            print('\t', tuple(e.tolist()))
+
+        print('Sides: num=%d' % len(self.sides))
+        for s, cf in zip(self.sides, self.connectedElemsForSide):
+            print('\t', tuple(s.tolist()), ' cofacets=', cf.tolist())
+
+        print('Side Sets: num=%d' % len(self.sideSets))
+        for label, sides in self.sideSets.items():
+            print('\tlabel=', label, ' sides', sides.tolist())
+
+
+# ---------------------------------------------------------------------------
+# Test code
+
+if __name__=='__main__':
+
+    from LoadableMesh2D import TwoElemSquare
+
+    loadable = TwoElemSquare()
+    mesh = loadable.compile()
+    mesh.dump()
+
+    for i in range(len(mesh.verts)):
+        assert set(mesh.connectedElemsForVert[i].tolist()) \
+            == loadable.connectedElemsForVert[i]
+    for i in range(len(mesh.sides)):
+        assert set(mesh.connectedElemsForSide[i].tolist()) \
+            == loadable.connectedElemsForSide[i]
+    for s in loadable.sides:
+        assert mesh.getSideLabel(s) == loadable.getSideLabel(s)
+    assert np.array_equal(mesh.sideToElems, loadable.sideToElems)
+    assert np.array_equal(mesh.elemNeighbors, loadable.elemNeighbors)
+    print('compressed mesh matches loadable mesh')
+    print('side to elements:', mesh.sideToElems.tolist())
+    print('element neighbors:', mesh.elemNeighbors.tolist())
+    print('boundary sides:', mesh.boundarySides.tolist())
@@ -31,14 +31,9 @@ def GoofySquare1():
 
   mesh = LoadableMesh2D()
 
-  for v in verts:
-    mesh.addVertex(v)
-
-  for s in sides:
-    mesh.addSide(s[0], s[1], 0)
-
-  for e in elems:
-    mesh.addElem(e[0], e[1], e[2])
+  mesh.addVertices(verts)
+  mesh.addSides(list(sides), 0)
+  mesh.addElems(elems)
 
 
   return mesh
@@ -79,6 +79,12 @@ class LoadableMesh1D:
     else:
       self.elemLabels[cellID]=label
 
+  # Write the mesh into an immutable CompressedMesh1D with array storage
+  def compile(self):
+    from CompressedMesh1D import CompressedMesh1D
+    return CompressedMesh1D(self.verts, self.elems, self.vertLabels,
+                            self.elemLabels)
+
   # Dump the internal data
   def dump(self):
 
@@ -1,11 +1,21 @@
 
+import numpy as np
+
 # --------------------------------------------------------------------------
 # A simple class for conforming triangular meshes. The class is
 # designed for simplicity of constructing the mesh.
 #
-# TODO: I plan to write another mesh class with compressed storage. The user
-# would then use LoadableMesh to build the mesh but then write it into a
-# compressed mesh format for use.
+# Once the mesh is built, call compile() to write it into the compressed,
+# array-based format of CompressedMesh2D for use.
+#
+# The connectivity derived from the elements (elemToEdgesMap,
+# connectedElemsForVert, and connectedElemsForSide) isn't maintained as
+# entities are added. Each is computed in bulk from the element array the
+# first time it's used, and discarded whenever the mesh is modified, so
+# building a mesh does no adjacency bookkeeping unless it's asked for.
+# The same goes for the adjacency arrays sideToElems, elemNeighbors,
+# isBoundarySide, and boundarySides, and for the boundaryIndex, which are
+# as in CompressedMesh2D.
 #
 # Katharine Long, Sep 2020
 # For Math 5344
@@ -40,9 +50,6 @@ class LoadableMesh2D:
     # triangulation of the unit square.
     self.sides = []
 
-    # Map to look to triplets of edges for each element
-    self.elemToEdgesMap = []
-
     # Side sets are stored in a dictionary with the label as key
     # and the set of side indices having that label as the value.
     # Syntax: {key1 : val1, key2 : val2, etc}
@@ -57,17 +64,106 @@ class LoadableMesh2D:
     # Example: {(0,1) : 0, (1,2) : 1, (2,3) : 2, (0,3) : 3, (0,2) : 4}
     self.sideToIndexMap = {}
 
-    # For each vertex, list the elements that are attached (cofacets).
-    # Example: [set([0,1]), set([0]), set([0,1]), set([1])]
-    self.connectedElemsForVert = []
-
-    # For each side, list the elements that are attached.
-    # Example: [set([0]), set([0]), set([1]), set([1]), set([0,1])]
-    self.connectedElemsForSide = []
-
     # Each side has a label
     self.sideLabels = []
 
+    # Sorted index of the sides for the bulk lookups in addElems(), and the
+    # number of sides in it. Sides added since are indexed on the next
+    # lookup, so adding sides never re-sorts the ones already indexed.
+    self._sideKeyIndex = SideKeyIndex()
+    self._numIndexedSides = 0
+
+    # Connectivity computed on demand; see the properties below. None
+    # means not computed since the last modification.
+    self._elemToEdgesMap = None
+    self._connectedElemsForVert = None
+    self._connectedElemsForSide = None
+    self._sideToElems = None
+    self._elemNeighbors = None
+    self._boundaryIndex = None
+
+
+  # Map to look up the triplet of edges for each element. Entry e lists
+  # the indices of sides (a,b), (b,c), (c,a) for element (a,b,c).
+  @property
+  def elemToEdgesMap(self):
+    if self._elemToEdgesMap is None:
+      from CompressedMesh2D import findSideIndices
+      elems = np.asarray(self.elems, dtype=np.int64).reshape(-1,3)
+      edges = findSideIndices(self.sides, len(self.verts),
+        elems[:,[0,1,2]].ravel(), elems[:,[1,2,0]].ravel()).reshape(-1,3)
+      self._elemToEdgesMap = list(map(tuple, edges.tolist()))
+    return self._elemToEdgesMap
+
+  # For each vertex, the set of elements that are attached (cofacets).
+  # Example: [set([0,1]), set([0]), set([0,1]), set([1])]
+  @property
+  def connectedElemsForVert(self):
+    if self._connectedElemsForVert is None:
+      self._connectedElemsForVert = cofacetSets(self.elems, len(self.verts))
+    return self._connectedElemsForVert
+
+  # For each side, the set of elements that are attached.
+  # Example: [set([0]), set([0]), set([1]), set([1]), set([0,1])]
+  @property
+  def connectedElemsForSide(self):
+    if self._connectedElemsForSide is None:
+      self._connectedElemsForSide = cofacetSets(self.elemToEdgesMap,
+                                                len(self.sides))
+    return self._connectedElemsForSide
+
+  # For each side, the elements on either side as a (numSides,2) array,
+  # with -1 in column 1 for boundary sides
+  @property
+  def sideToElems(self):
+    if self._sideToElems is None:
+      from CompressedMesh2D import sideElemPairs
+      self._sideToElems = sideElemPairs(self.elemToEdgesMap, len(self.sides))
+    return self._sideToElems
+
+  # For each element, the neighbors across its sides (a,b), (b,c), (c,a)
+  # as a (numElems,3) array, with -1 on the boundary
+  @property
+  def elemNeighbors(self):
+    if self._elemNeighbors is None:
+      from CompressedMesh2D import elemNeighborArray
+      self._elemNeighbors = elemNeighborArray(self.elemToEdgesMap,
+                                              self.sideToElems)
+    return self._elemNeighbors
+
+  # Whether each side is on the boundary
+  @property
+  def isBoundarySide(self):
+    return self.sideToElems[:,1] < 0
+
+  # Indices of the boundary sides
+  @property
+  def boundarySides(self):
+    return np.flatnonzero(self.isBoundarySide)
+
+  # Index of the labeled sides and their vertices (see BoundaryIndex)
+  @property
+  def boundaryIndex(self):
+    if self._boundaryIndex is None:
+      from BoundaryIndex import BoundaryIndex
+      self._boundaryIndex = BoundaryIndex(self.sides, self.sideLabels)
+    return self._boundaryIndex
+
+  # Install a boundary index computed elsewhere, such as by a refiner that
+  # carries the index over from the coarse mesh. Call this after the mesh
+  # is complete, since any modification discards the index.
+  def setBoundaryIndex(self, index):
+    self._boundaryIndex = index
+
+  # Discard the derived connectivity after a modification
+  def invalidateTopology(self):
+    self._elemToEdgesMap = None
+    self._connectedElemsForVert = None
+    self._connectedElemsForSide = None
+    self._sideToElems = None
+    self._elemNeighbors = None
+    self._boundaryIndex = None
+
 
   # Add a new vertex to the mesh. Vertex is input as (x,y) or [x,y]
   def addVertex(self, vert):
@@ -82,8 +178,7 @@ class LoadableMesh2D:
       # Store the mapping (x,y) <==> index
       self.vertToIndexMap[v] = vertIndex
       self.verts.append(v)
-      # Allocate an empty set for the set of connected elements
-      self.connectedElemsForVert.append(set())
+      self.invalidateTopology()
 
     # Return the index assigned to this vertex
     return vertIndex
@@ -100,9 +195,7 @@ class LoadableMesh2D:
     # Set up the mappings (p,q) <==> index
     self.sides.append(s)
     self.sideToIndexMap[s] = index
-
-    # Allocate an empty set for the set of connected elements
-    self.connectedElemsForSide.append(set())
+    self.invalidateTopology()
 
     # Put this side in the set of sides associated with its label.
     # If that set doesn't exist yet, create it
@@ -127,44 +220,126 @@ class LoadableMesh2D:
     # Put the indices into a tuple
     abc = (a,b,c)
 
-    # Store the new element
-    self.elems.append(abc)
-
-    # For each of the vertices, add this element to the vertex's
-    # set of connected elements
-    for v in abc:
-      # v is a vertex index
-      self.connectedElemsForVert[v].add(elemIndex)
-
-    # Add each of the element's sides to the list of sides, and then
-    # record that this element is attached to that side
-    edgeList = []
+    # Sanity check: the element's sides should have already been added
     for s in ( [a,b], [b,c], [c,a] ):
       # Sort the side's vertices
       s.sort()
-      # Sanity check: side should have already been added
       sKey = tuple(s)
       if sKey not in self.sideToIndexMap:
         raise RuntimeError('side (%d,%d) not in mesh' % sKey)
-      # Add this element to the side's set of connected elements
-      sideIndex = self.sideToIndexMap[sKey]
-      self.connectedElemsForSide[sideIndex].add(elemIndex)
-      # Record the three edges for this element
-      edgeList.append(sideIndex)
-    self.elemToEdgesMap.append(tuple(edgeList))
 
+    # Store the new element
+    self.elems.append(abc)
+    self.invalidateTopology()
 
     # Return the index assigned to this element
     return elemIndex
 
 
+  # ---- Bulk insertion. These functions add many entities at once, given
+  # as arrays, with the error checks done on whole arrays rather than one
+  # entity at a time. They return arrays of the assigned indices.
+
+  # Add an (N,2) array of vertices
+  def addVertices(self, verts):
+    verts = np.asarray(verts, dtype=np.float64).reshape(-1,2)
+    N = len(verts)
+    start = len(self.verts)
+
+    # Ensure that no vertex is a duplicate, within the new vertices or
+    # of vertices already in the mesh
+    if len(np.unique(verts, axis=0)) != N:
+      raise RuntimeError('Added duplicate vertices')
+    keys = list(map(tuple, verts.tolist()))
+    if start>0:
+      for v in keys:
+        if v in self.vertToIndexMap:
+          raise RuntimeError('Added vertex (%g,%g) twice' % v)
+
+    self.verts.extend(keys)
+    self.vertToIndexMap.update(zip(keys, range(start, start+N)))
+    self.invalidateTopology()
+
+    return np.arange(start, start+N)
+
+  # Add an (M,2) array of sides. The labels are given either as a single
+  # label for all the sides or as an array of M labels.
+  def addSides(self, sides, labels=0):
+    sides = np.sort(np.asarray(sides, dtype=np.int64).reshape(-1,2), axis=1)
+    M = len(sides)
+    start = len(self.sides)
+    labels = np.asarray(labels)
+    if labels.ndim==0:
+      labels = np.full(M, labels)
+
+    keys = list(map(tuple, sides.tolist()))
+    self.sides.extend(keys)
+    self.sideToIndexMap.update(zip(keys, range(start, start+M)))
+    self.invalidateTopology()
+
+    # Index the new sides now, while they're in an array, unless sides
+    # added one at a time are waiting to be indexed before them
+    if self._numIndexedSides==start:
+      self._sideKeyIndex.add(sides[:,0], sides[:,1], start)
+      self._numIndexedSides = start + M
+
+    # Put the sides in the sets associated with their labels
+    if M>0:
+      uniqueLabels, inv = np.unique(labels, return_inverse=True)
+      order = np.argsort(inv, kind='stable')
+      bounds = np.searchsorted(inv[order], np.arange(len(uniqueLabels)+1))
+      for i,label in enumerate(uniqueLabels.tolist()):
+        indices = (start + order[bounds[i]:bounds[i+1]]).tolist()
+        if not label in self.sideSets:
+          self.sideSets[label] = set(indices)
+        else:
+          self.sideSets[label].update(indices)
+
+    self.sideLabels.extend(labels.tolist())
+
+    return np.arange(start, start+M)
+
+  # Add a (K,3) array of elements, each with CCW ordered vertices. All the
+  # elements' sides must already be in the mesh.
+  def addElems(self, elems):
+    elems = np.asarray(elems, dtype=np.int64).reshape(-1,3)
+    K = len(elems)
+    start = len(self.elems)
+    elemIndices = np.arange(start, start+K)
+
+    # Index the sides added since the last lookup
+    if self._numIndexedSides < len(self.sides):
+      newSides = np.array(self.sides[self._numIndexedSides:],
+                          dtype=np.int64).reshape(-1,2)
+      self._sideKeyIndex.add(newSides[:,0], newSides[:,1],
+                             self._numIndexedSides)
+      self._numIndexedSides = len(self.sides)
+
+    # Look up the sides (a,b), (b,c), (c,a) of each element. This raises
+    # a RuntimeError if any side isn't in the mesh.
+    edges = self._sideKeyIndex.find(elems[:,[0,1,2]].ravel(),
+                                    elems[:,[1,2,0]].ravel()).reshape(-1,3)
+
+    # The edges were found anyway, so keep them if the map for the
+    # elements already in the mesh is up to date
+    edgeMap = self._elemToEdgesMap if start>0 else []
+    self.elems.extend(map(tuple, elems.tolist()))
+    self.invalidateTopology()
+    if edgeMap is not None:
+      edgeMap.extend(map(tuple, edges.tolist()))
+      self._elemToEdgesMap = edgeMap
+
+    return elemIndices
+
   # Look up the label for a side
   def getSideLabel(self, side):
-    sideIndex = self.sideToIndexMap[side]
-    for label, ss in self.sideSets.items():
-      if sideIndex in ss:
-        return label
-    return 0
+    return self.sideLabels[self.sideToIndexMap[side]]
+
+  # Write the mesh into an immutable CompressedMesh2D with array storage
+  def compile(self):
+    from CompressedMesh2D import CompressedMesh2D
+    return CompressedMesh2D(self.verts, self.elems, self.sides,
+                            self.sideLabels, self._elemToEdgesMap)
 
   # Dump the internal data
   def dump(self):
@@ -185,6 +360,63 @@ class LoadableMesh2D:
     for label, sides in self.sideSets.items():
       print('\tlabel=', label, ' sides', sides)
 
+# For each vertex (or side), the set of elements attached to it, given the
+# vertices (or sides) of each element
+def cofacetSets(conn, numTargets):
+  from CompressedMesh2D import cofacetsCSR
+  if len(conn)==0:
+    return [set() for i in range(numTargets)]
+  csr = cofacetsCSR(np.asarray(conn, dtype=np.int64).reshape(-1,3), numTargets)
+  offsets = csr.offsets.tolist()
+  owners = csr.indices.tolist()
+  return [set(owners[offsets[i]:offsets[i+1]]) for i in range(numTargets)]
+
+# Sorted index of sides for vectorized lookups by vertex pair, built up
+# batch by batch. The index is kept as a few sorted runs, oldest first. A
+# new batch is merged with the runs before it that are no longer than it,
+# so there are at most log2(numSides) runs, and each side is re-sorted
+# O(log(numSides)) times however many batches the mesh is built from.
+class SideKeyIndex:
+
+  def __init__(self):
+    # List of (sorted keys, side indices) pairs
+    self.runs = []
+
+  # The key of side (p,q), independent of the vertex order and of the
+  # number of vertices in the mesh
+  @staticmethod
+  def keys(p, q):
+    p = np.asarray(p, dtype=np.int64)
+    q = np.asarray(q, dtype=np.int64)
+    return (np.minimum(p,q) << 32) | np.maximum(p,q)
+
+  # Add sides p[i]-q[i], numbered consecutively from start
+  def add(self, p, q, start):
+    keys = SideKeyIndex.keys(p, q)
+    indices = np.arange(start, start+len(keys), dtype=np.int64)
+    while len(self.runs)>0 and len(self.runs[-1][0]) <= len(keys):
+      runKeys, runIndices = self.runs.pop()
+      keys = np.concatenate([runKeys, keys])
+      indices = np.concatenate([runIndices, indices])
+    order = np.argsort(keys, kind='stable')
+    self.runs.append((keys[order], indices[order]))
+
+  # Indices of sides a[i]-b[i]. If a side was added more than once, the
+  # first index is returned. Raises RuntimeError if any side is missing.
+  def find(self, a, b):
+    want = SideKeyIndex.keys(a, b)
+    found = np.full(want.shape, -1, dtype=np.int64)
+    for runKeys, runIndices in self.runs:
+      pos = np.minimum(np.searchsorted(runKeys, want), len(runKeys)-1)
+      hit = (runKeys[pos]==want) & (found<0)
+      found[hit] = runIndices[pos[hit]]
+    missing = np.flatnonzero(found<0)
+    if len(missing)>0:
+      p = int(np.asarray(a).ravel()[missing[0]])
+      q = int(np.asarray(b).ravel()[missing[0]])
+      raise RuntimeError('side (%d,%d) not in mesh' % (min(p,q), max(p,q)))
+    return found
+
 # ------------------------------------------------------------------------
 # Create a simple two-element square for use in testing
 #
@@ -251,3 +483,30 @@ if __name__=='__main__':
 
   mesh = TwoElemSquare()
   mesh.dump()
+
+  # Building a mesh from many batches gives the same mesh as building it
+  # from one, and the cost of a batch doesn't grow with the mesh
+  import time
+  from UniformRectangleMesher import UniformRectangleMesher
+  whole = UniformRectangleMesher(0.0, 1.0, 300, 0.0, 1.0, 300)
+  verts = np.array(whole.verts)
+  sides = np.array(whole.sides)
+  labels = np.array(whole.sideLabels)
+  elems = np.array(whole.elems)
+
+  for numBatches in (1, 10, 100):
+    start = time.perf_counter()
+    mesh = LoadableMesh2D()
+    for chunk in np.array_split(np.arange(len(verts)), numBatches):
+      mesh.addVertices(verts[chunk])
+    for chunk in np.array_split(np.arange(len(sides)), numBatches):
+      mesh.addSides(sides[chunk], labels[chunk])
+    for chunk in np.array_split(np.arange(len(elems)), numBatches):
+      mesh.addElems(elems[chunk])
+    t = time.perf_counter() - start
+    same = (mesh.verts==whole.verts and mesh.sides==whole.sides
+            and mesh.elems==whole.elems
+            and mesh.elemToEdgesMap==whole.elemToEdgesMap)
+    print('%4d batches: %.3f s, identical=%s' % (numBatches, t, same))
+    if not same:
+      raise RuntimeError('batched mesh differs')
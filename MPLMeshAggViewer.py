@@ -1,14 +1,24 @@
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, EllipseCollection
 import numpy as np
-from math import sqrt
 from LoadableMesh2D import *
 import random
 
 # --------------------------------------------------------------------------
 # A class for writing annotated meshes to Matplotlib.
 #
-# Katharine Long, Sep 2020
-# For Math 5344
+# Vertices are colored by the aggregate they belong to. The aggregate for
+# each vertex is looked up in an index array computed once from the list
+# of aggregates. If a vertex appears in more than one aggregate, the last
+# one wins. The mesh is drawn with collections: one for the sides and one
+# for the vertex circles. Vertex index labels are drawn only for meshes with
+# at most labelThreshold vertices.
+#
+# save() and saveBatch() render with the Agg backend on figures that are
+# not registered with pyplot, so batch export doesn't accumulate figures
+# or disturb pyplot's current figure.
 # --------------------------------------------------------------------------
 
 def getDistinctColors(n):
@@ -18,12 +28,22 @@ def getDistinctColors(n):
         colors.append(color[0])
     return colors
 
+# Index array giving the aggregate containing each vertex, or -1 for
+# vertices in no aggregate
+def vertexToAggregate(numVerts, aggregates):
+    aggOf = -np.ones(numVerts, dtype=np.int64)
+    for j,c in enumerate(aggregates):
+        aggOf[np.fromiter(c, dtype=np.int64, count=len(c))] = j
+    return aggOf
+
 class MPLMeshAggViewer:
 
-    def __init__(self, aggregates=[], fontSize=16, vertRad=0.06, colors=None):
+    def __init__(self, aggregates=[], fontSize=16, vertRad=0.06, colors=None,
+                 labelThreshold=1000):
         self.fontSize = fontSize
         self.vertRad = vertRad
         self.aggregates = aggregates
+        self.labelThreshold = labelThreshold
         if colors is None:
             self.colors = getDistinctColors(len(aggregates))
         else:
@@ -31,71 +51,91 @@ class MPLMeshAggViewer:
 
     def show(self, mesh):
         ax = plt.axes()
-
-        for i,v in enumerate(mesh.verts):
-            vertColor = 'lightgray'
-            # Calculate vertColor
-            for j,c in enumerate(self.aggregates):
-                if i in c:
-                    vertColor = self.colors[j]
-
-            self.addVert(ax, i, v, vertColor=vertColor)
-
-        for i,e in enumerate(mesh.elems):
-            self.addElem(ax, mesh, i, e)
-
-        ax.set_aspect('equal')
-        ax.autoscale_view()
-
+        self.draw(ax, mesh, self.aggregates, self.colors, 'lightgray')
         plt.show()
 
     def save(self, mesh, fname):
-        ax = plt.axes()
-
-        for i,v in enumerate(mesh.verts):
-            vertColor = 'white'
-            # Calculate vertColor
-            for j,c in enumerate(self.aggregates):
-                if i in c:
-                    vertColor = self.colors[j]
-
-            self.addVert(ax, i, v, vertColor=vertColor)
-
-        for i,e in enumerate(mesh.elems):
-            self.addElem(ax, mesh, i, e)
-
-        ax.set_aspect('equal')
-        ax.autoscale_view()
-        figure = plt.gcf()
-        figure.set_size_inches(8,8)
-        plt.savefig(fname, dpi=100)
-
+        self.saveFigure(mesh, self.aggregates, self.colors, fname)
+
+    # Render a sequence of aggregations, such as one per AMG level, to image
+    # files. Each snapshot is a (mesh, aggregates) pair. If colors aren't
+    # given, each snapshot gets its own set of random colors.
+    def saveBatch(self, snapshots, fnames, colors=None):
+        if len(fnames) != len(snapshots):
+            raise ValueError('got %d file names for %d snapshots'
+                % (len(fnames), len(snapshots)))
+        if colors is not None and len(colors) != len(snapshots):
+            raise ValueError('got %d color lists for %d snapshots'
+                % (len(colors), len(snapshots)))
+        for k, ((mesh, aggregates), fname) in enumerate(zip(snapshots, fnames)):
+            if colors is None:
+                aggColors = getDistinctColors(len(aggregates))
+            else:
+                aggColors = colors[k]
+            self.saveFigure(mesh, aggregates, aggColors, fname)
+
+    # Draw a single vertex as a labeled circle
     def addVert(self, ax, index, xy, vertColor='lightgray'):
         circle = plt.Circle(xy, radius=self.vertRad, fc=vertColor, ec='black')
         ax.add_patch(circle)
         ax.annotate(index.__str__(), xy, ha='center',
             va='center', fontsize=self.fontSize)
 
+    # Draw the three sides of a single element
     def addElem(self, ax, mesh, index, abc):
-        A = np.array(mesh.verts[abc[0]])
-        B = np.array(mesh.verts[abc[1]])
-        C = np.array(mesh.verts[abc[2]])
-
-        pairs = [[abc[0], abc[1]], [abc[1], abc[2]], [abc[2], abc[0]]]
-
-        for p in pairs:
-            p.sort()
-            q = tuple(p)
-            # label = mesh.getSideLabel(q)
+        # Only the element's corners are needed, not the whole vertex array
+        verts = np.array([mesh.verts[v] for v in abc], dtype=np.float64)
+        sides = np.array([[0, 1], [1, 2], [2, 0]])
+        ax.add_collection(LineCollection(self.sideSegments(verts, sides),
+                                         colors='black'))
+
+    # ---- Functions past this point are for internal use
+
+    # Render to a file using a figure that pyplot doesn't manage
+    def saveFigure(self, mesh, aggregates, colors, fname):
+        figure = Figure(figsize=(8,8))
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot()
+        self.draw(ax, mesh, aggregates, colors, 'white')
+        figure.savefig(fname, dpi=100)
+
+    # Draw the mesh with its vertices colored by aggregate
+    def draw(self, ax, mesh, aggregates, colors, background):
+        verts = np.asarray(mesh.verts, dtype=np.float64).reshape(-1,2)
+        aggOf = vertexToAggregate(len(verts), aggregates)
+        palette = np.array(list(colors) + [background], dtype=object)
+        vertColors = list(palette[aggOf])
+
+        sides = np.asarray(mesh.sides, dtype=np.int64).reshape(-1,2)
+        ax.add_collection(LineCollection(self.sideSegments(verts, sides),
+                                         colors='black'))
+
+        # Vertex circles, with the radius in data units
+        diam = np.full(len(verts), 2.0*self.vertRad)
+        circles = EllipseCollection(diam, diam, np.zeros(len(verts)),
+            units='xy', offsets=verts, offset_transform=ax.transData,
+            facecolors=vertColors, edgecolors='black', zorder=2)
+        ax.add_collection(circles)
+
+        if len(verts) <= self.labelThreshold:
+            for i,xy in enumerate(verts):
+                ax.annotate(str(i), xy, ha='center', va='center',
+                    fontsize=self.fontSize, zorder=3)
+
+        ax.update_datalim(verts - self.vertRad)
+        ax.update_datalim(verts + self.vertRad)
+        ax.set_aspect('equal')
+        ax.autoscale_view()
 
-            P1 = np.array(mesh.verts[q[0]])
-            P2 = np.array(mesh.verts[q[1]])
-            P12 = P2-P1
-            PUnit = P12/sqrt(np.dot(P12,P12))
-            p1 = P1 + self.vertRad*PUnit
-            p2 = P2 - self.vertRad*PUnit
-            line = plt.Line2D((p1[0],p2[0]), (p1[1], p2[1]),color='black')
-            ax.add_line(line)
+    # Line segments for the sides, shortened so they stop at the vertex
+    # circles
+    def sideSegments(self, verts, sides):
+        P1 = verts[sides[:,0]]
+        P2 = verts[sides[:,1]]
+        P12 = P2 - P1
+        PUnit = P12/np.sqrt(np.sum(P12*P12, axis=1))[:,None]
+        return np.stack([P1 + self.vertRad*PUnit, P2 - self.vertRad*PUnit],
+                        axis=1)
 
 
 if __name__=='__main__':
@@ -105,3 +145,14 @@ if __name__=='__main__':
     agg = [{0}, {1}, {2}, {3}]
     viewer = MPLMeshAggViewer(aggregates=agg, vertRad=0.05, fontSize=14)
     viewer.show(mesh)
+
+    # Batch export of a sequence of aggregations
+    from UniformTriangularRefinement import UniformTriangularRefinement
+    fine, up, down = UniformTriangularRefinement(mesh)
+    snapshots = [(fine, [{0,4,5,8}, {1,3}, {2,6,7}]), (mesh, [{0,1}, {2,3}])]
+    viewer.saveBatch(snapshots, ['agg-level1.png', 'agg-level0.png'])
+    try:
+        viewer.saveBatch(snapshots, ['agg-level1.png'])
+        raise RuntimeError('saveBatch accepted too few file names')
+    except ValueError as e:
+        print('saveBatch: %s' % e)
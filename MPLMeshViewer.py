@@ -1,4 +1,5 @@
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import numpy as np
 from math import sqrt
 from LoadableMesh2D import *
@@ -6,6 +7,13 @@ from LoadableMesh2D import *
 # --------------------------------------------------------------------------
 # A class for writing annotated meshes to Matplotlib.
 #
+# Small meshes are drawn with every vertex as a circle and every vertex and
+# element labeled by its index. Meshes with more than fastThreshold elements
+# are drawn in a fast mode: all sides are drawn once in a single
+# LineCollection colored by side label, and all vertices in a single
+# scatter plot. Index labels are drawn in fast mode only if the mesh has
+# no more than labelThreshold elements.
+#
 # Katharine Long, Sep 2020
 # For Math 5344
 # --------------------------------------------------------------------------
@@ -14,15 +22,31 @@ class MPLMeshViewer:
 
     def __init__(self, fontSize=16, vertRad=0.06,
             colors=['black','blue','red','seagreen', 'orangered','dodgerblue',
-                'forestgreen']):
+                'forestgreen'], fastThreshold=2000, labelThreshold=200,
+            pointSize=4):
         self.fontSize = fontSize
         self.vertRad = vertRad
         self.colors = colors
+        self.fastThreshold = fastThreshold
+        self.labelThreshold = labelThreshold
+        self.pointSize = pointSize
 
+    # Show the mesh. Set fast to True or False to choose the drawing mode;
+    # by default it's chosen from the mesh size.
     def show(self, mesh, marked=[], markedColor='skyblue',
-      unmarkedColor='lightgray'):
+      unmarkedColor='lightgray', fast=None):
         ax = plt.axes()
 
+        if fast is None:
+            fast = len(mesh.elems) > self.fastThreshold
+
+        if fast:
+            self.addMeshFast(ax, mesh, marked, markedColor, unmarkedColor)
+            ax.set_aspect('equal')
+            ax.autoscale_view()
+            plt.show()
+            return
+
         for i,v in enumerate(mesh.verts):
             if i in marked:
               vertColor = markedColor
@@ -39,6 +63,39 @@ class MPLMeshViewer:
         plt.show()
 
 
+    # Draw the whole mesh with collections
+    def addMeshFast(self, ax, mesh, marked=[], markedColor='skyblue',
+      unmarkedColor='lightgray'):
+        verts = np.asarray(mesh.verts, dtype=np.float64).reshape(-1,2)
+        elems = np.asarray(mesh.elems, dtype=np.int64).reshape(-1,3)
+        sides = np.asarray(mesh.sides, dtype=np.int64).reshape(-1,2)
+        labels = np.asarray(mesh.sideLabels, dtype=np.int64)
+
+        # Every side once, colored by its label
+        colors = np.array(self.colors, dtype=object)
+        lines = LineCollection(verts[sides],
+            colors=list(colors[labels % len(colors)]), linewidths=0.5)
+        ax.add_collection(lines)
+
+        # All vertices in one scatter plot
+        isMarked = np.zeros(len(verts), dtype=bool)
+        if len(marked)>0:
+            isMarked[np.fromiter(marked, dtype=np.int64)] = True
+        vertColors = np.where(isMarked, markedColor, unmarkedColor)
+        ax.scatter(verts[:,0], verts[:,1], s=self.pointSize, c=vertColors,
+            edgecolors='none', zorder=2)
+
+        # Index labels, only if there are few enough of them to read
+        if len(elems) <= self.labelThreshold:
+            for i,xy in enumerate(verts):
+                ax.annotate(str(i), xy, ha='center', va='center',
+                    fontsize=self.fontSize)
+            for i,centroid in enumerate(verts[elems].mean(axis=1)):
+                ax.annotate(str(i), centroid, ha='center', va='center',
+                    fontsize=self.fontSize)
+
+        ax.update_datalim(verts)
+
     def addVert(self, ax, index, xy, vertColor='lightgray'):
         circle = plt.Circle(xy, radius=self.vertRad, fc=vertColor, ec='black')
         ax.add_patch(circle)
@@ -0,0 +1,241 @@
+import json
+import os
+import numpy as np
+from CompressedMesh1D import CompressedMesh1D
+from CompressedMesh2D import CompressedMesh2D
+
+# --------------------------------------------------------------------------
+# A native binary file format for caching meshes on disk.
+#
+# saveMesh() writes a LoadableMesh1D/2D or CompressedMesh1D/2D to a single
+# file, and loadMesh() reads it back as a CompressedMesh1D/2D. By default
+# the arrays are opened with numpy.memmap, so loading is effectively
+# instant regardless of mesh size: pages are read from disk only when
+# they're touched, and processes that open the same file share the
+# operating system's page cache rather than each holding a copy.
+#
+# File layout:
+# --- 8 byte magic string b'PYMESH\x00\x01'
+# --- 8 byte little-endian unsigned length of the JSON header
+# --- JSON header with the mesh dimension and, for each array, its dtype,
+#     shape, and byte offset relative to the start of the data section
+# --- padding so that the data section starts on a 64 byte boundary
+# --- the raw arrays in C order, each starting on a 64 byte boundary
+#
+# Side sets aren't stored separately, since they're determined by the
+# side labels. Labels must be integers.
+#
+# cachedMesh() puts the two together: it loads the cache file if it's
+# newer than the files the mesh was made from, and otherwise builds the
+# mesh and rewrites the cache. Files are replaced rather than rewritten in
+# place, so a process still mapping the old file keeps reading valid data.
+# --------------------------------------------------------------------------
+
+magic = b'PYMESH\x00\x01'
+alignment = 64
+
+# Names of the arrays stored for each mesh dimension, in file order
+arrayNames = {
+    1 : ('verts', 'elems', 'vertLabels', 'elemLabels'),
+    2 : ('verts', 'elems', 'sides', 'sideLabels', 'elemToEdgesMap')
+}
+
+# Dtypes of the stored arrays
+arrayTypes = {
+    'verts' : '<f8', 'elems' : '<i4', 'sides' : '<i4', 'elemToEdgesMap' : '<i4',
+    'sideLabels' : '<i4', 'vertLabels' : '<i4', 'elemLabels' : '<i4'
+}
+
+
+def _alignUp(n):
+    return (n + alignment - 1)//alignment*alignment
+
+
+# Collect the arrays to be stored for a mesh
+def meshArrays(mesh):
+    arrays = {}
+    for name in arrayNames[mesh.dim]:
+        a = np.asarray(getattr(mesh, name))
+        if name.endswith('Labels') and a.dtype.kind not in 'iub' and len(a)>0:
+            raise ValueError('mesh cache requires integer labels, got %s'
+                % a.dtype)
+        arrays[name] = np.ascontiguousarray(a, dtype=arrayTypes[name])
+    if mesh.dim==2:
+        arrays['sides'] = np.sort(arrays['sides'].reshape(-1,2), axis=1)
+    return arrays
+
+
+# Write a mesh to the named file
+def saveMesh(mesh, filename):
+
+    if mesh.dim not in arrayNames:
+        raise ValueError('mesh dimension %d not supported' % mesh.dim)
+
+    arrays = meshArrays(mesh)
+
+    # Lay out the arrays in the data section
+    offset = 0
+    entries = {}
+    for name in arrayNames[mesh.dim]:
+        a = arrays[name]
+        entries[name] = {'dtype' : a.dtype.str, 'shape' : list(a.shape),
+                         'offset' : offset}
+        offset = _alignUp(offset + a.nbytes)
+
+    header = json.dumps({'dim' : mesh.dim, 'arrays' : entries}).encode('utf-8')
+    dataStart = _alignUp(len(magic) + 8 + len(header))
+
+    tmpName = filename + '.tmp'
+    with open(tmpName, 'wb') as f:
+        f.write(magic)
+        f.write(np.array([len(header)], dtype='<u8').tobytes())
+        f.write(header)
+        f.write(b'\0'*(dataStart - f.tell()))
+        for name in arrayNames[mesh.dim]:
+            a = arrays[name]
+            start = dataStart + entries[name]['offset']
+            f.write(b'\0'*(start - f.tell()))
+            if a.nbytes>0:
+                f.write(memoryview(a).cast('B'))
+    os.replace(tmpName, filename)
+
+
+# Read a mesh from the named file. If mmap is True, the mesh's arrays are
+# read-only memory maps of the file; otherwise they're read into memory.
+def loadMesh(filename, mmap=True):
+
+    with open(filename, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise RuntimeError('%s is not a PyMesh cache file' % filename)
+        headerLen = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(headerLen).decode('utf-8'))
+    dataStart = _alignUp(len(magic) + 8 + headerLen)
+
+    dim = header['dim']
+    arrays = {}
+    for name in arrayNames[dim]:
+        entry = header['arrays'][name]
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        offset = dataStart + entry['offset']
+        count = int(np.prod(shape))
+        if count==0:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        elif mmap:
+            arrays[name] = np.memmap(filename, dtype=dtype, mode='r',
+                offset=offset, shape=shape)
+        else:
+            arrays[name] = np.fromfile(filename, dtype=dtype, count=count,
+                offset=offset).reshape(shape)
+
+    if dim==1:
+        return CompressedMesh1D(arrays['verts'], arrays['elems'],
+            arrays['vertLabels'], arrays['elemLabels'])
+    return CompressedMesh2D(arrays['verts'], arrays['elems'], arrays['sides'],
+        arrays['sideLabels'], arrays['elemToEdgesMap'], sidesSorted=True)
+
+
+# Load the mesh cached in the named file, or if the file is missing, isn't
+# a cache file, or is older than any of the source files, call build() to
+# make the mesh and cache it first.
+def cachedMesh(filename, build, sources=(), mmap=True):
+    if not isFresh(filename, sources):
+        saveMesh(build(), filename)
+    return loadMesh(filename, mmap)
+
+
+# Whether the named cache file exists, is a cache file, and is at least as
+# new as each of the source files
+def isFresh(filename, sources=()):
+    if not os.path.exists(filename):
+        return False
+    with open(filename, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            return False
+    mtime = os.path.getmtime(filename)
+    for src in sources:
+        if os.path.getmtime(src) > mtime:
+            return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Test code
+
+if __name__=='__main__':
+
+    from LoadableMesh1D import FourElemLine
+    from LoadableMesh2D import TwoElemSquare
+    from TriangleMeshReader import TriangleMeshReader
+
+    import mmap as mmapModule
+
+    # The mesh constructors take views, which are plain arrays, so look for
+    # the file mapping at the bottom of the chain of bases
+    def isMapped(a):
+        while a is not None:
+            if isinstance(a, (np.memmap, mmapModule.mmap)):
+                return True
+            a = getattr(a, 'base', None)
+        return False
+
+    # Every stored array comes back equal, and memory-mapped read-only
+    def checkRoundTrip(mesh, filename):
+        saveMesh(mesh, filename)
+        expected = meshArrays(mesh)
+        for mmap in (True, False):
+            loaded = loadMesh(filename, mmap)
+            for name in arrayNames[mesh.dim]:
+                a = getattr(loaded, name)
+                if not np.array_equal(a, expected[name]):
+                    raise RuntimeError('%s: %s differs' % (filename, name))
+                if a.dtype != np.dtype(arrayTypes[name]):
+                    raise RuntimeError('%s: %s has dtype %s'
+                        % (filename, name, a.dtype))
+                if a.flags.writeable:
+                    raise RuntimeError('%s: %s is writeable' % (filename, name))
+                if mmap and a.size>0 and not isMapped(a):
+                    raise RuntimeError('%s: %s is not memory-mapped'
+                        % (filename, name))
+        print('%s: round trip ok' % filename)
+        return loaded
+
+    checkRoundTrip(TwoElemSquare(), 'twoElemSquare.pymesh').dump()
+    checkRoundTrip(FourElemLine(), 'fourElemLine.pymesh').dump()
+    reader = TriangleMeshReader('TestMeshes/oneHole.1')
+    checkRoundTrip(reader.getMesh(), 'oneHole.pymesh')
+
+    # Cache miss: the mesh is built once, then loaded from the file
+    builds = []
+    def build():
+        builds.append(1)
+        return TriangleMeshReader('TestMeshes/oneHole.1').getMesh()
+    sources = ['TestMeshes/oneHole.1.node', 'TestMeshes/oneHole.1.ele']
+    cacheName = 'oneHoleCached.pymesh'
+    if os.path.exists(cacheName):
+        os.remove(cacheName)
+    first = cachedMesh(cacheName, build, sources)
+    second = cachedMesh(cacheName, build, sources)
+    if len(builds)!=1 or not isMapped(second.verts):
+        raise RuntimeError('cache miss then hit built %d times' % len(builds))
+    print('cache miss and hit ok')
+
+    # Stale file: a source newer than the cache, or a file that isn't a
+    # cache file, forces a rebuild
+    old = min(os.path.getmtime(src) for src in sources) - 10.0
+    os.utime(cacheName, (old, old))
+    third = cachedMesh(cacheName, build, sources)
+    with open(cacheName, 'wb') as f:
+        f.write(b'not a mesh')
+    fourth = cachedMesh(cacheName, build, sources)
+    if len(builds)!=3 or not np.array_equal(fourth.elems, first.elems):
+        raise RuntimeError('stale cache rebuilt %d times' % (len(builds)-1))
+    try:
+        with open(cacheName, 'wb') as f:
+            f.write(b'not a mesh')
+        loadMesh(cacheName)
+        raise RuntimeError('loaded a file that is not a cache file')
+    except RuntimeError as e:
+        if 'not a PyMesh cache file' not in str(e):
+            raise
+    print('stale cache ok')
@@ -0,0 +1,496 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import breadth_first_order, laplacian
+from scipy.sparse.linalg import eigsh, ArpackNoConvergence
+
+# --------------------------------------------------------------------------
+# Partitioning of the elements of a triangular mesh into parts of equal size
+# with few cut sides, for distributing a mesh across processes.
+#
+# Three partitioners are provided. Each returns an array giving the part
+# number of every element.
+#
+# --- partitionRCB: recursive coordinate bisection. The element centroids
+#     are split at the median along the longer axis of their bounding box,
+#     recursively.
+# --- partitionRIB: recursive inertial bisection. Like RCB, but the split is
+#     along the principal axis of the centroids, so it isn't tied to the
+#     coordinate directions.
+# --- partitionMultilevel: multilevel recursive bisection of the element
+#     dual graph, in which elements sharing a side are neighbors. The graph
+#     is coarsened by repeatedly merging pairs of neighbors joined by heavy
+#     edges until it has a few hundred nodes. The coarsest graph is bisected
+#     spectrally, along straight lines, or by growing a region from a few
+#     seeds, and the bisection is projected back through the levels with a
+#     vectorized boundary refinement at each one. This follows the
+#     connectivity rather than the coordinates, so it adapts to irregular
+#     domains and graded meshes. Since the refinement can't straighten a
+#     ragged cut, refined straight cuts of the full graph compete with the
+#     multilevel one, so on nearly uniform meshes the result is about as
+#     good as RCB's.
+#
+# The number of parts needn't be a power of two. partitionMetrics() reports
+# the edge cut and imbalance of a partition, and extractPart() builds one
+# part as a CompressedMesh2D with its local-to-global vertex and element
+# maps.
+# --------------------------------------------------------------------------
+
+def partitionRCB(mesh, numParts):
+    def axis(points):
+        d = np.argmax(points.max(axis=0) - points.min(axis=0))
+        return points[:,d]
+    return recursiveBisection(elementCentroids(mesh), numParts, axis)
+
+
+def partitionRIB(mesh, numParts):
+    def axis(points):
+        centered = points - points.mean(axis=0)
+        w, v = np.linalg.eigh(centered.T.dot(centered))
+        return centered.dot(v[:,-1])
+    return recursiveBisection(elementCentroids(mesh), numParts, axis)
+
+
+# Multilevel partition of the dual graph. The allowed imbalance is the
+# fraction by which a part's size may exceed its target; seed fixes the
+# random tie-breaking in the coarsening and the choice of seeds.
+def partitionMultilevel(mesh, numParts, imbalance=0.03, seed=0):
+    A = elementDualGraph(mesh)
+    parts = np.zeros(A.shape[0], dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    # Each level of bisection gets an equal share of the allowed imbalance
+    depth = max(1, int(np.ceil(np.log2(numParts))))
+    splitGraph(A, np.ones(A.shape[0]), elementCentroids(mesh),
+               np.arange(A.shape[0]), numParts, 0, parts,
+               (1.0 + imbalance)**(1.0/depth) - 1.0, rng)
+    return parts
+
+
+# The element dual graph as a symmetric CSR matrix, with an entry of 1 for
+# every pair of elements sharing a side
+def elementDualGraph(mesh):
+    elemEdges = np.asarray(mesh.elemToEdgesMap, dtype=np.int64).reshape(-1,3)
+    numElems = len(elemEdges)
+    sideOf = elemEdges.ravel()
+    elemOf = np.repeat(np.arange(numElems), 3)
+    order = np.argsort(sideOf, kind='stable')
+    sideOf = sideOf[order]
+    elemOf = elemOf[order]
+    # Consecutive entries for the same side are the two elements sharing it
+    shared = np.flatnonzero(sideOf[1:]==sideOf[:-1])
+    e0 = elemOf[shared]
+    e1 = elemOf[shared+1]
+    ones = np.ones(2*len(shared))
+    return sp.csr_matrix((ones, (np.concatenate([e0,e1]),
+                                 np.concatenate([e1,e0]))),
+                         shape=(numElems, numElems))
+
+
+# Quality of a partition: the number of sides cut, the size of each part,
+# the imbalance (largest part over the average part), and the number of
+# vertices shared between parts
+def partitionMetrics(mesh, parts):
+    parts = np.asarray(parts)
+    A = sp.triu(elementDualGraph(mesh)).tocoo()
+    cut = int(np.sum(parts[A.row] != parts[A.col]))
+    numParts = int(parts.max())+1 if len(parts)>0 else 0
+    sizes = np.bincount(parts, minlength=numParts)
+
+    elems = np.asarray(mesh.elems, dtype=np.int64).reshape(-1,3)
+    pairs = np.unique(np.column_stack([elems.ravel(), np.repeat(parts, 3)]),
+                      axis=0)
+    sharedVerts = int(np.sum(np.bincount(pairs[:,0]) > 1))
+
+    return {'edgeCut' : cut,
+            'partSizes' : sizes,
+            'imbalance' : float(sizes.max()/sizes.mean()) if numParts else 0.0,
+            'sharedVerts' : sharedVerts}
+
+
+# Extract part p as its own mesh. Returns (mesh, localToGlobalVerts,
+# localToGlobalElems). Sides keep their labels; if interfaceLabel is given,
+# sides on the boundary between parts get that label instead.
+def extractPart(mesh, parts, p, interfaceLabel=None):
+
+    from CompressedMesh2D import CompressedMesh2D
+
+    parts = np.asarray(parts)
+    verts = np.asarray(mesh.verts, dtype=np.float64).reshape(-1,2)
+    elems = np.asarray(mesh.elems, dtype=np.int64).reshape(-1,3)
+    sides = np.asarray(mesh.sides, dtype=np.int64).reshape(-1,2)
+    sideLabels = np.asarray(mesh.sideLabels)
+    elemEdges = np.asarray(mesh.elemToEdgesMap, dtype=np.int64).reshape(-1,3)
+
+    localElems = np.flatnonzero(parts==p)
+    localVerts = np.unique(elems[localElems])
+    localSides = np.unique(elemEdges[localElems])
+
+    globalToLocalVert = -np.ones(len(verts), dtype=np.int64)
+    globalToLocalVert[localVerts] = np.arange(len(localVerts))
+    globalToLocalSide = -np.ones(len(sides), dtype=np.int64)
+    globalToLocalSide[localSides] = np.arange(len(localSides))
+
+    labels = sideLabels[localSides].copy()
+    if interfaceLabel is not None:
+        # Sides with elements in more than one part are on the interface
+        sideOf = elemEdges.ravel()
+        partOf = np.repeat(parts, 3)
+        lo = np.full(len(sides), parts.max()+1)
+        hi = np.full(len(sides), -1)
+        np.minimum.at(lo, sideOf, partOf)
+        np.maximum.at(hi, sideOf, partOf)
+        interface = (lo != hi)[localSides]
+        labels = labels.astype(np.result_type(labels, np.asarray(interfaceLabel)))
+        labels[interface] = interfaceLabel
+
+    part = CompressedMesh2D(verts[localVerts],
+                            globalToLocalVert[elems[localElems]],
+                            globalToLocalVert[sides[localSides]],
+                            labels,
+                            globalToLocalSide[elemEdges[localElems]])
+
+    return (part, localVerts, localElems)
+
+
+# ---- Functions past this point are for internal use
+
+def elementCentroids(mesh):
+    verts = np.asarray(mesh.verts, dtype=np.float64).reshape(-1,2)
+    elems = np.asarray(mesh.elems, dtype=np.int64).reshape(-1,3)
+    return np.mean(verts[elems], axis=1)
+
+
+# Split points into numParts groups by recursive bisection along the axis
+# computed by axisFn, which returns a coordinate for each point. Groups
+# are sized in proportion to the number of parts they'll be split into.
+def recursiveBisection(points, numParts, axisFn):
+    parts = np.zeros(len(points), dtype=np.int64)
+    stack = [(np.arange(len(points)), numParts, 0)]
+    while stack:
+        idx, k, first = stack.pop()
+        if k==1 or len(idx)==0:
+            parts[idx] = first
+            continue
+        k0 = k//2
+        n0 = int(round(len(idx)*k0/float(k)))
+        order = np.argsort(axisFn(points[idx]), kind='stable')
+        stack.append((idx[order[:n0]], k0, first))
+        stack.append((idx[order[n0:]], k-k0, first+k0))
+    return parts
+
+
+# Split the graph A, whose nodes have weights vw, coordinates xy, and
+# global indices ids, into k parts numbered from first, writing them into
+# parts
+def splitGraph(A, vw, xy, ids, k, first, parts, imbalance, rng):
+    if k==1 or A.shape[0]<=1:
+        parts[ids] = first
+        return
+    k0 = k//2
+    side = multilevelBisection(A, vw, xy, k0/float(k), imbalance, rng)
+    for s, kk, ff in ((0, k0, first), (1, k-k0, first+k0)):
+        sub = np.flatnonzero(side==s)
+        splitGraph(A[sub][:,sub].tocsr(), vw[sub], xy[sub], ids[sub], kk, ff,
+                   parts, imbalance, rng)
+
+
+# Bisect a weighted graph so that side 0 gets about the given fraction of
+# the node weight. Returns a 0/1 array. The graph is coarsened until it has
+# at most coarsestSize nodes, or until coarsening stops making progress.
+def multilevelBisection(A, vw, xy, fraction, imbalance, rng, coarsestSize=200):
+
+    # Coarsen, carrying the weighted mean coordinates of the merged nodes
+    graphs = [(A, vw, xy)]
+    maps = []
+    while graphs[-1][0].shape[0] > coarsestSize:
+        A, vw, xy = graphs[-1]
+        Ac, vwc, cmap = coarsenGraph(A, vw, rng)
+        if Ac.shape[0] > 0.95*A.shape[0]:
+            break
+        xyc = np.column_stack([np.bincount(cmap, weights=vw*xy[:,d],
+                                           minlength=len(vwc))
+                               for d in range(xy.shape[1])])/vwc[:,None]
+        graphs.append((Ac, vwc, xyc))
+        maps.append(cmap)
+
+    # Bisect the coarsest graph, keeping the best of several candidates
+    Ac, vwc, xyc = graphs[-1]
+    side = initialBisection(Ac, vwc, xyc, fraction, imbalance, rng)
+
+    # Project back, refining on each level
+    for level in reversed(range(len(maps))):
+        side = side[maps[level]]
+        A, vw, xy = graphs[level]
+        side = refineBisection(A, vw, side, fraction, imbalance)
+
+    # Batch refinement can't straighten a ragged boundary, so on nearly
+    # uniform meshes a refined straight cut can be better. Keep the best.
+    cut = cutWeight(A, side)
+    for key in coordinateKeys(vw, xy):
+        order = np.argsort(key, kind='stable')
+        cand = refineBisection(A, vw, splitOrder(vw, order, fraction),
+                               fraction, imbalance)
+        candCut = cutWeight(A, cand)
+        if candCut < cut:
+            side, cut = cand, candCut
+    return side
+
+
+# Merge pairs of neighbors that are each other's heaviest unmatched
+# neighbor. Returns the coarse graph, its node weights, and the coarse
+# node of each fine node.
+def coarsenGraph(A, vw, rng, rounds=4):
+    n = A.shape[0]
+    match = -np.ones(n, dtype=np.int64)
+    # Converting from CSR leaves the entries sorted by row
+    A = A.tocsr().tocoo()
+    for r in range(rounds):
+        free = match < 0
+        keep = free[A.row] & free[A.col]
+        if not np.any(keep):
+            break
+        # Random tie-breaking, symmetric so that mutual choices are likely
+        noise = rng.random(n)
+        rows = A.row[keep]
+        cols = A.col[keep]
+        w = A.data[keep]*(1.0 + 1.0e-3*(noise[rows] + noise[cols]))
+        # Each node's heaviest free neighbor. The entries are in row order,
+        # so each row is a segment; take the first maximum in each one.
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = rows[1:] != rows[:-1]
+        starts = np.flatnonzero(first)
+        segment = np.cumsum(first) - 1
+        isMax = np.flatnonzero(w == np.maximum.reduceat(w, starts)[segment])
+        firstMax = np.ones(len(isMax), dtype=bool)
+        firstMax[1:] = segment[isMax[1:]] != segment[isMax[:-1]]
+        isMax = isMax[firstMax]
+        best = -np.ones(n, dtype=np.int64)
+        best[rows[isMax]] = cols[isMax]
+        i = np.flatnonzero(best >= 0)
+        mutual = i[best[best[i]]==i]
+        match[mutual] = best[mutual]
+
+    # Number the coarse nodes, one for each pair or unmatched node
+    rep = np.where(match >= 0, np.minimum(np.arange(n), match), np.arange(n))
+    reps, cmap = np.unique(rep, return_inverse=True)
+    nc = len(reps)
+    P = sp.csr_matrix((np.ones(n), (np.arange(n), cmap)), shape=(n, nc))
+    Ac = (P.T @ A.tocsr() @ P).tocsr()
+    Ac.setdiag(0)
+    Ac.eliminate_zeros()
+    vwc = np.bincount(cmap, weights=vw, minlength=nc)
+    return Ac, vwc, cmap
+
+
+# Bisect a small graph. The candidates are orderings of the nodes, each
+# split where the running weight reaches the target: the Fiedler vector of
+# the graph Laplacian (from a sparse eigensolver), the coordinates along
+# each axis and along the principal axis, and regions grown breadth-first
+# from a few random seeds. Each is refined and the one with the smallest
+# cut is kept.
+def initialBisection(A, vw, xy, fraction, imbalance, rng, tries=4):
+    n = A.shape[0]
+
+    keys = coordinateKeys(vw, xy)
+    fiedler = fiedlerVector(A, rng)
+    if fiedler is not None:
+        keys.append(fiedler)
+    orders = [np.argsort(sign*key, kind='stable') for key in keys
+              for sign in (1, -1)]
+    for seed in rng.choice(n, size=min(tries, n), replace=False):
+        order = breadth_first_order(A, seed, directed=False,
+                                    return_predecessors=False)
+        # Nodes in other components go last
+        rest = np.setdiff1d(np.arange(n), order)
+        orders.append(np.concatenate([order, rest]))
+
+    best = None
+    bestCut = np.inf
+    for order in orders:
+        side = splitOrder(vw, order, fraction)
+        side = refineBisection(A, vw, side, fraction, imbalance)
+        cut = cutWeight(A, side)
+        if cut < bestCut:
+            best, bestCut = side, cut
+    return best
+
+
+# Coordinates of the nodes along each axis and along the principal axis of
+# inertia, for splitting along straight lines
+def coordinateKeys(vw, xy):
+    centered = xy - np.average(xy, axis=0, weights=vw)
+    w, v = np.linalg.eigh((vw[:,None]*centered).T.dot(centered))
+    return [xy[:,d] for d in range(xy.shape[1])] + [centered.dot(v[:,-1])]
+
+
+# Split the nodes where the running weight, taking them in the given
+# order, reaches the given fraction of the total. Returns a 0/1 array.
+def splitOrder(vw, order, fraction):
+    grown = np.searchsorted(np.cumsum(vw[order]), fraction*vw.sum()) + 1
+    side = np.ones(len(vw), dtype=np.int64)
+    side[order[:grown]] = 0
+    return side
+
+
+# The eigenvector of the graph Laplacian for its second smallest eigenvalue,
+# found by shift-invert Lanczos with a small negative shift, which keeps
+# the shifted Laplacian nonsingular. Returns None if it doesn't converge.
+def fiedlerVector(A, rng):
+    n = A.shape[0]
+    if n < 3:
+        return None
+    L = laplacian(A.astype(np.float64)).tocsc()
+    try:
+        w, v = eigsh(L, k=2, sigma=-1.0e-3, which='LM', v0=rng.random(n))
+    except ArpackNoConvergence:
+        return None
+    return v[:, np.argsort(w)[1]]
+
+
+# Weight of the edges between the two sides
+def cutWeight(A, side):
+    A = A.tocoo()
+    return 0.5*np.sum(A.data[side[A.row] != side[A.col]])
+
+
+# Boundary refinement of a bisection, vectorized over batches of nodes.
+# First an overweight side sheds its best boundary nodes until the balance
+# is restored. Then each pass moves nodes in batches:
+# --- from each side in turn, every node with a positive gain (weight of
+#     its edges to the other side minus the weight of those to its own
+#     side), best first, as many as the balance allows. Nodes moving the
+#     same way only help each other, so the cut drops by at least the sum
+#     of their gains.
+# --- if no such moves are possible, pairs of boundary nodes, one from
+#     each side, best first, whose gains sum to more than zero, so the
+#     balance is kept. Moving both ends of a cut edge gains less than
+#     the sum, so the batch is kept only if the cut actually drops.
+# Passes stop when neither kind of batch reduces the cut.
+def refineBisection(A, vw, side, fraction, imbalance, passes=10):
+    A = A.tocsr()
+    total = vw.sum()
+    targets = np.array([fraction*total, (1.0-fraction)*total])
+    upper = (1.0 + imbalance)*targets
+    lower = total - upper[::-1]
+    side = side.copy()
+
+    weight = np.array([np.sum(vw[side==0]), np.sum(vw[side==1])])
+    gain, boundary = bisectionGains(A, side)
+    for s in (0, 1):
+        if weight[s] > upper[s]:
+            cand = np.flatnonzero(side==s)
+            cand = cand[np.argsort(-gain[cand], kind='stable')]
+            count = np.searchsorted(np.cumsum(vw[cand]), weight[s]-upper[s]) + 1
+            side[cand[:count]] = 1-s
+            weight[s] -= np.sum(vw[cand[:count]])
+            weight[1-s] += np.sum(vw[cand[:count]])
+            gain, boundary = bisectionGains(A, side)
+
+    for p in range(passes):
+        moved = False
+
+        # One-way batches, from the heavier side (relative to its target)
+        # first
+        for s in np.argsort(targets - weight):
+            cand = np.flatnonzero((side==s) & (gain > 0))
+            if len(cand)==0:
+                continue
+            cand = cand[np.argsort(-gain[cand], kind='stable')]
+            room = min(weight[s] - lower[s], upper[1-s] - weight[1-s])
+            count = np.searchsorted(np.cumsum(vw[cand]), room, side='right')
+            if count==0:
+                continue
+            move = cand[:count]
+            side[move] = 1-s
+            weight[s] -= np.sum(vw[move])
+            weight[1-s] += np.sum(vw[move])
+            gain, boundary = bisectionGains(A, side)
+            moved = True
+        if moved:
+            continue
+
+        # Balanced exchange of pairs of boundary nodes
+        c0 = np.flatnonzero(boundary & (side==0))
+        c1 = np.flatnonzero(boundary & (side==1))
+        c0 = c0[np.argsort(-gain[c0], kind='stable')]
+        c1 = c1[np.argsort(-gain[c1], kind='stable')]
+        m = min(len(c0), len(c1))
+        pairs = np.flatnonzero(gain[c0[:m]] + gain[c1[:m]] <= 0)
+        m = pairs[0] if len(pairs)>0 else m
+        if m==0:
+            break
+        trial = side.copy()
+        trial[c0[:m]] = 1
+        trial[c1[:m]] = 0
+        trialWeight = np.array([np.sum(vw[trial==0]), np.sum(vw[trial==1])])
+        if (np.any(trialWeight > upper) or np.any(trialWeight < lower)
+                or cutWeight(A, trial) >= cutWeight(A, side)):
+            break
+        side = trial
+        weight = trialWeight
+        gain, boundary = bisectionGains(A, side)
+    return side
+
+
+# Gain of moving each node to the other side, and whether it has any
+# neighbors there
+def bisectionGains(A, side):
+    toOne = A @ (side==1).astype(np.float64)
+    toZero = A @ (side==0).astype(np.float64)
+    toOther = np.where(side==0, toOne, toZero)
+    toSame = np.where(side==0, toZero, toOne)
+    return toOther - toSame, toOther > 0
+
+
+# ---------------------------------------------------------------------------
+# Test code
+
+if __name__=='__main__':
+
+    import time
+    from TriangleMeshReader import TriangleMeshReader
+    from UniformTriangularRefinement import VectorizedUniformTriangularRefinement
+
+    mesh = TriangleMeshReader('TestMeshes/oneHole.1', bulk=True).getMesh()
+    for i in range(4):
+        mesh, up, down = VectorizedUniformTriangularRefinement(mesh)
+    print('mesh has %d elements' % len(mesh.elems))
+
+    numParts = 6
+    for name, partitioner in (('RCB', partitionRCB), ('RIB', partitionRIB),
+                              ('multilevel', partitionMultilevel)):
+        start = time.perf_counter()
+        parts = partitioner(mesh, numParts)
+        t = time.perf_counter() - start
+        m = partitionMetrics(mesh, parts)
+        print('%-10s cut %5d  imbalance %.3f  shared verts %5d  (%.3f s)'
+            % (name, m['edgeCut'], m['imbalance'], m['sharedVerts'], t))
+
+    # The parts cover the mesh, and their maps are consistent
+    numElems = 0
+    for p in range(numParts):
+        part, vmap, emap = extractPart(mesh, parts, p, interfaceLabel=-1)
+        assert np.array_equal(vmap[part.elems], mesh.elems[emap])
+        numElems += len(part.elems)
+    print('parts have %d elements in all, interface sides in last part: %d'
+        % (numElems, len(part.sideSets.get(-1, []))))
+
+    # On a mesh graded towards a corner of the hole, RCB's median cuts run
+    # through the fine elements, while the multilevel cuts avoid them
+    from AdaptiveTriangularRefinement import AdaptiveTriangularRefinement
+    graded = TriangleMeshReader('TestMeshes/oneHole.1', bulk=True).getMesh()
+    for i in range(2):
+        graded, up, down = VectorizedUniformTriangularRefinement(graded)
+    corner = np.array([0.5, 0.5])
+    for level in range(8):
+        centroids = elementCentroids(graded)
+        near = np.linalg.norm(centroids - corner, axis=1) < 0.5**(level+1)
+        graded, up, down = AdaptiveTriangularRefinement(graded,
+            np.flatnonzero(near), longestEdge=(level==0))
+    print('graded mesh has %d elements' % len(graded.elems))
+    for numParts in (2, 4, 6, 8):
+        rcb = partitionMetrics(graded, partitionRCB(graded, numParts))
+        ml = partitionMetrics(graded, partitionMultilevel(graded, numParts))
+        print('%2d parts: RCB cut %4d, multilevel cut %4d, imbalance %.3f'
+            % (numParts, rcb['edgeCut'], ml['edgeCut'], ml['imbalance']))
+        if ml['edgeCut'] >= rcb['edgeCut'] or ml['imbalance'] > 1.03:
+            raise RuntimeError('multilevel partition is no better than RCB')
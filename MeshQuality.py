@@ -0,0 +1,172 @@
+import numpy as np
+import sys
+
+# --------------------------------------------------------------------------
+# Quality measures for all elements of a triangular mesh at once.
+#
+# elementQuality() returns a dictionary of arrays with one entry per
+# element:
+# --- area: signed area, positive for counterclockwise elements
+# --- orientation: sign of the area (1, -1, or 0 for degenerate elements)
+# --- edgeLengths: (numElems, 3) lengths of the edges (a,b), (b,c), (c,a)
+# --- minAngle, maxAngle: smallest and largest interior angles, in degrees
+# --- aspectRatio: circumradius over twice the inradius, which is 1 for an
+#     equilateral triangle and grows without bound as the element
+#     degenerates (infinite for zero area)
+#
+# qualitySummary() reduces these to minimum, mean, and maximum values,
+# and qualityReport() prints the summary with histograms of the angles and
+# aspect ratios. addQualityFields() adds the measures to a VTKWriter as
+# cell data for viewing.
+# --------------------------------------------------------------------------
+
+# Measures reported by qualitySummary and exported by addQualityFields
+qualityMeasures = ('area', 'minAngle', 'maxAngle', 'aspectRatio')
+
+
+def elementQuality(mesh):
+
+    verts = np.asarray(mesh.verts, dtype=np.float64).reshape(-1,2)
+    elems = np.asarray(mesh.elems, dtype=np.int64).reshape(-1,3)
+
+    p = verts[elems]                       # (numElems, 3, 2)
+    # Edge i runs from vertex i to vertex i+1
+    e = p[:,[1,2,0]] - p
+    lengths = np.sqrt(np.sum(e*e, axis=2))
+
+    area = 0.5*(e[:,0,0]*e[:,1,1] - e[:,0,1]*e[:,1,0])
+    absArea = np.abs(area)
+
+    # The angle at vertex i is between edge i and the reversed edge i-1
+    a = e
+    b = -e[:,[2,0,1]]
+    cosines = np.sum(a*b, axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cosines = cosines/(lengths*lengths[:,[2,0,1]])
+    angles = np.degrees(np.arccos(np.clip(cosines, -1.0, 1.0)))
+
+    # R = abc/(4A) and r = A/s, with s the semiperimeter
+    s = 0.5*np.sum(lengths, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        aspect = np.prod(lengths, axis=1)*s/(8.0*absArea*absArea)
+    aspect[absArea==0.0] = np.inf
+
+    return {'area' : area,
+            'orientation' : np.sign(area).astype(np.int8),
+            'edgeLengths' : lengths,
+            'minAngle' : angles.min(axis=1),
+            'maxAngle' : angles.max(axis=1),
+            'aspectRatio' : aspect}
+
+
+# Minimum, mean, and maximum of each measure, and the numbers of inverted
+# (clockwise) and degenerate (zero area) elements
+def qualitySummary(quality):
+    summary = {}
+    for name in qualityMeasures + ('edgeLengths',):
+        q = quality[name]
+        finite = q[np.isfinite(q)]
+        if finite.size==0:
+            summary[name] = (np.nan, np.nan, np.nan)
+        else:
+            summary[name] = (finite.min(), finite.mean(), q.max())
+    summary['numElems'] = len(quality['area'])
+    summary['numInverted'] = int(np.sum(quality['orientation']<0))
+    summary['numDegenerate'] = int(np.sum(quality['orientation']==0))
+    return summary
+
+
+# Print a summary of the element quality, with histograms of the minimum
+# and maximum angles and the aspect ratio
+def qualityReport(mesh, bins=10, file=sys.stdout):
+    quality = elementQuality(mesh)
+    summary = qualitySummary(quality)
+
+    file.write('%d elements, %d inverted, %d degenerate\n'
+        % (summary['numElems'], summary['numInverted'],
+           summary['numDegenerate']))
+    file.write('%-12s %12s %12s %12s\n' % ('measure', 'min', 'mean', 'max'))
+    for name in qualityMeasures + ('edgeLengths',):
+        file.write('%-12s %12.4g %12.4g %12.4g\n' % ((name,) + summary[name]))
+
+    for name, lo, hi in (('minAngle', 0.0, 60.0), ('maxAngle', 60.0, 180.0),
+                         ('aspectRatio', 1.0, None)):
+        q = quality[name]
+        q = q[np.isfinite(q)]
+        if q.size==0:
+            continue
+        if hi is None:
+            hi = max(q.max(), lo + 1.0e-12)
+        counts, edges = np.histogram(q, bins=bins, range=(lo, hi))
+        file.write('\n%s\n' % name)
+        scale = 50.0/max(1, counts.max())
+        for k in range(bins):
+            file.write('  [%9.4g, %9.4g) %9d %s\n' % (edges[k], edges[k+1],
+                counts[k], '#'*int(np.ceil(counts[k]*scale))))
+
+
+# Add the quality measures to a VTKWriter as cell fields
+def addQualityFields(writer, quality):
+    for name in qualityMeasures:
+        writer.addCellField(name, quality[name])
+    writer.addCellField('orientation', quality['orientation'])
+
+
+# ---------------------------------------------------------------------------
+# Test code
+
+if __name__=='__main__':
+
+    import time
+    from math import sqrt
+    from TriangleMeshReader import TriangleMeshReader
+    from UniformTriangularRefinement import VectorizedUniformTriangularRefinement
+
+    # Triangles with known measures: equilateral, right isosceles,
+    # clockwise, and degenerate
+    class Triangles:
+        def __init__(self, verts, elems):
+            self.verts = verts
+            self.elems = elems
+
+    tri = Triangles(np.array([[0.0, 0.0], [1.0, 0.0], [0.5, 0.5*sqrt(3.0)],
+                              [0.0, 1.0], [2.0, 0.0]]),
+                    np.array([[0, 1, 2], [0, 1, 3], [0, 3, 1], [0, 1, 4]]))
+    q = elementQuality(tri)
+    rightAspect = (0.5*sqrt(2.0))/(2.0 - sqrt(2.0))
+    checks = [
+        ('area', q['area'][:3], [0.25*sqrt(3.0), 0.5, -0.5]),
+        ('orientation', q['orientation'], [1, 1, -1, 0]),
+        ('minAngle', q['minAngle'][:3], [60.0, 45.0, 45.0]),
+        ('maxAngle', q['maxAngle'], [60.0, 90.0, 90.0, 180.0]),
+        ('aspectRatio', q['aspectRatio'], [1.0, rightAspect, rightAspect,
+                                           np.inf]),
+        ('edgeLengths', q['edgeLengths'][1], [1.0, sqrt(2.0), 1.0])]
+    ok = True
+    for name, value, expected in checks:
+        same = np.allclose(value, expected, rtol=1.0e-12, atol=1.0e-12)
+        ok = ok and same
+        print('%-12s %s' % (name, 'ok' if same else 'wrong: %s' % value))
+    summary = qualitySummary(q)
+    ok = ok and summary['numInverted']==1 and summary['numDegenerate']==1
+    if not ok:
+        raise RuntimeError('element quality check failed')
+
+    mesh = TriangleMeshReader('TestMeshes/oneHole.1', bulk=True).getMesh()
+    qualityReport(mesh)
+
+    for level in range(1, 7):
+        mesh, up, down = VectorizedUniformTriangularRefinement(mesh)
+        start = time.perf_counter()
+        summary = qualitySummary(elementQuality(mesh))
+        t = time.perf_counter() - start
+        print('level %d: %8d elements, min angle %6.2f, max aspect %6.3f '
+            '(%.3f s)' % (level, summary['numElems'], summary['minAngle'][0],
+                          summary['aspectRatio'][2], t))
+
+    from VTKWriter import VTKWriter
+    with open('quality.vtu', 'w') as file:
+        writer = VTKWriter(file, mode='appended')
+        writer.addMesh(mesh)
+        addQualityFields(writer, elementQuality(mesh))
+        writer.write()
@@ -0,0 +1,193 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+
+# --------------------------------------------------------------------------
+# Renumbering of the vertices, elements, and sides of a triangular mesh for
+# better memory locality.
+#
+# Meshes produced by the readers and refiners number their entities in
+# order of creation, which after a few levels of refinement scatters
+# neighbors across memory and gives matrices a wide bandwidth. The
+# functions here compute permutations that put neighbors close together:
+#
+# --- vertices: reverse Cuthill-McKee ('rcm'), which minimizes the bandwidth
+#     of the vertex adjacency graph, or the order of the vertices along a
+#     Hilbert ('hilbert') or Morton/Z-order ('morton') space-filling curve
+# --- elements: the order of their centroids along a space-filling curve
+# --- sides: sorted by their (renumbered) vertices
+#
+# Permutations are arrays perm with perm[new] = old, so a field on the old
+# mesh is carried over to the new one by field[perm]. reorderMesh() returns
+# the renumbered mesh as a CompressedMesh2D together with the vertex,
+# element, and side permutations. Side sets and cofacets follow from the
+# renumbered arrays. Transfer operators between reordered meshes are
+# obtained with permuteTransferOperators().
+# --------------------------------------------------------------------------
+
+# Number of bits per coordinate used for space-filling curve keys
+curveBits = 16
+
+
+# Renumber the mesh. Returns (mesh, vertPerm, elemPerm, sidePerm).
+def reorderMesh(mesh, vertOrder='rcm', elemOrder='hilbert'):
+
+    from CompressedMesh2D import CompressedMesh2D
+
+    if mesh.dim != 2:
+        raise ValueError('mesh dimension %d not supported' % mesh.dim)
+
+    verts = np.asarray(mesh.verts, dtype=np.float64).reshape(-1,2)
+    elems = np.asarray(mesh.elems, dtype=np.int64).reshape(-1,3)
+    sides = np.asarray(mesh.sides, dtype=np.int64).reshape(-1,2)
+    elemEdges = np.asarray(mesh.elemToEdgesMap, dtype=np.int64).reshape(-1,3)
+
+    vertPerm = vertexPermutation(mesh, vertOrder)
+    elemPerm = elementPermutation(mesh, elemOrder)
+
+    newVertIndex = inversePermutation(vertPerm)
+    newSides = np.sort(newVertIndex[sides], axis=1)
+    sidePerm = np.lexsort((newSides[:,1], newSides[:,0]))
+    newSideIndex = inversePermutation(sidePerm)
+
+    newMesh = CompressedMesh2D(verts[vertPerm],
+                               newVertIndex[elems[elemPerm]],
+                               newSides[sidePerm],
+                               np.asarray(mesh.sideLabels)[sidePerm],
+                               newSideIndex[elemEdges[elemPerm]],
+                               sidesSorted=True)
+
+    return (newMesh, vertPerm, elemPerm, sidePerm)
+
+
+# Permutation of the vertices by the given method
+def vertexPermutation(mesh, method='rcm'):
+    verts = np.asarray(mesh.verts, dtype=np.float64).reshape(-1,2)
+    if method=='rcm':
+        sides = np.asarray(mesh.sides, dtype=np.int64).reshape(-1,2)
+        n = len(verts)
+        ones = np.ones(len(sides), dtype=np.int8)
+        adj = sp.coo_matrix((ones, (sides[:,0], sides[:,1])), shape=(n,n))
+        adj = (adj + adj.T).tocsr()
+        return reverse_cuthill_mckee(adj, symmetric_mode=True).astype(np.int64)
+    return curveOrder(verts, method)
+
+
+# Permutation of the elements, by the curve order of their centroids
+def elementPermutation(mesh, method='hilbert'):
+    verts = np.asarray(mesh.verts, dtype=np.float64).reshape(-1,2)
+    elems = np.asarray(mesh.elems, dtype=np.int64).reshape(-1,3)
+    return curveOrder(np.mean(verts[elems], axis=1), method)
+
+
+# Inverse of a permutation: inv[perm[i]] = i
+def inversePermutation(perm):
+    inv = np.empty(len(perm), dtype=np.int64)
+    inv[perm] = np.arange(len(perm))
+    return inv
+
+
+# Transfer operators between reordered meshes. finePerm and coarsePerm are
+# the vertex permutations of the fine and coarse meshes.
+def permuteTransferOperators(update, downdate, finePerm, coarsePerm):
+    update = update.tocsr()[finePerm][:,coarsePerm]
+    downdate = downdate.tocsr()[coarsePerm][:,finePerm]
+    return (update.tocsr(), downdate.tocsr())
+
+
+# ---- Functions past this point are for internal use
+
+# Order of points along a space-filling curve ('hilbert' or 'morton')
+def curveOrder(points, method):
+    if method not in ('hilbert', 'morton'):
+        raise ValueError('unknown ordering "%s"' % method)
+    if len(points)==0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Quantize the points onto a 2^curveBits grid over their bounding box
+    lo = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - lo, 1.0e-300)
+    scale = (2**curveBits - 1)/np.max(extent)
+    ij = np.floor((points - lo)*scale).astype(np.int64)
+
+    if method=='hilbert':
+        keys = hilbertKeys(ij[:,0], ij[:,1])
+    else:
+        keys = mortonKeys(ij[:,0], ij[:,1])
+    return np.argsort(keys, kind='stable')
+
+
+# Interleave the bits of x and y
+def mortonKeys(x, y):
+    keys = np.zeros(len(x), dtype=np.int64)
+    for b in range(curveBits):
+        keys |= ((x >> b) & 1) << (2*b)
+        keys |= ((y >> b) & 1) << (2*b+1)
+    return keys
+
+
+# Distance along the Hilbert curve of the points (x,y), processing one bit
+# per step from the most significant, with all points at once
+def hilbertKeys(x, y):
+    x = x.copy()
+    y = y.copy()
+    keys = np.zeros(len(x), dtype=np.int64)
+    s = 1 << (curveBits-1)
+    while s>0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        keys += s*s*((3*rx) ^ ry)
+        # Rotate the quadrant so the curve is in standard orientation
+        flip = ~ry & rx
+        x[flip] = s-1 - x[flip]
+        y[flip] = s-1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap]
+        x &= s-1
+        y &= s-1
+        s >>= 1
+    return keys
+
+
+# ---------------------------------------------------------------------------
+# Test code: reorder a refined mesh and compare the bandwidth of the vertex
+# adjacency matrix and the spread of element vertex indices.
+
+if __name__=='__main__':
+
+    import time
+    from TriangleMeshReader import TriangleMeshReader
+    from UniformTriangularRefinement import VectorizedUniformTriangularRefinement
+
+    mesh = TriangleMeshReader('TestMeshes/oneHole.1', bulk=True).getMesh()
+    for i in range(6):
+        coarse = mesh
+        mesh, up, down = VectorizedUniformTriangularRefinement(mesh)
+
+    def bandwidth(m):
+        s = np.asarray(m.sides)
+        return np.max(np.abs(s[:,0].astype(np.int64) - s[:,1]))
+
+    def elemSpread(m):
+        e = np.asarray(m.elems)
+        return np.mean(e.max(axis=1) - e.min(axis=1))
+
+    print('%-10s bandwidth %8d, mean element spread %10.1f'
+        % ('original', bandwidth(mesh), elemSpread(mesh)))
+    for method in ('rcm', 'hilbert', 'morton'):
+        start = time.perf_counter()
+        newMesh, vp, ep, spm = reorderMesh(mesh, vertOrder=method)
+        t = time.perf_counter() - start
+        print('%-10s bandwidth %8d, mean element spread %10.1f  (%.3f s)'
+            % (method, bandwidth(newMesh), elemSpread(newMesh), t))
+
+    # Fields and transfer operators carry over
+    newMesh, vp, ep, spm = reorderMesh(mesh)
+    newCoarse, cvp, cep, csp = reorderMesh(coarse)
+    newUp, newDown = permuteTransferOperators(up, down, vp, cvp)
+    f = coarse.verts[:,0] + 2.0*coarse.verts[:,1]
+    print('update commutes with reordering: %s'
+        % np.allclose((up*f)[vp], newUp*f[cvp]))
+    print('side labels preserved: %s'
+        % all(np.array_equal(np.sort(spm[newMesh.sideSets[k]]), mesh.sideSets[k])
+              for k in mesh.sideSets))
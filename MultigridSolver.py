@@ -0,0 +1,215 @@
+import numpy as np
+import numpy.linalg as la
+import scipy.sparse as sp
+from scipy.sparse.linalg import LinearOperator, splu, spsolve_triangular
+
+# --------------------------------------------------------------------------
+# Geometric multigrid solver built on a UniformRefinementSequence.
+#
+# The coarse level operators are the Galerkin products
+# A_{i} = downdate_i * A_{i+1} * update_i computed by the sequence's
+# makeMatrixSequence(). Residuals are restricted with the downdate
+# operators and corrections are interpolated with the update operators.
+# Because the downdate is the row-scaled transpose of the update, the
+# scaling cancels in the coarse correction, which is the same as that of
+# the symmetric Galerkin scheme with restriction update^T.
+#
+# Options:
+# --- smoother: 'jacobi' (damped Jacobi) or 'gauss-seidel'. Gauss-Seidel
+#     uses forward sweeps before the coarse correction and backward sweeps
+#     after it, so that the cycle is symmetric for symmetric problems.
+# --- omega: damping factor for Jacobi (default 2/3)
+# --- numPreSmooth, numPostSmooth: smoothing sweeps on each level
+# --- cycle: 'V' or 'W'
+# --- coarseSolver: function taking the coarsest matrix and returning a
+#     function that solves with it. By default SuperLU is used.
+#
+# Use solve() to run multigrid as a standalone iterative solver, or
+# aspreconditioner() to get a scipy LinearOperator that applies one cycle,
+# for use with the Krylov methods in scipy.sparse.linalg.
+# --------------------------------------------------------------------------
+
+class MultigridSolver:
+
+    def __init__(self, seq, A, smoother='jacobi', omega=2.0/3.0,
+                 numPreSmooth=2, numPostSmooth=2, cycle='V',
+                 coarseSolver=None):
+
+        if smoother not in ('jacobi', 'gauss-seidel'):
+            raise ValueError('unknown smoother "%s"' % smoother)
+        if cycle not in ('V', 'W'):
+            raise ValueError('unknown cycle type "%s"' % cycle)
+
+        self.seq = seq
+        self.smoother = smoother
+        self.omega = omega
+        self.numPreSmooth = numPreSmooth
+        self.numPostSmooth = numPostSmooth
+        self.cycleType = cycle
+        # Number of recursive coarse corrections per level
+        self.gamma = 1 if cycle=='V' else 2
+
+        seq.makeMatrixSequence(sp.csr_matrix(A))
+        self.A = [sp.csr_matrix(Ai) for Ai in seq.seqA]
+        self.updates = [seq.update(i) for i in range(seq.numLevels()-1)]
+        self.downdates = [seq.downdate(i) for i in range(seq.numLevels()-1)]
+
+        # Set up the smoothers on all but the coarsest level
+        self.invDiag = [None]*len(self.A)
+        self.lower = [None]*len(self.A)
+        self.upper = [None]*len(self.A)
+        for i in range(1, len(self.A)):
+            if smoother=='jacobi':
+                self.invDiag[i] = 1.0/self.A[i].diagonal()
+            else:
+                self.lower[i] = sp.tril(self.A[i], format='csr')
+                self.upper[i] = sp.triu(self.A[i], format='csr')
+
+        # Factor the coarsest level operator
+        if coarseSolver is None:
+            lu = splu(sp.csc_matrix(self.A[0]))
+            self.coarseSolve = lu.solve
+        else:
+            self.coarseSolve = coarseSolver(self.A[0])
+
+        self.residualHistory = []
+
+    def numLevels(self):
+        return len(self.A)
+
+    # Run multigrid cycles until the residual norm is reduced by a factor
+    # of tol relative to the norm of b, or until maxiter cycles have been
+    # done. Returns the solution and the number of cycles used; the
+    # residual norms are recorded in residualHistory.
+    def solve(self, b, x0=None, tol=1.0e-8, maxiter=100):
+        L = self.numLevels()-1
+        b = np.asarray(b, dtype=np.float64)
+        if x0 is None:
+            x = np.zeros_like(b)
+        else:
+            x = np.array(x0, dtype=np.float64)
+
+        bNorm = la.norm(b)
+        if bNorm==0.0:
+            bNorm = 1.0
+
+        r = b - self.A[L]*x
+        self.residualHistory = [la.norm(r)]
+        for it in range(maxiter):
+            if self.residualHistory[-1] <= tol*bNorm:
+                return x, it
+            x = self.cycle(L, b, x)
+            r = b - self.A[L]*x
+            self.residualHistory.append(la.norm(r))
+
+        return x, maxiter
+
+    # Return a LinearOperator that applies one cycle with zero initial guess
+    def aspreconditioner(self):
+        L = self.numLevels()-1
+        n = self.A[L].shape[0]
+
+        def matvec(b):
+            b = np.asarray(b, dtype=np.float64).ravel()
+            return self.cycle(L, b, np.zeros_like(b))
+
+        return LinearOperator((n, n), matvec=matvec, dtype=np.float64)
+
+    # One multigrid cycle on level i for A_i x = b, starting from x
+    def cycle(self, i, b, x):
+
+        if i==0:
+            return self.coarseSolve(b)
+
+        A = self.A[i]
+        for k in range(self.numPreSmooth):
+            x = self.smooth(i, b, x, forward=True)
+
+        # Coarse grid correction
+        r = b - A*x
+        rc = self.downdates[i-1]*r
+        ec = np.zeros_like(rc)
+        for k in range(self.gamma):
+            ec = self.cycle(i-1, rc, ec)
+            # On the level above the coarsest, the coarse solve is exact
+            if i-1==0:
+                break
+        x = x + self.updates[i-1]*ec
+
+        for k in range(self.numPostSmooth):
+            x = self.smooth(i, b, x, forward=False)
+
+        return x
+
+    # One smoothing sweep on level i
+    def smooth(self, i, b, x, forward):
+        r = b - self.A[i]*x
+        if self.smoother=='jacobi':
+            return x + self.omega*self.invDiag[i]*r
+        if forward:
+            return x + spsolve_triangular(self.lower[i], r, lower=True)
+        return x + spsolve_triangular(self.upper[i], r, lower=False)
+
+
+# ---------------------------------------------------------------------------
+# Test code: solve the Poisson equation -u'' = f and -div grad u = f with
+# homogeneous Dirichlet boundary conditions.
+
+if __name__=='__main__':
+
+    from UniformRefinementSequence import UniformRefinementSequence
+    from UniformTriangularRefinement import VectorizedUniformTriangularRefinement
+    from UniformLineMesher import UniformLineMesh
+    from UniformRectangleMesher import UniformRectangleMesher
+    from P1Assembler import stiffnessMatrix
+    from scipy.sparse.linalg import cg
+
+    # P1 stiffness matrix, with Dirichlet rows/columns replaced by identity
+    def stiffness2D(mesh):
+        A = stiffnessMatrix(mesh)
+        onBdry = np.zeros(A.shape[0], dtype=bool)
+        onBdry[mesh.boundaryIndex.vertsForLabels()] = True
+        keep = sp.diags((~onBdry).astype(float))
+        return keep*A*keep + sp.diags(onBdry.astype(float)), onBdry
+
+    print('--- 1D ---')
+    seq = UniformRefinementSequence(UniformLineMesh(0.0, 1.0, 4), 8)
+    n = len(seq.mesh(seq.numLevels()-1).verts)
+    h = 1.0/(n-1)
+    A = sp.diags([-np.ones(n-1), 2.0*np.ones(n), -np.ones(n-1)], [-1, 0, 1],
+        format='lil')/h
+    # Dirichlet conditions, eliminated symmetrically
+    for i in (0, n-1):
+        A[i,:] = 0.0
+        A[:,i] = 0.0
+        A[i,i] = 1.0
+    b = h*np.ones(n)
+    b[0] = b[n-1] = 0.0
+    mg = MultigridSolver(seq, A.tocsr())
+    x, its = mg.solve(b)
+    print('n=%d, %d V-cycles, residual=%g' % (n, its, mg.residualHistory[-1]))
+
+    print('--- 2D ---')
+    coarse = UniformRectangleMesher(0.0, 1.0, 4, 0.0, 1.0, 4)
+    seq = UniformRefinementSequence(coarse, 5, lazy=True,
+        refiner=VectorizedUniformTriangularRefinement)
+    fine = seq.mesh(seq.numLevels()-1)
+    A, onBdry = stiffness2D(fine)
+    b = np.ones(A.shape[0])/A.shape[0]
+    b[onBdry] = 0.0
+
+    for smoother in ('jacobi', 'gauss-seidel'):
+        for cycle in ('V', 'W'):
+            mg = MultigridSolver(seq, A, smoother=smoother, cycle=cycle)
+            x, its = mg.solve(b)
+            rates = np.array(mg.residualHistory[1:])/np.array(
+                mg.residualHistory[:-1])
+            print('%-12s %s-cycle: n=%d, %2d cycles, mean reduction %.3f'
+                % (smoother, cycle, A.shape[0], its, np.mean(rates)))
+
+    mg = MultigridSolver(seq, A)
+    count = [0]
+    def callback(xk):
+        count[0] += 1
+    x, info = cg(A, b, M=mg.aspreconditioner(), callback=callback)
+    print('MG-preconditioned CG: %d iterations, info=%d' % (count[0], info))
@@ -0,0 +1,247 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+from UniformTriangularRefinement import (coarseArrays, numberFineEntities,
+    fineVertexCoordinates, allocateFineArrays, refineElemBlock,
+    vectorizedTransferOperators, fineBoundaryIndex, countFineEntities)
+import Timers
+
+# --------------------------------------------------------------------------
+# Uniform refinement of a triangular mesh, with the work on the coarse
+# elements split across a pool of processes.
+#
+# The children of a coarse element depend only on the element and its three
+# edges, once every fine vertex and side has been given its global index.
+# That numbering is done up front in the parent process by the same
+# vectorized routine used in VectorizedUniformTriangularRefinement, which
+# reproduces the order of the serial UniformTriangularRefinement. The
+# coarse elements are then split into contiguous chunks and each worker
+# writes its chunk's child elements and sides directly into the fine
+# mesh's arrays, held in shared memory. While the workers run, the parent
+# computes the fine vertex coordinates and the transfer operators. The
+# result is identical to the serial refiner's regardless of the number of
+# processes or chunks.
+#
+# When the parallel path is faster: in the vectorized refiner, numbering
+# the fine entities takes about a third of the time, refining the
+# elements a little over half, and the transfer operators the rest. Only
+# the element refinement is split across the workers, and the parallel
+# path adds the cost of starting the pool and copying the arrays in and out
+# of shared memory, about a third of the vectorized refiner's time. So it
+# pays off only with several processes (three or more) and on large
+# meshes, where the pool's start-up cost is small next to the work. With
+# fewer than minProcs processes, or fewer than minElemsPerProc coarse
+# elements per process, this function just calls
+# VectorizedUniformTriangularRefinement. Pass minProcs=1 and
+# minElemsPerProc=0 to force the parallel path.
+# --------------------------------------------------------------------------
+
+@Timers.timed('ParallelUniformTriangularRefinement')
+def ParallelUniformTriangularRefinement(coarse, numProcs=None, numChunks=None,
+                                        minProcs=3, minElemsPerProc=100000,
+                                        verb=0):
+
+    from CompressedMesh2D import CompressedMesh2D
+    from UniformTriangularRefinement import VectorizedUniformTriangularRefinement
+
+    if numProcs is None:
+        numProcs = os.cpu_count()
+    if numChunks is None:
+        numChunks = 4*numProcs
+
+    numElems = len(coarse.elems)
+    if numProcs < minProcs or numElems < minElemsPerProc*numProcs:
+        if verb>0:
+            print('refining %d elements serially' % numElems)
+        return VectorizedUniformTriangularRefinement(coarse, verb=verb)
+
+    with Timers.timer('number fine entities'):
+        c = coarseArrays(coarse)
+        numberFineEntities(c)
+
+    if verb>0:
+        print('refining %d elements in %d chunks on %d processes'
+            % (numElems, numChunks, numProcs))
+
+    bounds = np.linspace(0, numElems, numChunks+1).astype(np.int64)
+
+    # Share the coarse arrays and the fine arrays with the workers. The
+    # fine arrays are allocated in shared memory, not copied there.
+    shared = SharedArrays()
+    try:
+        with Timers.timer('share arrays'):
+            cShared = shared.share(c)
+            outShared = shared.allocate(allocateFineArrays(c, allocate=False))
+
+        with Timers.timer('refine chunks'), \
+                ProcessPoolExecutor(max_workers=numProcs) as pool:
+            tasks = [pool.submit(refineChunk, int(lo), int(hi),
+                                 shared.specs(cShared), shared.specs(outShared))
+                     for lo, hi in zip(bounds[:-1], bounds[1:]) if hi>lo]
+
+            # The parent's own work overlaps with the workers'
+            with Timers.timer('transfer operators'):
+                fineVerts = fineVertexCoordinates(c)
+                update, downdate = vectorizedTransferOperators(c)
+
+            for t in tasks:
+                t.result()
+
+        # Copy the results out of shared memory before it's released
+        with Timers.timer('share arrays'):
+            out = {name : np.array(a) for name, a in outShared.items()}
+    finally:
+        shared.release()
+
+    countFineEntities(c)
+
+    with Timers.timer('build mesh'):
+        fine = CompressedMesh2D(fineVerts, out['elems'], out['sides'],
+            out['sideLabels'], out['elemToEdgesMap'], sidesSorted=True,
+            boundaryIndex=fineBoundaryIndex(coarse, c, out))
+
+    return (fine, update, downdate)
+
+
+# Worker task: attach to the shared arrays and refine one chunk of elements
+def refineChunk(lo, hi, cSpecs, outSpecs):
+    handles = []
+    c = out = None
+    try:
+        c = attachArrays(cSpecs, handles)
+        out = attachArrays(outSpecs, handles)
+        refineElemBlock(lo, hi, c, out)
+    finally:
+        # The arrays must be dropped before their memory can be closed
+        c = out = None
+        for h in handles:
+            h.close()
+
+
+# Attach to arrays in shared memory, given their (name, shape, dtype) specs.
+# The SharedMemory handles are appended to the list so the caller can close
+# them. If attaching fails, the arrays already made are dropped, so the
+# handles can still be closed.
+def attachArrays(specs, handles):
+    arrays = {}
+    try:
+        for key, (shmName, shape, dtype) in specs.items():
+            if shmName is None:
+                arrays[key] = np.zeros(shape, dtype=dtype)
+                continue
+            shm = shared_memory.SharedMemory(name=shmName)
+            handles.append(shm)
+            arrays[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    except BaseException:
+        arrays.clear()
+        raise
+    return arrays
+
+
+# Owner of a group of shared memory blocks, released all at once
+class SharedArrays:
+
+    def __init__(self):
+        self.blocks = {}
+
+    # Copy a dictionary of arrays into shared memory, returning a dictionary
+    # of arrays backed by the shared blocks
+    def share(self, arrays):
+        result = {}
+        for key, a in arrays.items():
+            a = np.ascontiguousarray(a)
+            if a.nbytes==0:
+                result[key] = a
+                continue
+            shm = shared_memory.SharedMemory(create=True, size=a.nbytes)
+            view = np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)
+            view[...] = a
+            self.blocks[id(view)] = (shm, view)
+            result[key] = view
+        return result
+
+    # Allocate uninitialized arrays in shared memory, given a dictionary of
+    # (shape, dtype) pairs
+    def allocate(self, shapes):
+        result = {}
+        for key, (shape, dtype) in shapes.items():
+            dtype = np.dtype(dtype)
+            nbytes = int(np.prod(shape))*dtype.itemsize
+            if nbytes==0:
+                result[key] = np.zeros(shape, dtype=dtype)
+                continue
+            shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            view = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            self.blocks[id(view)] = (shm, view)
+            result[key] = view
+        return result
+
+    # Specifications (name, shape, dtype) from which workers can attach
+    def specs(self, arrays):
+        specs = {}
+        for key, a in arrays.items():
+            if id(a) in self.blocks:
+                specs[key] = (self.blocks[id(a)][0].name, a.shape, a.dtype.str)
+            else:
+                specs[key] = (None, a.shape, a.dtype.str)
+        return specs
+
+    def release(self):
+        for shm, view in self.blocks.values():
+            del view
+            shm.close()
+            shm.unlink()
+        self.blocks = {}
+
+
+# ---------------------------------------------------------------------------
+# Test code: check against the serial refiner and time the refinement for
+# increasing numbers of processes.
+
+if __name__=='__main__':
+
+    import sys
+    import time
+    from TriangleMeshReader import TriangleMeshReader
+    from UniformTriangularRefinement import VectorizedUniformTriangularRefinement
+
+    mesh = TriangleMeshReader('TestMeshes/oneHole.1', bulk=True).getMesh()
+
+    numLevels = int(sys.argv[1]) if len(sys.argv)>1 else 6
+    for i in range(numLevels):
+        mesh, up, down = VectorizedUniformTriangularRefinement(mesh)
+    print('coarse mesh has %d elements' % len(mesh.elems))
+
+    start = time.perf_counter()
+    serial, up, down = VectorizedUniformTriangularRefinement(mesh)
+    tSerial = time.perf_counter() - start
+    print('%12s %10.3f s' % ('vectorized', tSerial))
+
+    def check(fine, pUp, pDown):
+        same = all(np.array_equal(getattr(serial, name), getattr(fine, name))
+                   for name in ('verts', 'elems', 'sides', 'sideLabels',
+                                'elemToEdgesMap'))
+        return same and (up != pUp).nnz==0 and (down != pDown).nnz==0
+
+    # With the default thresholds, small meshes and few processes use the
+    # vectorized refiner
+    start = time.perf_counter()
+    fine, pUp, pDown = ParallelUniformTriangularRefinement(mesh)
+    t = time.perf_counter() - start
+    print('%12s %10.3f s  speedup %5.2f  identical=%s'
+        % ('default', t, tSerial/t, check(fine, pUp, pDown)))
+
+    # The parallel path, forced
+    p = 1
+    while p <= 2*os.cpu_count():
+        start = time.perf_counter()
+        fine, pUp, pDown = ParallelUniformTriangularRefinement(mesh,
+            numProcs=p, minProcs=1, minElemsPerProc=0)
+        t = time.perf_counter() - start
+        same = check(fine, pUp, pDown)
+        print('%9d proc %10.3f s  speedup %5.2f  identical=%s'
+            % (p, t, tSerial/t, same))
+        if not same:
+            raise RuntimeError('parallel refinement differs from serial')
+        p *= 2
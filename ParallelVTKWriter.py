@@ -0,0 +1,296 @@
+from VTKWriter import *
+from ParallelUniformTriangularRefinement import SharedArrays, attachArrays
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+# --------------------------------------------------------------------------
+# Partitioned VTK output: the mesh is split into pieces, each piece is
+# written to its own .vtu file by a pool of worker processes, and a
+# .pvtu file listing the pieces is written for ParaView, which can then
+# also read the pieces in parallel.
+#
+# By default the elements are split into numPieces contiguous ranges, in
+# the order they're stored. Meshes from the refiners and readers keep
+# nearby elements close together, so the ranges are compact enough for
+# output. For compact pieces with few shared vertices, pass a part number
+# for each element as parts, such as from MeshPartitioner.
+#
+# Each piece holds its elements and the vertices they touch, renumbered
+# locally, with the point and cell fields restricted to them. Vertices on
+# the boundaries between pieces appear in each piece that touches them.
+# The mesh and fields are copied once into shared memory, and each worker
+# cuts its own piece out of them, so the parent process does no per-piece
+# work and nothing large is pickled.
+#
+# Pieces are written with VTKWriter, with the given mode, compress, and
+# floatType options. With numProcs=1 the pieces are written one after
+# another in this process. Writing in pieces pays off when encoding
+# dominates, as with compressed or ascii output, and several processes are
+# available. Uncompressed appended output of the whole mesh is little more
+# than a copy to the file, which the partitioned writer doesn't beat.
+# --------------------------------------------------------------------------
+
+def writePartitionedVTK(basename, mesh, pointFields=None, cellFields=None,
+                        numPieces=None, parts=None, numProcs=None,
+                        mode='appended', compress=False, floatType='Float32'):
+
+    if pointFields is None:
+        pointFields = {}
+    if cellFields is None:
+        cellFields = {}
+    if numProcs is None:
+        numProcs = os.cpu_count()
+
+    arrays = {'verts' : np.asarray(mesh.verts, dtype=np.float64).reshape(-1,2),
+              'elems' : np.asarray(mesh.elems, dtype=np.int32).reshape(-1,3)}
+    numElems = len(arrays['elems'])
+
+    # Element ranges of the pieces, in the element order or, with a given
+    # partition, in the order that groups the elements by part
+    if parts is None:
+        if numPieces is None:
+            numPieces = numProcs
+        bounds = np.linspace(0, numElems, numPieces+1).astype(np.int64)
+    else:
+        parts = np.asarray(parts)
+        numPieces = int(parts.max())+1
+        arrays['order'] = np.argsort(parts, kind='stable')
+        bounds = np.searchsorted(parts[arrays['order']], np.arange(numPieces+1))
+
+    pointFields = {name : np.asarray(f, dtype=np.float64)
+                   for name, f in pointFields.items()}
+    cellFields = {name : np.asarray(f, dtype=np.float64)
+                  for name, f in cellFields.items()}
+
+    pieceNames = ['%s_%d.vtu' % (basename, p) for p in range(numPieces)]
+    options = (mode, compress, floatType)
+
+    if numProcs==1:
+        for p in range(numPieces):
+            writePiece(pieceNames[p], arrays, pointFields, cellFields,
+                       bounds[p], bounds[p+1], *options)
+    else:
+        shared = SharedArrays()
+        try:
+            specs = [shared.specs(shared.share(a))
+                     for a in (arrays, pointFields, cellFields)]
+            with ProcessPoolExecutor(max_workers=numProcs) as pool:
+                tasks = [pool.submit(writeSharedPiece, pieceNames[p], specs,
+                                     int(bounds[p]), int(bounds[p+1]), options)
+                         for p in range(numPieces)]
+                for t in tasks:
+                    t.result()
+        finally:
+            shared.release()
+
+    writePVTU(basename + '.pvtu', pieceNames, list(pointFields.keys()),
+              list(cellFields.keys()), mode, floatType)
+
+
+# Write the .pvtu file describing the pieces. Piece file names are made
+# relative to the .pvtu file.
+def writePVTU(filename, pieceNames, pointFieldNames, cellFieldNames, mode,
+              floatType):
+
+    pvtuDir = os.path.dirname(os.path.abspath(filename))
+
+    with open(filename, 'w') as file:
+        head = XMLHeader('VTKFile')
+        head.addAttribute('type', 'PUnstructuredGrid')
+        if mode=='ascii':
+            head.addAttribute('version', '0.1')
+        else:
+            head.addAttribute('version', '1.0')
+            head.addAttribute('byte_order', 'LittleEndian')
+            head.addAttribute('header_type', 'UInt64')
+        head.writeHeader(file)
+
+        ug = XMLHeader('PUnstructuredGrid')
+        ug.addAttribute('GhostLevel', '0')
+        ug.writeHeader(file)
+
+        pts = XMLHeader('PPoints')
+        pts.writeHeader(file)
+        data = XMLHeader('PDataArray')
+        data.addAttribute('type', floatType)
+        data.addAttribute('NumberOfComponents', '3')
+        data.writeHeader(file)
+        data.writeFooter(file)
+        pts.writeFooter(file)
+
+        for section, names in (('PPointData', pointFieldNames),
+                               ('PCellData', cellFieldNames)):
+            pd = XMLHeader(section)
+            if len(names)>0:
+                pd.addAttribute('Scalars', names[0])
+            pd.writeHeader(file)
+            for name in names:
+                data = XMLHeader('PDataArray')
+                data.addAttribute('type', floatType)
+                data.addAttribute('Name', name)
+                data.writeHeader(file)
+                data.writeFooter(file)
+            pd.writeFooter(file)
+
+        for name in pieceNames:
+            piece = XMLHeader('Piece')
+            piece.addAttribute('Source',
+                os.path.relpath(os.path.abspath(name), pvtuDir))
+            piece.writeHeader(file)
+            piece.writeFooter(file)
+
+        ug.writeFooter(file)
+        head.writeFooter(file)
+
+
+# ---- Functions past this point are for internal use
+
+# The vertices and elements of one piece, in the form VTKWriter expects
+class MeshPiece:
+
+    def __init__(self, verts, elems):
+        self.verts = verts
+        self.elems = elems
+
+
+# Write the piece made of elements lo through hi-1 (in the order given by
+# arrays['order'], if there is one) to a .vtu file
+def writePiece(filename, arrays, pointFields, cellFields, lo, hi, mode,
+               compress, floatType):
+    if 'order' in arrays:
+        pieceElems = arrays['order'][lo:hi]
+    else:
+        pieceElems = np.arange(lo, hi)
+    localVerts, localConn = np.unique(arrays['elems'][pieceElems],
+                                      return_inverse=True)
+
+    with open(filename, 'w') as file:
+        writer = VTKWriter(file, mode=mode, compress=compress,
+                           floatType=floatType)
+        writer.addMesh(MeshPiece(arrays['verts'][localVerts],
+                                 localConn.reshape(-1,3)))
+        for name, f in pointFields.items():
+            writer.addField(name, f[localVerts])
+        for name, f in cellFields.items():
+            writer.addCellField(name, f[pieceElems])
+        writer.write()
+
+
+# Worker task: attach to the shared mesh and fields and write one piece
+def writeSharedPiece(filename, specs, lo, hi, options):
+    handles = []
+    arrays = pointFields = cellFields = None
+    try:
+        arrays = attachArrays(specs[0], handles)
+        pointFields = attachArrays(specs[1], handles)
+        cellFields = attachArrays(specs[2], handles)
+        writePiece(filename, arrays, pointFields, cellFields, lo, hi,
+                   *options)
+    finally:
+        # The arrays must be dropped before their memory can be closed
+        arrays = pointFields = cellFields = None
+        for h in handles:
+            h.close()
+
+
+# ---------------------------------------------------------------------------
+# Test code: check that the pieces put back together give the mesh and
+# fields, then time the appended output of a large mesh for increasing
+# numbers of processes
+
+if __name__=='__main__':
+
+    import sys
+    import time
+    from TriangleMeshReader import TriangleMeshReader
+    from UniformTriangularRefinement import VectorizedUniformTriangularRefinement
+    from VTKReader import readVTU, readPVTU
+
+    mesh = TriangleMeshReader('TestMeshes/oneHole.1', bulk=True).getMesh()
+    for i in range(3):
+        mesh, up, down = VectorizedUniformTriangularRefinement(mesh)
+
+    # Global indices as fields, to map each piece back to the mesh
+    pointFields = {'u' : np.sin(mesh.verts[:,0]),
+                   'globalVert' : np.arange(len(mesh.verts))}
+    cellFields = {'globalElem' : np.arange(len(mesh.elems))}
+    ok = True
+    for mode, compress in (('ascii', False), ('binary', True),
+                           ('appended', False), ('appended', True)):
+        writePartitionedVTK('check-%s' % mode, mesh, pointFields, cellFields,
+            numPieces=4, numProcs=2, mode=mode, compress=compress,
+            floatType='Float64')
+        pvtu = readPVTU('check-%s.pvtu' % mode)
+        same = (len(pvtu.pieces)==4
+            and pvtu.pointFieldNames==list(pointFields.keys())
+            and pvtu.cellFieldNames==list(cellFields.keys()))
+        elemCount = np.zeros(len(mesh.elems), dtype=np.int64)
+        for name in pvtu.pieces:
+            piece = readVTU(name)
+            gv = piece.pointData['globalVert'].astype(np.int64)
+            ge = piece.cellData['globalElem'].astype(np.int64)
+            elemCount[ge] += 1
+            same = same and (np.array_equal(piece.points[:,0:2],
+                                            mesh.verts[gv])
+                and np.array_equal(gv[piece.elems], mesh.elems[ge])
+                and np.array_equal(piece.pointData['u'], pointFields['u'][gv]))
+        same = same and np.all(elemCount==1)
+        ok = ok and same
+        print('%-8s compress=%-5s pieces read back %s' % (mode, compress, same))
+    if not ok:
+        raise RuntimeError('ParallelVTKWriter round trip failed')
+
+    # A precomputed partition gives the same pieces as the partitioner
+    from MeshPartitioner import partitionRCB
+    parts = partitionRCB(mesh, 3)
+    writePartitionedVTK('check-parts', mesh, pointFields, cellFields,
+        parts=parts, numProcs=2, floatType='Float64')
+    pvtu = readPVTU('check-parts.pvtu')
+    same = len(pvtu.pieces)==3
+    for p, name in enumerate(pvtu.pieces):
+        ge = readVTU(name).cellData['globalElem'].astype(np.int64)
+        same = same and np.array_equal(ge, np.flatnonzero(parts==p))
+    print('given partition: pieces match %s' % same)
+    if not same:
+        raise RuntimeError('ParallelVTKWriter pieces differ from the partition')
+
+    numLevels = int(sys.argv[1]) if len(sys.argv)>1 else 4
+    for i in range(numLevels):
+        mesh, up, down = VectorizedUniformTriangularRefinement(mesh)
+    u = np.sin(mesh.verts[:,0])*np.cos(mesh.verts[:,1])
+    area = np.ones(len(mesh.elems))
+    print('mesh has %d elements' % len(mesh.elems))
+
+    numProcs = os.cpu_count()
+    for mode, compress in (('appended', False), ('appended', True)):
+        label = mode + ('+zlib' if compress else '')
+        start = time.perf_counter()
+        with open('serial-%s.vtu' % mode, 'w') as file:
+            writer = VTKWriter(file, mode=mode, compress=compress)
+            writer.addMesh(mesh)
+            writer.addField('u', u)
+            writer.addCellField('area', area)
+            writer.write()
+        tSerial = time.perf_counter() - start
+        print('%-13s VTKWriter %10.3f s' % (label, tSerial))
+
+        p = 1
+        while p <= 2*numProcs:
+            start = time.perf_counter()
+            writePartitionedVTK('parallel-%s' % mode, mesh,
+                pointFields={'u' : u}, cellFields={'area' : area},
+                numProcs=p, mode=mode, compress=compress)
+            t = time.perf_counter() - start
+            print('%-13s %3d proc  %10.3f s  speedup %5.2f'
+                % (label, p, t, tSerial/t))
+
+            # With compression the work is in the encoding, which the
+            # pieces share out, so with several processors the
+            # partitioned writer must beat the serial one
+            if (compress and p==numProcs and numProcs>=2
+                    and t >= tSerial):
+                raise RuntimeError('partitioned write on %d processes is '
+                    'slower than the serial appended writer' % p)
+            p *= 2
+    if numProcs<2:
+        print('one processor: the speedup check needs at least two')
@@ -0,0 +1,179 @@
+import numpy as np
+
+# --------------------------------------------------------------------------
+# Spatial index for locating points in a triangular mesh.
+#
+# The bounding box of the mesh is covered by a uniform grid of buckets, and
+# each bucket lists the elements whose bounding boxes overlap it (in CSR
+# form). To locate a batch of points, each point is assigned to its bucket
+# and tested against that bucket's elements, all with array operations.
+#
+# locate() returns, for an (M,2) array of points, the index of the element
+# containing each point (-1 for points outside the mesh) and the (M,3)
+# barycentric coordinates of each point in that element. interpolate()
+# evaluates the piecewise linear interpolant of a vertex field at points.
+#
+# Works with both LoadableMesh2D and CompressedMesh2D.
+# --------------------------------------------------------------------------
+
+class PointLocator:
+
+    # The grid has roughly elemsPerBucket elements per bucket. A point is
+    # considered to be inside an element if all its barycentric coordinates
+    # are at least -tol, so that points on shared sides are found.
+    def __init__(self, mesh, elemsPerBucket=1.0, tol=1.0e-12):
+        self.tol = tol
+        self.verts = np.asarray(mesh.verts, dtype=np.float64).reshape(-1,2)
+        self.elems = np.asarray(mesh.elems, dtype=np.int64).reshape(-1,3)
+        numElems = len(self.elems)
+
+        corners = self.verts[self.elems]                   # (numElems, 3, 2)
+        elemLo = corners.min(axis=1)
+        elemHi = corners.max(axis=1)
+
+        # Set up the grid, with buckets that are roughly square
+        self.lo = self.verts.min(axis=0)
+        extent = np.maximum(self.verts.max(axis=0) - self.lo, 1.0e-300)
+        numBuckets = max(1.0, numElems/elemsPerBucket)
+        h = np.sqrt(extent[0]*extent[1]/numBuckets)
+        if h==0.0:
+            h = max(extent)/numBuckets
+        self.shape = np.maximum(np.ceil(extent/h).astype(np.int64), 1)
+        self.h = extent/self.shape
+
+        # Bucket index ranges covered by each element's bounding box
+        ij0 = self.bucketCoords(elemLo)
+        ij1 = self.bucketCoords(elemHi)
+        width = ij1[:,0] - ij0[:,0] + 1
+        counts = width*(ij1[:,1] - ij0[:,1] + 1)
+
+        # Expand into (element, bucket) pairs
+        owner = np.repeat(np.arange(numElems), counts)
+        start = np.zeros(numElems+1, dtype=np.int64)
+        np.cumsum(counts, out=start[1:])
+        k = np.arange(start[-1]) - start[owner]
+        i = ij0[owner,0] + k % width[owner]
+        j = ij0[owner,1] + k // width[owner]
+        bucket = i + self.shape[0]*j
+
+        order = np.argsort(bucket, kind='stable')
+        self.bucketElems = owner[order]
+        self.bucketOffsets = np.zeros(self.shape[0]*self.shape[1]+1,
+                                      dtype=np.int64)
+        np.cumsum(np.bincount(bucket, minlength=self.shape[0]*self.shape[1]),
+                  out=self.bucketOffsets[1:])
+
+        # Inverse of the affine map from the reference triangle to each
+        # element, for computing barycentric coordinates
+        self.origin = corners[:,0,:]
+        J = np.stack([corners[:,1,:] - corners[:,0,:],
+                      corners[:,2,:] - corners[:,0,:]], axis=2)
+        self.invJ = np.linalg.inv(J)
+
+    # Grid coordinates (i,j) of the buckets holding the given points,
+    # clipped to the grid
+    def bucketCoords(self, points):
+        ij = np.floor((points - self.lo)/self.h).astype(np.int64)
+        return np.clip(ij, 0, self.shape-1)
+
+    # Find the elements containing an (M,2) array of points. Returns
+    # (elemIndex, bary): elemIndex is -1 for points not in the mesh, and
+    # bary holds the barycentric coordinates (zero where not found).
+    # Points are processed in chunks to limit temporary memory.
+    def locate(self, points, chunkSize=100000):
+        points = np.asarray(points, dtype=np.float64).reshape(-1,2)
+        M = len(points)
+        elemIndex = -np.ones(M, dtype=np.int64)
+        bary = np.zeros((M,3))
+        for lo in range(0, M, chunkSize):
+            hi = min(M, lo+chunkSize)
+            elemIndex[lo:hi], bary[lo:hi] = self.locateChunk(points[lo:hi])
+        return elemIndex, bary
+
+    # Evaluate the piecewise linear interpolant of a vertex field at an
+    # (M,2) array of points. Points outside the mesh get the fill value.
+    def interpolate(self, field, points, fill=np.nan):
+        field = np.asarray(field, dtype=np.float64)
+        elemIndex, bary = self.locate(points)
+        found = elemIndex >= 0
+        values = np.full(len(elemIndex), fill, dtype=np.float64)
+        nodes = self.elems[elemIndex[found]]
+        values[found] = np.sum(bary[found]*field[nodes], axis=1)
+        return values
+
+    # ---- Functions past this point are for internal use
+
+    def locateChunk(self, points):
+        M = len(points)
+        elemIndex = -np.ones(M, dtype=np.int64)
+        bary = np.zeros((M,3))
+
+        # Points outside the grid can't be in the mesh
+        rel = (points - self.lo)/self.h
+        inGrid = np.all((rel >= -self.tol) & (rel <= self.shape + self.tol),
+                        axis=1)
+        ij = self.bucketCoords(points)
+        bucket = ij[:,0] + self.shape[0]*ij[:,1]
+
+        # Expand into (point, candidate element) pairs
+        counts = np.where(inGrid, self.bucketOffsets[bucket+1]
+                          - self.bucketOffsets[bucket], 0)
+        pt = np.repeat(np.arange(M), counts)
+        start = np.zeros(M+1, dtype=np.int64)
+        np.cumsum(counts, out=start[1:])
+        k = np.arange(start[-1]) - start[pt]
+        cand = self.bucketElems[self.bucketOffsets[bucket[pt]] + k]
+
+        # Barycentric coordinates of each point in each candidate
+        d = points[pt] - self.origin[cand]
+        xi = np.einsum('nij,nj->ni', self.invJ[cand], d)
+        lam = np.column_stack([1.0 - xi[:,0] - xi[:,1], xi[:,0], xi[:,1]])
+        inside = np.all(lam >= -self.tol, axis=1)
+
+        # Keep the first containing element for each point
+        hitPts, first = np.unique(pt[inside], return_index=True)
+        hits = np.flatnonzero(inside)[first]
+        elemIndex[hitPts] = cand[hits]
+        bary[hitPts] = lam[hits]
+        return elemIndex, bary
+
+
+# ---------------------------------------------------------------------------
+# Test code
+
+if __name__=='__main__':
+
+    import time
+    from TriangleMeshReader import TriangleMeshReader
+    from UniformTriangularRefinement import VectorizedUniformTriangularRefinement
+
+    mesh = TriangleMeshReader('TestMeshes/oneHole.1', bulk=True).getMesh()
+    for i in range(5):
+        mesh, up, down = VectorizedUniformTriangularRefinement(mesh)
+
+    start = time.perf_counter()
+    locator = PointLocator(mesh)
+    print('index for %d elements built in %.3f s'
+        % (len(mesh.elems), time.perf_counter()-start))
+
+    rng = np.random.default_rng(1)
+    points = rng.uniform(-0.1, 2.1, size=(200000, 2))
+
+    start = time.perf_counter()
+    elemIndex, bary = locator.locate(points)
+    print('located %d points in %.3f s, %d inside the mesh'
+        % (len(points), time.perf_counter()-start, np.sum(elemIndex>=0)))
+
+    # A linear function is interpolated exactly
+    f = 1.0 + 2.0*mesh.verts[:,0] - 3.0*mesh.verts[:,1]
+    vals = locator.interpolate(f, points)
+    inside = elemIndex >= 0
+    exact = 1.0 + 2.0*points[:,0] - 3.0*points[:,1]
+    print('max interpolation error: %g'
+        % np.max(np.abs(vals[inside] - exact[inside])))
+
+    # The square hole [0.5,1.5]^2 is not part of the mesh
+    hole = np.all((points > 0.5+1.0e-9) & (points < 1.5-1.0e-9), axis=1)
+    square = np.all((points >= 0.0) & (points <= 2.0), axis=1)
+    print('points in the hole found: %d, points in the domain missed: %d'
+        % (np.sum(inside & hole), np.sum(~inside & square & ~hole)))
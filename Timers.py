@@ -0,0 +1,252 @@
+import functools
+import json
+import sys
+import time
+
+# --------------------------------------------------------------------------
+# Timers and counters for finding where the time goes in reading, refining,
+# and writing meshes.
+#
+# Instrumentation is off by default. Turn it on with enable(), run the
+# code, and print the results with report(), or get them as a dictionary
+# with summary() or as JSON with writeJSON(). reset() clears the results.
+#
+# Timers are named and nest: a timer started while another is running is
+# recorded as its child, under the path "parent/child", so the same name
+# can appear under different parents. Each timer records its number of
+# calls, its total time, and its self time (total minus the time of its
+# children). Time code with one of
+# --- with Timers.timer('name'): ...
+# --- the decorator @Timers.timed('name') on a function or method
+#
+# Counters are named totals, such as the number of entities created or
+# bytes written, incremented with count('name', n). Every refiner counts
+# refine.vertsCreated as the vertices it adds, not those carried over from
+# the coarse mesh.
+#
+# When instrumentation is off, timer() returns a shared object whose
+# enter and exit do nothing, and count() returns at once, so the cost is a
+# function call. Counts inside hot loops should still be accumulated
+# locally and passed to count() once after the loop.
+# --------------------------------------------------------------------------
+
+enabled = False
+
+# Paths of the timers currently running, innermost last
+stack = []
+# Path -> [calls, total seconds], in the order the timers were first started
+timings = {}
+# Name -> total
+counters = {}
+
+
+def enable(flag=True):
+    global enabled
+    enabled = flag
+
+
+def disable():
+    enable(False)
+
+
+def isEnabled():
+    return enabled
+
+
+# Clear all timings and counts
+def reset():
+    del stack[:]
+    timings.clear()
+    counters.clear()
+
+
+# A timer for use in a with statement
+def timer(name):
+    if not enabled:
+        return nullTimer
+    return RunningTimer(name)
+
+
+# Decorator timing every call of a function
+def timed(name):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with RunningTimer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Add n to a counter
+def count(name, n=1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+
+# The timings and counters as a dictionary. Timers are listed by path with
+# their calls, total and self times in seconds.
+def summary():
+    totals = {path : rec[1] for path, rec in timings.items()}
+    childTime = dict.fromkeys(totals, 0.0)
+    for path, t in totals.items():
+        parent = path.rpartition('/')[0]
+        if parent in childTime:
+            childTime[parent] += t
+
+    # List children after their parents, in the order they were started
+    rank = {path : i for i, path in enumerate(timings)}
+    def treeOrder(path):
+        parts = path.split('/')
+        return [rank.get('/'.join(parts[:k+1]), -1) for k in range(len(parts))]
+
+    timers = {}
+    for path in sorted(timings, key=treeOrder):
+        calls, total = timings[path]
+        timers[path] = {'calls' : calls, 'total' : total,
+                        'self' : total - childTime[path]}
+    return {'timers' : timers, 'counters' : dict(counters)}
+
+
+# Print the timers as an indented tree, followed by the counters
+def report(file=sys.stdout):
+    s = summary()
+    file.write('%-48s %8s %12s %12s\n' % ('timer', 'calls', 'total (s)',
+                                          'self (s)'))
+    for path, t in s['timers'].items():
+        depth = path.count('/')
+        label = '  '*depth + path.rpartition('/')[2]
+        file.write('%-48s %8d %12.4f %12.4f\n' % (label, t['calls'],
+                                                  t['total'], t['self']))
+    if len(s['counters'])>0:
+        file.write('\n%-48s %21s\n' % ('counter', 'count'))
+        for name in sorted(s['counters']):
+            file.write('%-48s %21d\n' % (name, s['counters'][name]))
+
+
+# Write the summary as JSON to a file name or an open file
+def writeJSON(file):
+    if isinstance(file, str):
+        with open(file, 'w') as f:
+            json.dump(summary(), f, indent=2)
+    else:
+        json.dump(summary(), file, indent=2)
+
+
+# ---- Functions past this point are for internal use
+
+class RunningTimer:
+
+    def __init__(self, name):
+        if len(stack)>0:
+            self.path = stack[-1] + '/' + name
+        else:
+            self.path = name
+
+    def __enter__(self):
+        stack.append(self.path)
+        if self.path not in timings:
+            timings[self.path] = [0, 0.0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        elapsed = time.perf_counter() - self.start
+        rec = timings[self.path]
+        rec[0] += 1
+        rec[1] += elapsed
+        # Pop through anything left running by an exception
+        while len(stack)>0 and stack.pop() != self.path:
+            pass
+        return False
+
+
+class NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+
+nullTimer = NullTimer()
+
+
+# ---------------------------------------------------------------------------
+# Test code: check the bookkeeping, time the reading and refinement of a
+# mesh, and measure the cost of the instrumentation when it's off
+
+if __name__=='__main__':
+
+    # Run as a script, this file is __main__, not the Timers module the
+    # other modules report to
+    import Timers
+    from TriangleMeshReader import TriangleMeshReader
+    from UniformRefinementSequence import UniformRefinementSequence
+    from UniformTriangularRefinement import VectorizedUniformTriangularRefinement
+
+    Timers.enable()
+    with Timers.timer('outer'):
+        for i in range(3):
+            with Timers.timer('inner'):
+                Timers.count('items', 2)
+    @Timers.timed('decorated')
+    def work():
+        with Timers.timer('inner'):
+            pass
+    work()
+    s = Timers.summary()
+    ok = (list(s['timers'].keys())
+              == ['outer', 'outer/inner', 'decorated', 'decorated/inner']
+          and s['timers']['outer/inner']['calls']==3
+          and s['timers']['outer']['self'] >= 0.0
+          and s['counters']=={'items' : 6}
+          and len(Timers.stack)==0)
+    print('bookkeeping %s' % ('ok' if ok else 'wrong: %s' % s))
+    if not ok:
+        raise RuntimeError('Timers check failed')
+
+    # Every refiner counts only the vertices it adds
+    from UniformTriangularRefinement import UniformTriangularRefinement
+    from ParallelUniformTriangularRefinement import \
+        ParallelUniformTriangularRefinement
+    from AdaptiveTriangularRefinement import AdaptiveTriangularRefinement
+    from UniformLineRefinement import UniformLineRefinement
+    from UniformLineMesher import UniformLineMesh
+    mesh = TriangleMeshReader('TestMeshes/oneHole.1').getMesh()
+    refiners = [('uniform', mesh, UniformTriangularRefinement),
+        ('vectorized', mesh, VectorizedUniformTriangularRefinement),
+        ('parallel', mesh, lambda m: ParallelUniformTriangularRefinement(m,
+            numProcs=1, minProcs=1, minElemsPerProc=0)),
+        ('adaptive', mesh, lambda m: AdaptiveTriangularRefinement(m,
+            range(0, len(m.elems), 3))),
+        ('line', UniformLineMesh(0.0, 1.0, 4), UniformLineRefinement)]
+    for name, coarse, refiner in refiners:
+        Timers.reset()
+        fine = refiner(coarse)[0]
+        created = Timers.summary()['counters'].get('refine.vertsCreated')
+        if created != len(fine.verts) - len(coarse.verts):
+            raise RuntimeError('%s refiner counted %s vertices created, '
+                'but added %d' % (name, created,
+                                  len(fine.verts) - len(coarse.verts)))
+    print('vertices created counted correctly by every refiner')
+
+    Timers.reset()
+    seq = UniformRefinementSequence(mesh, 3)
+    seq = UniformRefinementSequence(mesh, 6, lazy=True,
+        refiner=VectorizedUniformTriangularRefinement)
+    seq.mesh(5)
+    Timers.report()
+    Timers.writeJSON('timers.json')
+
+    Timers.disable()
+    n = 1000000
+    start = time.perf_counter()
+    for i in range(n):
+        with Timers.timer('x'):
+            Timers.count('y')
+    print('\ndisabled timer and counter: %.3g us per use'
+        % (1.0e6*(time.perf_counter()-start)/n))
@@ -0,0 +1,54 @@
+import numpy as np
+import scipy.sparse as sp
+
+# --------------------------------------------------------------------------
+# Construction of the update (prolongation) and downdate (restriction)
+# operators between a coarse mesh and its refinement.
+#
+# The refiners record the update operator as flat arrays of
+# (fine row, coarse column, weight) triplets. The update matrix is
+# assembled directly from these in COO form and converted to CSR. The
+# downdate operator is the transpose of the update operator with its rows
+# normalized by their sums, D^{-1} U^T, where D is the diagonal matrix of
+# row sums of U^T.
+# --------------------------------------------------------------------------
+
+def makeTransferOperators(numFine, numCoarse, rows, cols, vals):
+
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    vals = np.asarray(vals, dtype=np.float64)
+
+    # Duplicate (row, col) entries are summed on conversion to CSR
+    update = sp.coo_matrix((vals, (rows, cols)),
+                           shape=(numFine, numCoarse)).tocsr()
+
+    # Scale the rows of the transpose by the inverse of their sums. Rows
+    # with no entries are left empty.
+    upT = update.transpose().tocsr()
+    rowSums = np.asarray(upT.sum(axis=1)).ravel()
+    scale = np.zeros(numCoarse)
+    nonzero = rowSums != 0.0
+    scale[nonzero] = 1.0/rowSums[nonzero]
+    downdate = (sp.diags(scale) @ upT).tocsr()
+
+    return (update, downdate)
+
+
+# ---------------------------------------------------------------------------
+# Test code
+
+if __name__=='__main__':
+
+    # Refinement of a single interval [0,1] into [0, 1/2] and [1/2, 1]
+    rows = [0, 1, 1, 2]
+    cols = [0, 0, 1, 1]
+    vals = [1.0, 0.5, 0.5, 1.0]
+
+    up, down = makeTransferOperators(3, 2, rows, cols, vals)
+
+    print('--- update operator ---')
+    print(up.todense())
+
+    print('--- downdate operator ---')
+    print(down.todense())
@@ -1,4 +1,7 @@
 from LoadableMesh2D import *
+import numpy as np
+import os
+import Timers
 
 # --------------------------------------------------------------------------
 # Reader for constructing a mesh from data stored in the file formats
@@ -16,6 +19,13 @@ from LoadableMesh2D import *
 # If no boundary markers are provided, all edges will be given the label "0".
 # If edges have boundary markers, those markers are used as labels.
 #
+# Each file is parsed into NumPy arrays in a single pass. By default the
+# arrays are loaded into a LoadableMesh2D with its bulk insertion
+# functions. For large meshes, construct the reader with bulk=True, and
+# getMesh() builds a CompressedMesh2D directly from the arrays.
+#
+# With Timers enabled, reading is timed per file, and the numbers of
+# entities and bytes read are counted.
 #
 # Katharine Long, Sep 2020
 # For Math 5344
@@ -24,20 +34,133 @@ from LoadableMesh2D import *
 class TriangleMeshReader:
     # Create a reader object to read a mesh from the files
     # filename.node, filename.edge, and filename.ele
-    def __init__(self, filename):
+    def __init__(self, filename, bulk=False):
         self.filename = filename
         self.offset = 0
+        self.bulk = bulk
 
     # Call this function to read the mesh and return it to the user
+    @Timers.timed('TriangleMeshReader')
     def getMesh(self):
+        if self.bulk:
+            return self.getCompressedMesh()
+
         mesh = LoadableMesh2D()
         self.readVerts(mesh)
         self.readSides(mesh)
         self.readElems(mesh)
         return mesh
 
+    # Read the mesh in bulk mode, returning a CompressedMesh2D
+    def getCompressedMesh(self):
+        from CompressedMesh2D import CompressedMesh2D
+
+        verts = self.readVertArray()
+        sides, labels = self.readSideArrays()
+        elems = self.readElemArray()
+        return CompressedMesh2D(verts, elems, sides, labels)
+
+    # Read the .node file into a (numVerts, 2) array of coordinates.
+    # Sets self.offset from the index of the first vertex.
+    def readVertArray(self):
+        header, body = self.readTable('node', np.float64)
+        nNodes, dim = header[0], header[1]
+        if dim != 2:
+            raise ValueError('expected 2D vertices in %s.node, got dim=%d'
+                % (self.filename, dim))
+
+        index = body[:,0].astype(np.int64)
+        self.offset = int(index[0]) if nNodes>0 else 0
+        index -= self.offset
+        self.checkIndices(index, nNodes, 'node')
+        verts = np.empty((nNodes, 2))
+        verts[index] = body[:,1:3]
+        Timers.count('reader.verts', nNodes)
+
+        # Ensure that no vertex is a duplicate
+        if len(np.unique(verts, axis=0)) != nNodes:
+            raise RuntimeError('duplicate vertices in %s.node' % self.filename)
+        return verts
+
+    # Read the .edge file into a (numSides, 2) array of vertex indices and
+    # an array of labels. Must be called after readVertArray().
+    def readSideArrays(self):
+        header, body = self.readTable('edge', np.int64)
+        nSides = header[0]
+        nMarkers = header[1] if len(header)>1 else 0
+
+        index = body[:,0] - self.offset
+        self.checkIndices(index, nSides, 'edge')
+        sides = np.empty((nSides, 2), dtype=np.int64)
+        sides[index] = body[:,1:3] - self.offset
+        labels = np.zeros(nSides, dtype=np.int64)
+        if nMarkers>0:
+            labels[index] = body[:,3]
+        Timers.count('reader.sides', nSides)
+        return sides, labels
+
+    # Read the .ele file into a (numElems, 3) array of vertex indices. Must
+    # be called after readVertArray(). Only the three corner vertices of
+    # higher-order (6-node) triangles are kept, and regional attributes,
+    # which can be floats, are skipped.
+    def readElemArray(self):
+        header, body = self.readTable('ele', np.int64, usecols=(0,1,2,3))
+        nElems = header[0]
+        index = body[:,0] - self.offset
+        self.checkIndices(index, nElems, 'ele')
+        elems = np.empty((nElems, 3), dtype=np.int64)
+        elems[index] = body[:,1:4] - self.offset
+        Timers.count('reader.elems', nElems)
+        return elems
+
     # ---- Functions past this point are for internal use
 
+    # Read a Triangle file with the given suffix. Returns the integer header
+    # entries and the body as a 2D array with one row per entity. The header
+    # is the first line with content; the body is the next N lines of
+    # content, where N is the first header entry. Comments and blank lines
+    # are skipped by NumPy's parser. If usecols is given, only those columns
+    # are parsed.
+    def readTable(self, suffix, dtype, usecols=None):
+        name = '%s.%s' % (self.filename, suffix)
+        if Timers.enabled:
+            Timers.count('reader.bytesRead', os.path.getsize(name))
+        with Timers.timer('read .%s' % suffix), open(name) as f:
+            header = []
+            while len(header)==0:
+                line = f.readline()
+                if len(line)==0:
+                    raise RuntimeError('no header found in %s.%s'
+                        % (self.filename, suffix))
+                header = self.tokenize(line)
+            header = [int(h) for h in header]
+
+            n = header[0]
+            if n==0:
+                return header, np.zeros((0, 4), dtype=dtype)
+            body = np.loadtxt(f, dtype=dtype, comments='#', max_rows=n,
+                usecols=usecols, ndmin=2)
+
+        if len(body) != n:
+            raise RuntimeError('expected %d entries in %s.%s, found %d'
+                % (n, self.filename, suffix, len(body)))
+        return header, body
+
+
+    # Check that the index column of a file numbers its n entries exactly
+    # once each, so that every row of the output array is filled
+    def checkIndices(self, index, n, suffix):
+        if len(index)>0 and (index.min()<0 or index.max()>=n):
+            raise ValueError('%s.%s: entry index %d out of range for %d '
+                'entries numbered from %d' % (self.filename, suffix,
+                (index.min() if index.min()<0 else index.max()) + self.offset,
+                n, self.offset))
+        counts = np.bincount(index, minlength=n)
+        if np.any(counts!=1):
+            raise ValueError('%s.%s: entry index %d appears %d times'
+                % (self.filename, suffix, np.argmax(counts!=1) + self.offset,
+                   counts[np.argmax(counts!=1)]))
+
     # Tokenize a line after stripping comments
     def tokenize(self, line):
         # Strip comments
@@ -54,91 +177,16 @@ class TriangleMeshReader:
 
     # Read the vertices from the .node file
     def readVerts(self, mesh):
-
-        #print('reading verts')
-
-        with open('%s.node' % self.filename) as f:
-
-            lineCount = 0
-
-            for line in f:
-                toks = self.tokenize(line)
-                if len(toks)==0:
-                    continue
-
-                # If this is our first line of content, the number of nodes
-                # is the first entry.
-                if lineCount==0:
-                    nNodes = int(toks[0])
-                    #print('nVerts = %d' % nNodes)
-                    lineCount +=1
-                    continue
-
-                # If this is our first node, use its index to determine whether
-                # indices are numbered starting from 0 or from 1.
-                if lineCount==1:
-                    self.offset = int(toks[0])
-
-                # Add the vertex to the mesh
-                v = (float(toks[1 ]), float(toks[2]))
-                mesh.addVertex(v)
-
-                lineCount += 1
-
+        mesh.addVertices(self.readVertArray())
 
     # Read the sides from the .edge file
     def readSides(self, mesh):
-
-        #print('reading edges')
-
-        with open('%s.edge' % self.filename) as f:
-
-            first = True
-
-            for line in f:
-                toks = self.tokenize(line)
-                if len(toks)==0:
-                    continue
-
-                if first:
-                    nSides = int(toks[0])
-                    #print('nSides = %d' % nSides)
-                    first = False
-                    continue
-
-                s = [int(toks[1])-self.offset, int(toks[2])-self.offset]
-                if len(toks)>=4:
-                    label = int(toks[3])
-                else:
-                    label = 0
-                mesh.addSide(s[0], s[1], label)
-
-
+        sides, labels = self.readSideArrays()
+        mesh.addSides(sides, labels)
 
     # Read the elements from the .ele file
     def readElems(self, mesh):
-
-        #print('reading elems')
-
-        with open('%s.ele' % self.filename) as f:
-
-            first = True
-
-            for line in f:
-                toks = self.tokenize(line)
-                if len(toks)==0:
-                    continue
-
-                if first:
-                    nElems = int(toks[0])
-                    #print('nElems = %d' % nElems)
-                    first = False
-                    continue
-
-                a = int(toks[1])-self.offset
-                b = int(toks[2])-self.offset
-                c = int(toks[3])-self.offset
-                mesh.addElem(a,b,c)
+        mesh.addElems(self.readElemArray())
 
 
 # ------------------------------------------------------------------------
@@ -163,10 +211,11 @@ def writeExampleTriangleFiles():
     4 0 2 0
     """
 
+    # Regional attributes, as written by triangle -A, can be floats
     elemData = """
-    2 3 0
-    0 0 1 2
-    1 0 2 3
+    2 3 1
+    0 0 1 2 1.5
+    1 0 2 3 -2.25
     """
 
 
@@ -186,6 +235,24 @@ def writeExampleTriangleFiles():
 # ---------------------------------------------------------------------------
 # Test code
 
+# Reference reader that parses the files line by line, as the reader did
+# before the array parser. Returns the vertex, side, label, and element
+# lists.
+def readByLines(filename):
+    tables = []
+    for suffix in ('node', 'edge', 'ele'):
+        with open('%s.%s' % (filename, suffix)) as f:
+            rows = [line.split('#')[0].split() for line in f]
+        tables.append([r for r in rows if len(r)>0][1:])
+    nodes, edges, eles = tables
+    offset = int(nodes[0][0])
+    verts = [(float(r[1]), float(r[2])) for r in nodes]
+    sides = [tuple(sorted((int(r[1])-offset, int(r[2])-offset))) for r in edges]
+    labels = [int(r[3]) if len(r)>=4 else 0 for r in edges]
+    elems = [tuple(int(r[k])-offset for k in (1,2,3)) for r in eles]
+    return verts, sides, labels, elems
+
+
 if __name__=='__main__':
 
     tmpName = writeExampleTriangleFiles()
@@ -194,3 +261,32 @@ if __name__=='__main__':
     reader = TriangleMeshReader(tmpName)
     mesh = reader.getMesh()
     mesh.dump()
+
+    bulkMesh = TriangleMeshReader(tmpName, bulk=True).getMesh()
+    bulkMesh.dump()
+
+    # Both readers against the line-by-line reference
+    ok = True
+    for name in (tmpName, 'TestMeshes/oneHole.1', 'TestMeshes/coarse'):
+        verts, sides, labels, elems = readByLines(name)
+        same = True
+        for m in (TriangleMeshReader(name).getMesh(),
+                  TriangleMeshReader(name, bulk=True).getMesh()):
+            same = same and (np.array_equal(np.asarray(m.verts), verts)
+                and np.array_equal(np.sort(np.asarray(m.sides), axis=1), sides)
+                and np.array_equal(np.asarray(m.sideLabels), labels)
+                and np.array_equal(np.asarray(m.elems), elems))
+        ok = ok and same
+        print('%-24s readers match line-by-line reference: %s' % (name, same))
+
+    # Index columns that skip or repeat an entry are rejected
+    with open('%s.ele' % tmpName, 'w') as f:
+        f.write('2 3 0\n0 0 1 2\n0 0 2 3\n')
+    try:
+        TriangleMeshReader(tmpName, bulk=True).getMesh()
+        ok = False
+    except ValueError as e:
+        print('bad index column rejected: %s' % e)
+
+    if not ok:
+        raise RuntimeError('TriangleMeshReader check failed')
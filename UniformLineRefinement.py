@@ -1,7 +1,9 @@
 import numpy as np
 from LoadableMesh1D import LoadableMesh1D
-import scipy.sparse as sp
+from TransferOperators import makeTransferOperators
+import Timers
 
+@Timers.timed('UniformLineRefinement')
 def UniformLineRefinement(coarse, verb=0):
 
     coarse = coarse
@@ -11,7 +13,9 @@ def UniformLineRefinement(coarse, verb=0):
     numElems = len(coarse.elems)
     numNewVerts = numVerts + numElems
 
-    updateIndices = []
+    # Triplets (fine row, coarse column, weight) for the update operator
+    updateRows = []
+    updateCols = []
     updateVals = []
 
 
@@ -23,8 +27,9 @@ def UniformLineRefinement(coarse, verb=0):
       if ie==0:
         fine.addVertex(coarse.verts[0], coarse.vertLabels[0])
         leftID = 0
-        updateIndices.append([ie])
-        updateVals.append([1.0])
+        updateRows.append(leftID)
+        updateCols.append(ie)
+        updateVals.append(1.0)
       else:
         leftID = 2*ie
       # new vertex is the midpoint of the old element
@@ -34,45 +39,26 @@ def UniformLineRefinement(coarse, verb=0):
       fine.addElem(leftID, midID, coarse.elemLabels[ie])
       fine.addElem(midID, rightID, coarse.elemLabels[ie])
 
-      updateIndices.append([ie, ie+1])
-      updateIndices.append([ie+1])
-
-      updateVals.append([0.5, 0.5])
-      updateVals.append([1.0])
+      updateRows.extend((midID, midID, rightID))
+      updateCols.extend((ie, ie+1, ie+1))
+      updateVals.extend((0.5, 0.5, 1.0))
 
     #print('--- refined mesh --- ')
     #fine.dump()
 
     #print('--- update information ---')
-    #for i,(ind,val) in enumerate(zip(updateIndices, updateVals)):
-    #  print('%6d %20s %20s' % (i, ind, val))
+    #for i,(r,c,val) in enumerate(zip(updateRows, updateCols, updateVals)):
+    #  print('%6d %6d %6d %20s' % (i, r, c, val))
+
+    Timers.count('refine.vertsCreated', numElems)
+    Timers.count('refine.elemsCreated', 2*numElems)
 
     # -- Refinement is done. Create the prolongation and restriction operators.
     # The update operator uses interpolation. The downdate operator is the
     # normalized transpose of the update operator.
 
-    # build the matrices in DOK form
-    update = sp.dok_matrix((numNewVerts, numVerts))
-    downdate = sp.dok_matrix((numVerts, numNewVerts))
-    for r in range(numNewVerts):
-        for c,v in zip(updateIndices[r],updateVals[r]):
-            update[r,c]=v
-            downdate[c,r]=v
-
-    # Update matrix is ready; convert to CSR
-    update = update.tocsr()
-
-    # Normalize the rows of the downdate operator by the row sum.
-    # Start by converting to list-of-list format
-    downdate = downdate.tolil()
-    # normalize rows
-    for r in range(numVerts):
-        row = downdate.getrowview(r)
-        nrm = row.sum()
-        row /= nrm
-
-    # Convert to CSR
-    downdate = downdate.tocsr()
+    update, downdate = makeTransferOperators(numNewVerts, numVerts,
+        updateRows, updateCols, updateVals)
 
     return (fine, update, downdate)
 
@@ -1,66 +1,128 @@
 from LoadableMesh2D import LoadableMesh2D
-
-def findSides(elems):
-
-  sides = set()
-
-  for e in elems:
-    pairs = ([e[0], e[1]], [e[1], e[2]], [e[2], e[0]])
-    for p in pairs:
-      p.sort()
-      s = tuple(p)
-      sides.add(s)
-
-  return sides
+import numpy as np
 
 def runningVertIndex(nx, ix, iy):
   return ix + (nx+1)*iy
 
-def runningElemIndex(nx, ix, iy):
-  return ix + nx*iy
-
-
-def UniformRectangleMesher(ax, bx, nx, ay, by, ny):
 
+# Labels given to the sides on each part of the rectangle's boundary.
+# Interior sides have label 0.
+SOUTH = 1
+EAST = 2
+NORTH = 3
+WEST = 4
+
+# --------------------------------------------------------------------------
+# Mesh the rectangle [ax,bx] x [ay,by] with nx by ny cells, each split into
+# two triangles with diagonals that alternate in a checkerboard pattern.
+# Vertex (ix,iy) has index ix + (nx+1)*iy.
+#
+# Coordinates, elements, sides, and side labels are all produced with NumPy
+# index arithmetic. The sides are ordered as the horizontal sides, then the
+# vertical sides, then the diagonals. Boundary sides are labeled SOUTH,
+# EAST, NORTH, and WEST. The sides of each element are known from the grid
+# structure, so the element-to-edge map is computed directly rather than
+# searched for. Index arrays are int32, the index type of CompressedMesh2D,
+# so grids with more than 2**31-1 sides are rejected with a ValueError.
+#
+# By default the result is a LoadableMesh2D. With compressed=True, a
+# CompressedMesh2D is built directly from the arrays, which is much faster
+# and smaller for large grids.
+# --------------------------------------------------------------------------
+
+def UniformRectangleMesher(ax, bx, nx, ay, by, ny, compressed=False):
+
+  # Every index computed below is less than the number of sides
+  numSides = nx*(ny+1) + (nx+1)*ny + nx*ny
+  if numSides > np.iinfo(np.int32).max:
+    raise ValueError('a %dx%d grid has %d sides, too many for int32 indices'
+      % (nx, ny, numSides))
+  idx = np.int32
 
   # create the vertices
-  verts = []
-  for iy in range(ny+1):
-    for ix in range (nx+1):
-      x = ax + ix*(bx-ax)/float(nx)
-      y = ay + iy*(by-ay)/float(ny)
-      verts.append((x,y))
-
-  # create the triangles
-  elems = []
-  for iy in range(ny):
-    for ix in range(nx):
-      a = runningVertIndex(nx, ix, iy)
-      b = runningVertIndex(nx, ix+1, iy)
-      c = runningVertIndex(nx, ix+1, iy+1)
-      d = runningVertIndex(nx, ix, iy+1)
-      if (ix+iy)%2==0:
-        T1 = (a,b,c)
-        T2 = (a,c,d)
-      else:
-        T1 = (a,b,d)
-        T2 = (b,c,d)
-      elems.append(T1)
-      elems.append(T2)
-
-  sides = findSides(elems)
+  x = ax + np.arange(nx+1)*(bx-ax)/float(nx)
+  y = ay + np.arange(ny+1)*(by-ay)/float(ny)
+  verts = np.empty(((nx+1)*(ny+1), 2))
+  verts[:,0] = np.tile(x, ny+1)
+  verts[:,1] = np.repeat(y, nx+1)
+
+  # cell indices, in the order ix fastest
+  ix = np.tile(np.arange(nx, dtype=idx), ny)
+  iy = np.repeat(np.arange(ny, dtype=idx), nx)
+  even = ((ix+iy)%2==0)
+
+  # corners of each cell
+  a = runningVertIndex(nx, ix, iy)
+  b = a + 1
+  d = a + (nx+1)
+  c = d + 1
+
+  # create the sides: first the nx*(ny+1) horizontal sides, with side
+  # (ix,iy)-(ix+1,iy) at ix + nx*iy; then the (nx+1)*ny vertical sides,
+  # with side (ix,iy)-(ix,iy+1) at ix + (nx+1)*iy; then the diagonal
+  # of each cell, in cell order. Cells with ix+iy even are split along
+  # (a,c), the others along (b,d).
+  numHoriz = nx*(ny+1)
+  numVert = (nx+1)*ny
+  numCells = nx*ny
+  sides = np.empty((numHoriz + numVert + numCells, 2), dtype=idx)
+  labels = np.zeros(len(sides), dtype=np.int32)
+
+  h = np.arange(numHoriz, dtype=idx)
+  sides[:numHoriz,0] = h + h//nx
+  sides[:numHoriz,1] = sides[:numHoriz,0] + 1
+  labels[:nx] = SOUTH
+  labels[numHoriz-nx:numHoriz] = NORTH
+
+  v = np.arange(numVert, dtype=idx)
+  sides[numHoriz:numHoriz+numVert,0] = v
+  sides[numHoriz:numHoriz+numVert,1] = v + (nx+1)
+  vertLabels = labels[numHoriz:numHoriz+numVert].reshape(ny, nx+1)
+  vertLabels[:,0] = WEST
+  vertLabels[:,nx] = EAST
+
+  sides[numHoriz+numVert:,0] = np.where(even, a, b)
+  sides[numHoriz+numVert:,1] = np.where(even, c, d)
+
+  # indices of the sides of each cell
+  south = ix + nx*iy
+  north = south + nx
+  west = numHoriz + ix + (nx+1)*iy
+  east = west + 1
+  diag = numHoriz + numVert + np.arange(numCells, dtype=idx)
+
+  # create the triangles and record their sides (p,q), (q,r), (r,p):
+  #   even cells: (a,b,c) with sides south, east, diag
+  #               (a,c,d) with sides diag, north, west
+  #   odd cells:  (a,b,d) with sides south, diag, west
+  #               (b,c,d) with sides east, north, diag
+  elems = np.empty((numCells, 2, 3), dtype=idx)
+  elems[:,0,0] = a
+  elems[:,0,1] = b
+  elems[:,0,2] = np.where(even, c, d)
+  elems[:,1,0] = np.where(even, a, b)
+  elems[:,1,1] = c
+  elems[:,1,2] = d
+  elems = elems.reshape(-1,3)
+
+  elemEdges = np.empty((numCells, 2, 3), dtype=idx)
+  elemEdges[:,0,0] = south
+  elemEdges[:,0,1] = np.where(even, east, diag)
+  elemEdges[:,0,2] = np.where(even, diag, west)
+  elemEdges[:,1,0] = np.where(even, diag, east)
+  elemEdges[:,1,1] = north
+  elemEdges[:,1,2] = np.where(even, west, diag)
+  elemEdges = elemEdges.reshape(-1,3)
+
+  if compressed:
+    from CompressedMesh2D import CompressedMesh2D
+    return CompressedMesh2D(verts, elems, sides, labels, elemEdges,
+                            sidesSorted=True)
 
   mesh = LoadableMesh2D()
-
-  for v in verts:
-    mesh.addVertex(v)
-
-  for s in sides:
-    mesh.addSide(s[0], s[1], 0)
-
-  for e in elems:
-    mesh.addElem(e[0], e[1], e[2])
-
+  mesh.addVertices(verts)
+  mesh.addSides(sides, labels)
+  mesh.addElems(elems)
 
   return mesh
 
@@ -74,3 +136,13 @@ if __name__=='__main__':
   C = set([1, 3, 6, 7, 9])
   viewer = MPLMeshViewer()
   viewer.show(mesh, marked=C)
+
+  # Timing on a larger grid. The size can be given on the command line;
+  # a 4000x4000 grid has 32M elements and needs several GB of memory.
+  import sys
+  import time
+  n = int(sys.argv[1]) if len(sys.argv)>1 else 200
+  start = time.perf_counter()
+  big = UniformRectangleMesher(0.0, 1.0, n, 0.0, 1.0, n, compressed=True)
+  print('%dx%d grid: %d elements in %.2f s' % (n, n, len(big.elems),
+    time.perf_counter()-start))
@@ -5,59 +5,192 @@ from UniformLineRefinement import *
 from UniformTriangularRefinement import *
 
 import scipy.sparse as sp
+import Timers
+
+# --------------------------------------------------------------------------
+# A sequence of uniformly refined meshes, with the update (prolongation)
+# and downdate (restriction) operators between successive levels.
+#
+# By default every level is built when the sequence is constructed. With
+# lazy=True, levels are built on first access through mesh(i), update(i),
+# or downdate(i). In lazy mode a memoryBudget (in bytes) can be given for
+# the meshes: when the meshes held exceed the budget, the least recently
+# used intermediate meshes are evicted and will be regenerated from the
+# nearest coarser mesh if they're needed again. The coarse and finest
+# meshes and all transfer operators are never evicted.
+#
+# The refiner is the same in both modes: UniformLineRefinement for 1D
+# meshes and UniformTriangularRefinement for 2D meshes, unless another is
+# given. For large lazy sequences, pass
+# refiner=VectorizedUniformTriangularRefinement: it's much faster, and the
+# CompressedMesh2D levels it produces report their memory exactly, while
+# the memory of LoadableMesh2D levels is only estimated.
+#
+# Levels refined by other means, such as AdaptiveTriangularRefinement, can
+# be appended with addLevel(). Appended levels are never evicted, since the
+# sequence's refiner can't regenerate them.
+#
+# With Timers enabled, the refinement of each level is timed, and the
+# levels refined and meshes evicted are counted.
+# --------------------------------------------------------------------------
 
 class UniformRefinementSequence:
 
-  def __init__(self, coarse, numLevels, verb=0):
+  def __init__(self, coarse, numLevels, verb=0, lazy=False, memoryBudget=None,
+               refiner=None):
 
-    if coarse.dim==1:
-      refiner = UniformLineRefinement
-    elif coarse.dim==2:
-      refiner = UniformTriangularRefinement
-    else:
-      raise ValueError('mesh dimension %d not supported' % dim)
+    if refiner is None:
+      if coarse.dim==1:
+        refiner = UniformLineRefinement
+      elif coarse.dim==2:
+        refiner = UniformTriangularRefinement
+      else:
+        raise ValueError('mesh dimension %d not supported' % coarse.dim)
+
+    if memoryBudget is not None and not lazy:
+      raise ValueError('a memory budget requires lazy=True')
 
-    self.meshes = []
-    self.meshes.append(coarse)
-    self.updates = []
-    self.downdates = []
+    self.refiner = refiner
+    self.verb = verb
+    self.lazy = lazy
+    self.memoryBudget = memoryBudget
+
+    self.meshes = [None]*numLevels
+    self.meshes[0] = coarse
+    self.updates = [None]*(numLevels-1)
+    self.downdates = [None]*(numLevels-1)
     self.seqA = []
 
-    for i in range(1,numLevels):
-      fine, up, down = refiner(self.meshes[i-1], verb)
-      self.meshes.append(fine)
-      self.updates.append(up)
-      self.downdates.append(down)
+    # Levels in order of most recent use, for eviction
+    self.recentlyUsed = [0]
+    # Levels appended with addLevel()
+    self.addedLevels = set()
+
+    if not lazy:
+      for i in range(1,numLevels):
+        self.refineLevel(i-1)
 
   def numLevels(self):
     return len(self.meshes)
 
   def mesh(self, i):
+    if self.meshes[i] is None:
+      self.materialize(i)
+    self.touch(i)
     return self.meshes[i]
 
   def update(self, i):
+    if self.updates[i] is None:
+      self.materialize(i+1)
     return self.updates[i]
 
   def downdate(self, i):
+    if self.downdates[i] is None:
+      self.materialize(i+1)
     return self.downdates[i]
 
+  # Append a finer level, given the fine mesh and the transfer operators
+  # between it and the current finest mesh
+  def addLevel(self, fine, update, downdate):
+    L = self.numLevels()
+    if update.shape != (len(fine.verts), len(self.mesh(L-1).verts)):
+      raise ValueError('update operator has shape %s, expected %s'
+        % (update.shape, (len(fine.verts), len(self.mesh(L-1).verts))))
+    self.meshes.append(fine)
+    self.updates.append(update)
+    self.downdates.append(downdate)
+    self.addedLevels.add(L)
+    self.touch(L)
+    self.evict()
+
+  # Whether the mesh on level i is currently held in memory
+  def isMaterialized(self, i):
+    return self.meshes[i] is not None
+
+  # Memory held by the meshes currently in memory, in bytes
+  def meshMemory(self):
+    return sum([meshBytes(m) for m in self.meshes if m is not None])
+
 
   def makeMatrixSequence(self, fineA):
-    L = len(self.meshes)
+    L = self.numLevels()
     self.seqA = [None]*L
     self.seqA[L-1]=fineA
     for i in reversed(range(L-1)):
-      self.seqA[i]=self.downdates[i]*(self.seqA[i+1]*self.updates[i])
+      self.seqA[i]=self.downdate(i)*(self.seqA[i+1]*self.update(i))
     
 
   def makeVectorSequence(self, fine_b):
-    L = len(self.meshes)
+    L = self.numLevels()
     seq_b = [None]*L
     seq_b[L-1]=fine_b
     for i in reversed(range(L-1)):
-      seq_b[i]=self.downdates[i]*self.seq_b[i+1]
+      seq_b[i]=self.downdate(i)*seq_b[i+1]
     return seq_b
 
+  # ---- Functions past this point are for internal use
+
+  # Refine the mesh on level i to produce level i+1. Transfer operators that
+  # have already been computed are kept; regenerating a level produces the
+  # same operators again.
+  def refineLevel(self, i):
+    if self.verb>0:
+      print('refining level %d' % i)
+    with Timers.timer('refine level %d' % (i+1)):
+      fine, up, down = self.refiner(self.meshes[i], self.verb)
+    Timers.count('sequence.levelsRefined')
+    self.meshes[i+1] = fine
+    if self.updates[i] is None:
+      self.updates[i] = up
+      self.downdates[i] = down
+
+  # Build level i from the nearest coarser level held in memory
+  def materialize(self, i):
+    j = i
+    while self.meshes[j] is None:
+      j -= 1
+    for k in range(j, i):
+      self.refineLevel(k)
+      self.touch(k+1)
+      # Intermediate meshes can be dropped as soon as they've been used
+      self.evict(keep=(k+1,))
+
+  # Record that level i was used most recently
+  def touch(self, i):
+    if i in self.recentlyUsed:
+      self.recentlyUsed.remove(i)
+    self.recentlyUsed.append(i)
+
+  # Evict least recently used intermediate meshes until the meshes held fit
+  # in the memory budget. Levels listed in keep aren't evicted.
+  def evict(self, keep=()):
+    if self.memoryBudget is None:
+      return
+    L = self.numLevels()
+    for i in list(self.recentlyUsed):
+      if self.meshMemory() <= self.memoryBudget:
+        break
+      if (i==0 or i==L-1 or i in keep or i in self.addedLevels
+          or self.meshes[i] is None):
+        continue
+      if self.verb>0:
+        print('evicting level %d' % i)
+      self.meshes[i] = None
+      self.recentlyUsed.remove(i)
+      Timers.count('sequence.meshesEvicted')
+
+
+# Memory used by a mesh, in bytes. Compressed meshes report this exactly;
+# for loadable meshes it's a rough estimate of the Python objects held.
+def meshBytes(mesh):
+  if hasattr(mesh, 'nbytes'):
+    return mesh.nbytes()
+  bytesPerVert = 250
+  bytesPerElem = 350
+  numSides = len(getattr(mesh, 'sides', []))
+  return (bytesPerVert*len(mesh.verts) + bytesPerElem*len(mesh.elems)
+          + bytesPerVert*numSides)
+
 # ---------------------------------------------------------------------------
 # Test code
 
@@ -115,3 +248,45 @@ if __name__=='__main__':
     w.addField('fUp', fUp[i])
     w.addField('fDown', fDown[i])
     w.write()
+
+  # ---- Lazy sequence with a memory budget small enough that intermediate
+  # meshes are evicted. A regenerated level must be identical to the one
+  # built the first time, and to the eagerly built sequence's.
+  print('-- eviction')
+  refiner = VectorizedUniformTriangularRefinement
+  numLevels = 5
+  eager = UniformRefinementSequence(mesh, numLevels, refiner=refiner)
+  budget = meshBytes(eager.mesh(0)) + meshBytes(eager.mesh(numLevels-1))
+  lazy = UniformRefinementSequence(mesh, numLevels, lazy=True,
+                                   memoryBudget=budget, refiner=refiner)
+
+  def sameMesh(a, b):
+    return all(np.array_equal(getattr(a, name), getattr(b, name))
+               for name in ('verts', 'elems', 'sides', 'sideLabels',
+                            'elemToEdgesMap'))
+
+  def sameMatrix(a, b):
+    return a.shape==b.shape and (a != b).nnz==0
+
+  first = [lazy.mesh(i) for i in range(numLevels)]
+  evicted = [i for i in range(numLevels) if not lazy.isMaterialized(i)]
+  if len(evicted)==0:
+    raise RuntimeError('no level was evicted under a budget of %d bytes'
+      % budget)
+  if lazy.meshMemory() > budget:
+    raise RuntimeError('meshes held use %d bytes, over the budget of %d'
+      % (lazy.meshMemory(), budget))
+
+  for i in evicted:
+    again = lazy.mesh(i)
+    if again is first[i]:
+      raise RuntimeError('level %d was not regenerated' % i)
+    if not (sameMesh(again, first[i]) and sameMesh(again, eager.mesh(i))):
+      raise RuntimeError('regenerated level %d differs' % i)
+    print('level %d evicted and regenerated identically' % i)
+
+  for i in range(numLevels-1):
+    if not (sameMatrix(lazy.update(i), eager.update(i))
+            and sameMatrix(lazy.downdate(i), eager.downdate(i))):
+      raise RuntimeError('transfer operators on level %d differ' % i)
+  print('transfer operators match the eager sequence')
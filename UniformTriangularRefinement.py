@@ -1,7 +1,9 @@
 import numpy as np
 from LoadableMesh2D import *
-import scipy.sparse as sp
+from TransferOperators import makeTransferOperators
+import Timers
 
+@Timers.timed('UniformTriangularRefinement')
 def UniformTriangularRefinement(coarse, verb=0):
 
     coarse = coarse
@@ -11,16 +13,20 @@ def UniformTriangularRefinement(coarse, verb=0):
     numEdges = len(coarse.sides)
     numElems = len(coarse.elems)
 
-    numNewVerts = numVerts + numEdges
+    numFineVerts = numVerts + numEdges
     numNewEdges = 2*numEdges + 3*numElems
     numNewElems = 4*numElems
 
-    vertDone = np.zeros(numVerts, dtype=np.bool)
-    oldEdgeDone = np.zeros(numEdges, dtype=np.bool)
+    vertDone = np.zeros(numVerts, dtype=bool)
+    oldEdgeDone = np.zeros(numEdges, dtype=bool)
     oldToNewVertexMap = -np.ones(numVerts, dtype=np.int64)
     oldEdgeToNewVertMap = -np.ones(numEdges, dtype=np.int64)
+    # The two fine sides each old edge is split into
+    childSides = -np.ones((numEdges, 2), dtype=np.int64)
 
-    updateIndices = []
+    # Triplets (fine row, coarse column, weight) for the update operator
+    updateRows = []
+    updateCols = []
     updateVals = []
 
     elemVerts = np.zeros([numElems, 6], dtype=np.int64)
@@ -49,8 +55,9 @@ def UniformTriangularRefinement(coarse, verb=0):
                 newVertID = fine.addVertex(coarse.verts[oldVertID])
                 # Record the indices and the weights for the update
                 # matrix
-                updateIndices.append([oldVertID])
-                updateVals.append([1.0])
+                updateRows.append(newVertID)
+                updateCols.append(oldVertID)
+                updateVals.append(1.0)
                 elemVerts[el,i]=newVertID
                 oldToNewVertexMap[oldVertID]=newVertID
                 vertDone[oldVertID] = True
@@ -60,15 +67,16 @@ def UniformTriangularRefinement(coarse, verb=0):
         # Put new vertices at midpoints of old edges.
         # Use Exodus ordering where new vertex i+3 is
         # opposite vertex i.
+        # The element's edges are stored in the order (0,1), (1,2), (2,0),
+        # so the edge opposite vertex i is at position (i+1)%3.
+        curElemEdges = coarse.elemToEdgesMap[el]
         for i,S in enumerate(([1,2], [2,0], [0,1])):
-            # Get vertices on current edge, then sort to make a key
-            # into old mesh's dictionary of vertices
+            # Get vertices on current edge, sorted
             s = [curElemVerts[S[0]], curElemVerts[S[1]]]
             s.sort();
             if verb>0:
                 print('\tchecking vertex at midpoint of edge=', s )
-            sKey = tuple(s)
-            oldEdgeIndex = coarse.sideToIndexMap[sKey]
+            oldEdgeIndex = curElemEdges[(i+1)%3]
             # Add only those edges that haven't yet been added
             if not oldEdgeDone[oldEdgeIndex]:
                 if verb>0:
@@ -84,8 +92,9 @@ def UniformTriangularRefinement(coarse, verb=0):
                 # Associate the new vertex with the current element
                 elemVerts[el, 3+i] = newVertID
                 # Record the indices and weights for the update matrix
-                updateIndices.append(s)
-                updateVals.append([0.5, 0.5])
+                updateRows.extend((newVertID, newVertID))
+                updateCols.extend(s)
+                updateVals.extend((0.5, 0.5))
                 oldEdgeDone[oldEdgeIndex] = True
                 oldEdgeToNewVertMap[oldEdgeIndex]=newVertID
 
@@ -98,10 +107,12 @@ def UniformTriangularRefinement(coarse, verb=0):
                 if verb>0:
                     print('\t\tadding new edge ', (v0, newVertID) )
                 newEdgeID = fine.addSide(v0, newVertID, oldLabel)
+                childSides[oldEdgeIndex,0] = newEdgeID
 
                 if verb>0:
                     print('\t\tadding new edge ', (v1, newVertID) )
                 newEdgeID = fine.addSide(v1, newVertID, oldLabel)
+                childSides[oldEdgeIndex,1] = newEdgeID
             else:
                 if verb>0:
                     print('\t\treusing vertex at midpoint of edge=', s )
@@ -143,36 +154,259 @@ def UniformTriangularRefinement(coarse, verb=0):
             print('\t\tadding new elem ', (v[3], v[4], v[5]) )
         fine.addElem(v[3], v[4], v[5])
 
+    # The new vertices are the edge midpoints. Each new element looks up its
+    # three sides.
+    Timers.count('refine.vertsCreated', numEdges)
+    Timers.count('refine.sidesCreated', numNewEdges)
+    Timers.count('refine.elemsCreated', numNewElems)
+    Timers.count('refine.sideLookups', 3*numNewElems)
+
+    # Carry the boundary index over to the fine mesh
+    with Timers.timer('boundary index'):
+        fine.setBoundaryIndex(coarse.boundaryIndex.refine(fine.sideLabels,
+            childSides, oldToNewVertexMap, oldEdgeToNewVertMap))
+
     # -- Refinemnt is done. Create the prolongation and restriction operators.
     # The update operator uses interpolation. The downdate operator is the
     # normalized transpose of the update operator.
 
-    # build the matrices in DOK form
-    update = sp.dok_matrix((numNewVerts, numVerts))
-    downdate = sp.dok_matrix((numVerts, numNewVerts))
-    for r in range(numNewVerts):
-        for c,v in zip(updateIndices[r],updateVals[r]):
-            update[r,c]=v
-            downdate[c,r]=v
-
-    # Update matrix is ready; convert to CSR
-    update = update.tocsr()
-
-    # Normalize the rows of the downdate operator by the row sum.
-    # Start by converting to list-of-list format
-    downdate = downdate.tolil()
-    # normalize rows
-    for r in range(numVerts):
-        row = downdate.getrowview(r)
-        nrm = row.sum()
-        row /= nrm
-
-    # Convert to CSR
-    downdate = downdate.tocsr()
+    with Timers.timer('transfer operators'):
+        update, downdate = makeTransferOperators(numFineVerts, numVerts,
+            updateRows, updateCols, updateVals)
 
     return (fine, update, downdate)
 
 
+# ---------------------------------------------------------------------------
+# Vectorized version of UniformTriangularRefinement. Rather than looping
+# over elements in Python, this works on whole arrays at once and returns
+# the fine mesh as a CompressedMesh2D. The coarse mesh can be either a
+# LoadableMesh2D or a CompressedMesh2D.
+#
+# The fine mesh is numbered exactly as UniformTriangularRefinement numbers
+# it, so the two functions produce the same (fine, update, downdate) triple.
+# In that routine, vertices and sides are created in the order they're
+# first encountered in a sweep over elements; here we reproduce that order
+# by ranking the first appearance of each coarse vertex and edge in the
+# flattened element-by-element list of "slots" [v0, v1, v2, e0, e1, e2],
+# where edge ei is opposite vertex vi.
+
+@Timers.timed('VectorizedUniformTriangularRefinement')
+def VectorizedUniformTriangularRefinement(coarse, verb=0):
+
+    from CompressedMesh2D import CompressedMesh2D
+
+    with Timers.timer('coarse arrays'):
+        c = coarseArrays(coarse)
+    numVerts = len(c['verts'])
+    numEdges = len(c['sides'])
+    numElems = len(c['elems'])
+
+    if verb>0:
+        print('refining %d elements into %d' % (numElems, 4*numElems))
+
+    with Timers.timer('number fine entities'):
+        numberFineEntities(c)
+        fineVerts = fineVertexCoordinates(c)
+
+    with Timers.timer('refine elements'):
+        out = allocateFineArrays(c)
+        refineElemBlock(0, numElems, c, out)
+    countFineEntities(c)
+
+    with Timers.timer('build mesh'):
+        fine = CompressedMesh2D(fineVerts, out['elems'], out['sides'],
+            out['sideLabels'], out['elemToEdgesMap'], sidesSorted=True,
+            boundaryIndex=fineBoundaryIndex(coarse, c, out))
+
+    with Timers.timer('transfer operators'):
+        update, downdate = vectorizedTransferOperators(c)
+
+    return (fine, update, downdate)
+
+
+# ---- Building blocks of the vectorized refinement, shared with
+# ParallelUniformTriangularRefinement. Arrays are passed around in
+# dictionaries: c holds the coarse mesh and the numbering of the fine
+# entities, out holds the fine mesh's element and side arrays.
+
+# Put the coarse mesh's data into a dictionary of arrays
+def coarseArrays(coarse):
+    c = {}
+    c['verts'] = np.asarray(coarse.verts, dtype=np.float64).reshape(-1,2)
+    c['elems'] = np.asarray(coarse.elems, dtype=np.int64).reshape(-1,3)
+    c['sides'] = np.sort(np.asarray(coarse.sides, dtype=np.int64).reshape(-1,2),
+                         axis=1)
+    c['sideLabels'] = np.asarray(coarse.sideLabels)
+    c['elemEdges'] = np.asarray(coarse.elemToEdgesMap,
+                                dtype=np.int64).reshape(-1,3)
+    return c
+
+
+# Number the fine vertices and sides in the order the serial refiner
+# creates them. Adds to c:
+# --- oldToNewVertexMap, oldEdgeToNewVertMap: fine index of each coarse
+#     vertex and of the midpoint of each coarse edge
+# --- edgeIsFirst: (numElems, 3) flags, true where the edge opposite vertex
+#     i is first encountered in this element. That element creates the
+#     edge's two child sides.
+# --- sideStart: index of the first fine side created by each element
+# --- childSides: (numEdges, 2) fine indices of the children of each coarse
+#     edge; child k is the half touching coarse vertex sides[e,k].
+def numberFineEntities(c):
+    elems = c['elems']
+    numVerts = len(c['verts'])
+    numEdges = len(c['sides'])
+    numElems = len(elems)
+
+    # Edge opposite vertex i is stored at position (i+1)%3
+    oppEdges = c['elemEdges'][:, [1,2,0]]
+
+    # Rank the first appearance of each vertex and edge
+    slots = np.hstack([elems, numVerts + oppEdges]).ravel()
+    keys, firstSlot = np.unique(slots, return_index=True)
+    if len(keys) != numVerts + numEdges:
+        raise RuntimeError('mesh has vertices or sides not attached to '
+            'any element')
+    newIndex = np.empty(numVerts + numEdges, dtype=np.int64)
+    newIndex[keys[np.argsort(firstSlot, kind='stable')]] \
+        = np.arange(len(keys), dtype=np.int64)
+    c['oldToNewVertexMap'] = newIndex[:numVerts]
+    c['oldEdgeToNewVertMap'] = newIndex[numVerts:]
+
+    # Each element creates two children for each edge it encounters first,
+    # then three interior sides.
+    isFirst = np.zeros(len(slots), dtype=bool)
+    isFirst[firstSlot] = True
+    edgeIsFirst = isFirst.reshape(-1,6)[:,3:]
+    c['edgeIsFirst'] = edgeIsFirst
+
+    sideStart = np.zeros(numElems+1, dtype=np.int64)
+    np.cumsum(2*edgeIsFirst.sum(axis=1) + 3, out=sideStart[1:])
+    c['sideStart'] = sideStart
+
+    rank = np.cumsum(edgeIsFirst, axis=1) - edgeIsFirst
+    firstChild = sideStart[:-1,None] + 2*rank
+    childSides = np.empty((numEdges, 2), dtype=np.int64)
+    childSides[oppEdges[edgeIsFirst], 0] = firstChild[edgeIsFirst]
+    childSides[oppEdges[edgeIsFirst], 1] = firstChild[edgeIsFirst] + 1
+    c['childSides'] = childSides
+
+
+# Fine vertex coordinates: the old vertices plus edge midpoints
+def fineVertexCoordinates(c):
+    verts = c['verts']
+    sides = c['sides']
+    fineVerts = np.empty((len(verts) + len(sides), 2))
+    fineVerts[c['oldToNewVertexMap']] = verts
+    fineVerts[c['oldEdgeToNewVertMap']] = 0.5*(verts[sides[:,0]]
+                                               + verts[sides[:,1]])
+    return fineVerts
+
+
+# Allocate the fine mesh's element and side arrays. If allocate is False,
+# return their (shape, dtype) pairs instead, for the caller to allocate.
+def allocateFineArrays(c, allocate=True):
+    numElems = len(c['elems'])
+    numSides = int(c['sideStart'][-1])
+    shapes = {}
+    shapes['elems'] = ((4*numElems, 3), np.int32)
+    shapes['elemToEdgesMap'] = ((4*numElems, 3), np.int32)
+    shapes['sides'] = ((numSides, 2), np.int32)
+    shapes['sideLabels'] = ((numSides,), c['sideLabels'].dtype)
+    if not allocate:
+        return shapes
+    return {key : np.empty(shape, dtype=dtype)
+            for key, (shape, dtype) in shapes.items()}
+
+
+# Refine the coarse elements lo through hi-1, writing their children and
+# the sides they create into the fine arrays. Blocks of elements can be
+# done in any order, or concurrently.
+def refineElemBlock(lo, hi, c, out):
+    elems = c['elems'][lo:hi]
+    oppEdges = c['elemEdges'][lo:hi][:, [1,2,0]]
+    edgeIsFirst = c['edgeIsFirst'][lo:hi]
+    sideStart = c['sideStart']
+    sides = c['sides']
+    childSides = c['childSides']
+    oldToNewVertexMap = c['oldToNewVertexMap']
+    numElems = hi - lo
+
+    # ---- Child elements, using Exodus ordering where new vertex i+3 is
+    # opposite vertex i.
+    v = np.hstack([oldToNewVertexMap[elems], c['oldEdgeToNewVertMap'][oppEdges]])
+    out['elems'][4*lo:4*hi] = np.stack([v[:,[0,5,4]], v[:,[1,3,5]],
+        v[:,[2,4,3]], v[:,[3,4,5]]], axis=1).reshape(-1,3)
+
+    # ---- Sides created by these elements: the children of first-encountered
+    # edges, then the interior sides (3,5), (3,4), (4,5).
+    ends = oldToNewVertexMap[sides[oppEdges]]          # (numElems, 3, 2)
+    mids = v[:,3:]
+    childPairs = np.stack([ends, np.repeat(mids[:,:,None], 2, axis=2)],
+                          axis=3).reshape(numElems, 6, 2)
+    interiorPairs = v[:, [[3,5], [3,4], [4,5]]]
+    allSides = np.concatenate([childPairs, interiorPairs], axis=1)
+
+    sideValid = np.hstack([np.repeat(edgeIsFirst, 2, axis=1),
+                           np.ones((numElems,3), dtype=bool)])
+    s0, s1 = sideStart[lo], sideStart[hi]
+    out['sides'][s0:s1] = np.sort(allSides[sideValid], axis=1)
+
+    labels = c['sideLabels'][oppEdges]
+    childLabels = np.repeat(labels, 2, axis=1)
+    interiorLabels = np.zeros((numElems,3), dtype=labels.dtype)
+    out['sideLabels'][s0:s1] = np.hstack([childLabels, interiorLabels])[sideValid]
+
+    # ---- Sides of each child element, in the order (a,b), (b,c), (c,a)
+    interior = sideStart[lo:hi] + 2*edgeIsFirst.sum(axis=1)
+    i35 = interior
+    i34 = interior + 1
+    i45 = interior + 2
+
+    # The half of the edge opposite vertex i that touches vertex j
+    def half(i, j):
+        e = oppEdges[:,i]
+        return childSides[e, (sides[e,0] != elems[:,j]).astype(np.int64)]
+
+    out['elemToEdgesMap'][4*lo:4*hi] = np.stack([
+        np.stack([half(2,0), i45, half(1,0)], axis=1),
+        np.stack([half(0,1), i35, half(2,1)], axis=1),
+        np.stack([half(1,2), i34, half(0,2)], axis=1),
+        np.stack([i34, i45, i35], axis=1)], axis=1).reshape(-1,3)
+
+
+# Count the fine entities created, for the instrumentation in Timers. The
+# coarse vertices are carried over, so only the edge midpoints are new.
+def countFineEntities(c):
+    numEdges = len(c['sides'])
+    numElems = len(c['elems'])
+    Timers.count('refine.vertsCreated', numEdges)
+    Timers.count('refine.sidesCreated', 2*numEdges + 3*numElems)
+    Timers.count('refine.elemsCreated', 4*numElems)
+
+
+# The coarse mesh's boundary index carried over to the fine mesh
+def fineBoundaryIndex(coarse, c, out):
+    return coarse.boundaryIndex.refine(out['sideLabels'], c['childSides'],
+        c['oldToNewVertexMap'], c['oldEdgeToNewVertMap'])
+
+
+# Create the prolongation and restriction operators. The update
+# operator uses interpolation. The downdate operator is the
+# normalized transpose of the update operator.
+def vectorizedTransferOperators(c):
+    numVerts = len(c['verts'])
+    numEdges = len(c['sides'])
+    rows = np.concatenate([c['oldToNewVertexMap'],
+                           np.repeat(c['oldEdgeToNewVertMap'], 2)])
+    cols = np.concatenate([np.arange(numVerts), c['sides'].ravel()])
+    vals = np.concatenate([np.ones(numVerts), np.full(2*numEdges, 0.5)])
+
+    return makeTransferOperators(numVerts + numEdges, numVerts,
+        rows, cols, vals)
+
+
 # ---------------------------------------------------------------------------
 # Test code
 
@@ -0,0 +1,176 @@
+import numpy as np
+import xml.etree.ElementTree as ET
+import base64
+import zlib
+import os
+
+# --------------------------------------------------------------------------
+# Reader for the VTK XML unstructured grid (.vtu) files written by
+# VTKWriter, in any of its modes (ascii, binary, or appended with raw or
+# base64 data), with or without zlib compression. It's meant for checking
+# output and reading it back into NumPy, not as a general VTK reader: only
+# UInt64 headers, little-endian data, and triangle cells are supported.
+#
+# readVTU(filename) returns a VTUData object with
+# --- points: (numPoints, 3) array of coordinates
+# --- elems: (numCells, 3) array of vertex indices
+# --- pointData, cellData: dictionaries mapping field names to arrays
+#
+# readPVD(filename) returns the (time, file name) pairs listed in a .pvd
+# collection, and readPVTU(filename) returns a PVTUData object with the
+# piece file names and the names of the point and cell fields declared in
+# a .pvtu file. File names are made relative to the current directory.
+# --------------------------------------------------------------------------
+
+class VTUData:
+
+    def __init__(self, points, elems, pointData, cellData):
+        self.points = points
+        self.elems = elems
+        self.pointData = pointData
+        self.cellData = cellData
+
+
+def readVTU(filename):
+    with open(filename, 'rb') as f:
+        contents = f.read()
+
+    # Raw appended data isn't XML, so cut it out before parsing
+    appended = b''
+    raw = False
+    start = contents.find(b'<AppendedData')
+    if start>=0:
+        tagEnd = contents.index(b'>', start)
+        raw = b'"raw"' in contents[start:tagEnd]
+        dataStart = contents.index(b'_', tagEnd) + 1
+        end = contents.rindex(b'</AppendedData>')
+        appended = contents[dataStart:end].rstrip(b'\n')
+        contents = contents[:start] + contents[end+len(b'</AppendedData>'):]
+
+    root = ET.fromstring(contents)
+    if root.get('header_type', 'UInt64') != 'UInt64':
+        raise ValueError('%s: only UInt64 headers are supported' % filename)
+    compressed = root.get('compressor') is not None
+    piece = root.find('UnstructuredGrid/Piece')
+
+    def read(xml):
+        return readDataArray(xml, compressed, appended, raw)
+
+    points = read(piece.find('Points/DataArray')).reshape(-1, 3)
+    cells = {a.get('Name') : read(a) for a in piece.findall('Cells/DataArray')}
+    if np.any(cells['types'] != 5):
+        raise ValueError('%s: only triangle cells are supported' % filename)
+    elems = cells['connectivity'].reshape(-1, 3)
+
+    pointData = {a.get('Name') : read(a)
+                 for a in piece.findall('PointData/DataArray')}
+    cellData = {a.get('Name') : read(a)
+                for a in piece.findall('CellData/DataArray')}
+    return VTUData(points, elems, pointData, cellData)
+
+
+def readPVD(filename):
+    root = ET.parse(filename).getroot()
+    pvdDir = os.path.dirname(filename)
+    return [(float(ds.get('timestep')), os.path.join(pvdDir, ds.get('file')))
+            for ds in root.findall('Collection/DataSet')]
+
+
+class PVTUData:
+
+    def __init__(self, pieces, pointFieldNames, cellFieldNames):
+        self.pieces = pieces
+        self.pointFieldNames = pointFieldNames
+        self.cellFieldNames = cellFieldNames
+
+
+def readPVTU(filename):
+    root = ET.parse(filename).getroot()
+    pvtuDir = os.path.dirname(filename)
+    grid = root.find('PUnstructuredGrid')
+    pieces = [os.path.join(pvtuDir, p.get('Source'))
+              for p in grid.findall('Piece')]
+    pointFieldNames = [a.get('Name')
+                       for a in grid.findall('PPointData/PDataArray')]
+    cellFieldNames = [a.get('Name')
+                      for a in grid.findall('PCellData/PDataArray')]
+    return PVTUData(pieces, pointFieldNames, cellFieldNames)
+
+
+# ---- Functions past this point are for internal use
+
+numpyTypes = {'Float32' : '<f4', 'Float64' : '<f8', 'Int32' : '<i4',
+              'Int64' : '<i8', 'UInt8' : 'u1'}
+
+
+# Decode the data of one DataArray element
+def readDataArray(xml, compressed, appended, raw):
+    dtype = np.dtype(numpyTypes[xml.get('type')])
+    fmt = xml.get('format')
+
+    if fmt=='ascii':
+        return np.array((xml.text or '').split(), dtype=np.float64).astype(dtype)
+
+    if fmt=='binary':
+        data = decodeBase64(xml.text.strip().encode('ascii'), compressed)
+    elif fmt=='appended':
+        offset = int(xml.get('offset'))
+        if raw:
+            data = decodeRaw(appended[offset:], compressed)
+        else:
+            data = decodeBase64(appended[offset:], compressed)
+    else:
+        raise ValueError('unknown DataArray format "%s"' % fmt)
+    return np.frombuffer(data, dtype=dtype)
+
+
+# Raw appended data: a header followed by the (possibly compressed) data
+def decodeRaw(block, compressed):
+    if not compressed:
+        n = int(np.frombuffer(block[:8], dtype='<u8')[0])
+        return block[8:8+n]
+    numBlocks = int(np.frombuffer(block[:8], dtype='<u8')[0])
+    header = np.frombuffer(block[:8*(3+numBlocks)], dtype='<u8')
+    pos = 8*(3+numBlocks)
+    chunks = []
+    for size in header[3:]:
+        chunks.append(zlib.decompress(block[pos:pos+int(size)]))
+        pos += int(size)
+    return b''.join(chunks)
+
+
+# Base64 data. Uncompressed, the header and data are encoded together;
+# compressed, they're encoded separately, so the header's length has to be
+# found from its first entry before the data can be located.
+def decodeBase64(text, compressed):
+    if not compressed:
+        head = base64.b64decode(text[:12])
+        n = int(np.frombuffer(head[:8], dtype='<u8')[0])
+        length = 4*((8 + n + 2)//3)
+        return base64.b64decode(text[:length])[8:]
+    first = base64.b64decode(text[:12])
+    numBlocks = int(np.frombuffer(first[:8], dtype='<u8')[0])
+    headerLength = 4*((8*(3+numBlocks) + 2)//3)
+    header = np.frombuffer(base64.b64decode(text[:headerLength]), dtype='<u8')
+    dataLength = 4*((int(np.sum(header[3:])) + 2)//3)
+    data = base64.b64decode(text[headerLength:headerLength+dataLength])
+    chunks = []
+    pos = 0
+    for size in header[3:]:
+        chunks.append(zlib.decompress(data[pos:pos+int(size)]))
+        pos += int(size)
+    return b''.join(chunks)
+
+
+# ---------------------------------------------------------------------------
+# Test code
+
+if __name__=='__main__':
+
+    import sys
+    data = readVTU(sys.argv[1])
+    print('%d points, %d cells' % (len(data.points), len(data.elems)))
+    for name, f in data.pointData.items():
+        print('point field %s: min %g, max %g' % (name, f.min(), f.max()))
+    for name, f in data.cellData.items():
+        print('cell field %s: min %g, max %g' % (name, f.min(), f.max()))
@@ -0,0 +1,333 @@
+from VTKWriter import *
+import os
+
+# --------------------------------------------------------------------------
+# Writer for a time series of fields on a fixed mesh.
+#
+# By default (format='xdmf') the series is written as XDMF over a single
+# HDF5 file, which ParaView and VisIt read as one time-dependent dataset:
+# --- <basename>.h5 holds the points and triangles once, under /mesh, and
+#     each step's fields under /step_<n>/<name>
+# --- <basename>.xdmf describes the mesh once; the grid for each step
+#     includes that mesh by reference and adds the step's time and fields
+# so each step writes only its fields. This format needs h5py.
+#
+# With format='pvd', each step is a complete .vtu file, <basename>_<n>.vtu,
+# indexed by a ParaView data collection, <basename>.pvd. A .vtu file can't
+# refer to geometry in another file, so every step repeats the points and
+# cells; they're encoded once and the encoded bytes reused, but the disk
+# volume is that of writing each step separately. The mode and compress
+# options are as for VTKWriter and apply only to this format.
+#
+# Each call to writeStep(time, pointFields, cellFields) writes one step.
+# Fields are given as dictionaries mapping names to arrays. floatType
+# ('Float32' or 'Float64') sets the precision the fields are stored in.
+#
+# The index (.xdmf or .pvd) is rewritten after every flushEvery steps (by
+# default every step) and when the writer is closed, after the HDF5 file
+# has been flushed. It's written to a temporary file that then replaces the
+# old index, so if the run is interrupted the index on disk is always
+# complete and lists every step written up to the last flush.
+# --------------------------------------------------------------------------
+
+class VTKTimeSeriesWriter:
+
+    def __init__(self, basename, mesh, format='xdmf', mode='appended',
+                 compress=False, floatType='Float32', flushEvery=1):
+        if format not in ('xdmf', 'pvd'):
+            raise ValueError('unknown time series format "%s"' % format)
+        if floatType not in ('Float32', 'Float64'):
+            raise ValueError('unknown float type "%s"' % floatType)
+        self.basename = basename
+        self.mesh = mesh
+        self.format = format
+        self.mode = mode
+        self.compress = compress
+        self.floatType = floatType
+        self.flushEvery = flushEvery
+
+        # (time, file name) for each .vtu step, or (time, point field
+        # names, cell field names) for each XDMF step
+        self.steps = []
+        self.unflushed = 0
+
+        if format=='pvd':
+            # Encoded geometry shared by the writers for all steps
+            self.cache = {}
+        else:
+            self.openHDF5()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    # Write the fields for one time step
+    def writeStep(self, time, pointFields=None, cellFields=None):
+        if pointFields is None:
+            pointFields = {}
+        if cellFields is None:
+            cellFields = {}
+
+        if self.format=='pvd':
+            self.writeVTUStep(time, pointFields, cellFields)
+        else:
+            self.writeHDF5Step(time, pointFields, cellFields)
+
+        self.unflushed += 1
+        if self.unflushed >= self.flushEvery:
+            self.flush()
+
+    # Rewrite the index listing all steps written so far
+    def flush(self):
+        if self.format=='pvd':
+            indexName = self.basename + '.pvd'
+            writeIndex = self.writePVD
+        else:
+            self.h5.flush()
+            indexName = self.basename + '.xdmf'
+            writeIndex = self.writeXDMF
+
+        tmpName = indexName + '.tmp'
+        with open(tmpName, 'w') as file:
+            writeIndex(file, os.path.dirname(os.path.abspath(indexName)))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmpName, indexName)
+        self.unflushed = 0
+
+    def close(self):
+        if self.unflushed>0:
+            self.flush()
+        if self.format=='xdmf' and self.h5 is not None:
+            self.h5.close()
+            self.h5 = None
+
+    # ---- Functions past this point are for internal use
+
+    def numpyFloatType(self):
+        return {'Float32' : np.float32, 'Float64' : np.float64}[self.floatType]
+
+    # Create the HDF5 file and write the mesh into it
+    def openHDF5(self):
+        import h5py
+
+        self.h5Name = self.basename + '.h5'
+        self.h5 = h5py.File(self.h5Name, 'w')
+        self.verts = np.asarray(self.mesh.verts, dtype=np.float64).reshape(-1,2)
+        self.elems = np.asarray(self.mesh.elems, dtype=np.int32).reshape(-1,3)
+        self.h5.create_dataset('mesh/points', data=self.verts)
+        self.h5.create_dataset('mesh/elems', data=self.elems)
+
+    def writeHDF5Step(self, time, pointFields, cellFields):
+        group = self.h5.create_group('step_%04d' % len(self.steps))
+        for fields, size in ((pointFields, len(self.verts)),
+                             (cellFields, len(self.elems))):
+            for name, vec in fields.items():
+                vec = np.asarray(vec, dtype=self.numpyFloatType())
+                if vec.shape != (size,):
+                    raise ValueError('field "%s" has shape %s, expected (%d,)'
+                        % (name, vec.shape, size))
+                group.create_dataset(name, data=vec)
+        self.steps.append((time, list(pointFields.keys()),
+                           list(cellFields.keys())))
+
+    def writeVTUStep(self, time, pointFields, cellFields):
+        filename = '%s_%04d.vtu' % (self.basename, len(self.steps))
+        with open(filename, 'w') as file:
+            writer = VTKWriter(file, mode=self.mode, compress=self.compress,
+                               floatType=self.floatType, cache=self.cache)
+            writer.addMesh(self.mesh)
+            for name, vec in pointFields.items():
+                writer.addField(name, vec)
+            for name, vec in cellFields.items():
+                writer.addCellField(name, vec)
+            writer.write()
+        self.steps.append((time, filename))
+
+    # Write an HDF5 DataItem element referring to a dataset
+    def writeDataItem(self, file, path, dims, numberType, precision):
+        item = XMLHeader('DataItem')
+        item.addAttribute('Dimensions', ' '.join([str(d) for d in dims]))
+        item.addAttribute('NumberType', numberType)
+        item.addAttribute('Precision', precision)
+        item.addAttribute('Format', 'HDF')
+        file.write('<%s>%s:%s</DataItem>\n' % (item.openTag(),
+            os.path.basename(self.h5Name), path))
+
+    def writeXDMF(self, file, xdmfDir):
+        numVerts = len(self.verts)
+        numElems = len(self.elems)
+        precision = 4 if self.floatType=='Float32' else 8
+
+        file.write('<?xml version="1.0"?>\n')
+        head = XMLHeader('Xdmf')
+        head.addAttribute('Version', '3.0')
+        head.addAttribute('xmlns:xi', 'http://www.w3.org/2001/XInclude')
+        head.writeHeader(file)
+        domain = XMLHeader('Domain')
+        domain.writeHeader(file)
+
+        # The mesh, described once
+        grid = XMLHeader('Grid')
+        grid.addAttribute('Name', 'mesh')
+        grid.addAttribute('GridType', 'Uniform')
+        grid.writeHeader(file)
+        topo = XMLHeader('Topology')
+        topo.addAttribute('TopologyType', 'Triangle')
+        topo.addAttribute('NumberOfElements', numElems)
+        topo.writeHeader(file)
+        self.writeDataItem(file, '/mesh/elems', (numElems, 3), 'Int', 4)
+        topo.writeFooter(file)
+        geom = XMLHeader('Geometry')
+        geom.addAttribute('GeometryType', 'XY')
+        geom.writeHeader(file)
+        self.writeDataItem(file, '/mesh/points', (numVerts, 2), 'Float', 8)
+        geom.writeFooter(file)
+        grid.writeFooter(file)
+
+        # The steps, each including the mesh by reference
+        series = XMLHeader('Grid')
+        series.addAttribute('Name', 'series')
+        series.addAttribute('GridType', 'Collection')
+        series.addAttribute('CollectionType', 'Temporal')
+        series.writeHeader(file)
+        for n, (time, pointNames, cellNames) in enumerate(self.steps):
+            step = XMLHeader('Grid')
+            step.addAttribute('Name', 'step_%04d' % n)
+            step.addAttribute('GridType', 'Uniform')
+            step.writeHeader(file)
+            file.write('<xi:include xpointer="xpointer(//Grid[@Name=&quot;mesh'
+                '&quot;]/*[self::Topology or self::Geometry])"/>\n')
+            t = XMLHeader('Time')
+            t.addAttribute('Value', repr(float(time)))
+            file.write('<%s/>\n' % t.openTag())
+            for names, center, size in ((pointNames, 'Node', numVerts),
+                                        (cellNames, 'Cell', numElems)):
+                for name in names:
+                    attr = XMLHeader('Attribute')
+                    attr.addAttribute('Name', name)
+                    attr.addAttribute('AttributeType', 'Scalar')
+                    attr.addAttribute('Center', center)
+                    attr.writeHeader(file)
+                    self.writeDataItem(file, '/step_%04d/%s' % (n, name),
+                                       (size,), 'Float', precision)
+                    attr.writeFooter(file)
+            step.writeFooter(file)
+        series.writeFooter(file)
+
+        domain.writeFooter(file)
+        head.writeFooter(file)
+
+    def writePVD(self, file, pvdDir):
+        file.write('<?xml version="1.0"?>\n')
+        head = XMLHeader('VTKFile')
+        head.addAttribute('type', 'Collection')
+        head.addAttribute('version', '0.1')
+        head.addAttribute('byte_order', 'LittleEndian')
+        head.writeHeader(file)
+
+        coll = XMLHeader('Collection')
+        coll.writeHeader(file)
+        for time, filename in self.steps:
+            ds = XMLHeader('DataSet')
+            ds.addAttribute('timestep', repr(float(time)))
+            ds.addAttribute('group', '')
+            ds.addAttribute('part', '0')
+            # File names are relative to the index
+            ds.addAttribute('file', os.path.relpath(
+                os.path.abspath(filename), pvdDir))
+            ds.writeHeader(file)
+            ds.writeFooter(file)
+        coll.writeFooter(file)
+
+        head.writeFooter(file)
+
+
+# ---------------------------------------------------------------------------
+# Test code: a traveling wave on a refined mesh, read back step by step
+
+if __name__=='__main__':
+
+    import time
+    import h5py
+    import xml.etree.ElementTree as ET
+    from math import pi
+    from TriangleMeshReader import TriangleMeshReader
+    from UniformTriangularRefinement import VectorizedUniformTriangularRefinement
+    from VTKReader import readVTU, readPVD
+
+    mesh = TriangleMeshReader('TestMeshes/oneHole.1', bulk=True).getMesh()
+    for i in range(4):
+        mesh, up, down = VectorizedUniformTriangularRefinement(mesh)
+    x = mesh.verts[:,0]
+    centroids = np.mean(mesh.verts[mesh.elems], axis=1)
+
+    def u(t):
+        return np.sin(2.0*pi*(x - t))
+
+    def speed(t):
+        return np.cos(2.0*pi*(centroids[:,0] - t))
+
+    numSteps = 20
+    times = [step/float(numSteps) for step in range(numSteps)]
+    ok = True
+
+    # XDMF: the mesh is stored once, each step adds only its fields
+    start = time.perf_counter()
+    with VTKTimeSeriesWriter('wave', mesh, flushEvery=3) as writer:
+        for step, t in enumerate(times):
+            writer.writeStep(t, pointFields={'u' : u(t)},
+                             cellFields={'speed' : speed(t)})
+            if step==0:
+                firstSize = os.path.getsize('wave.h5')
+            # The index on disk lists every step up to the last flush
+            if step==4:
+                flushed = len(ET.parse('wave.xdmf').findall(
+                    'Domain/Grid/Grid'))
+    elapsed = time.perf_counter() - start
+
+    root = ET.parse('wave.xdmf').getroot()
+    ok = ok and flushed==3
+    ok = ok and len(root.findall('.//Geometry'))==1
+    steps = root.findall('Domain/Grid/Grid')
+    with h5py.File('wave.h5', 'r') as h5:
+        def dataset(item):
+            return h5[item.text.split(':')[1]][()]
+        ok = ok and np.array_equal(dataset(root.find('.//Topology/DataItem')),
+                                   mesh.elems)
+        ok = ok and np.array_equal(dataset(root.find('.//Geometry/DataItem')),
+                                   mesh.verts)
+        for step, t in zip(steps, times):
+            fields = {a.get('Name') : dataset(a.find('DataItem'))
+                      for a in step.findall('Attribute')}
+            ok = ok and (float(step.find('Time').get('Value'))==t
+                and np.allclose(fields['u'], u(t), atol=1.0e-6)
+                and np.allclose(fields['speed'], speed(t), atol=1.0e-6))
+    ok = ok and len(steps)==numSteps
+    stepBytes = (os.path.getsize('wave.h5') - firstSize)/(numSteps - 1)
+    fieldBytes = 4*(len(mesh.verts) + len(mesh.elems))
+    print('xdmf: wrote %d steps on %d elements in %.3f s, read back %s'
+        % (numSteps, len(mesh.elems), elapsed, ok))
+    print('xdmf: %d bytes per step, fields are %d bytes'
+        % (stepBytes, fieldBytes))
+    ok = ok and stepBytes < 1.1*fieldBytes
+
+    # .pvd of complete .vtu files
+    with VTKTimeSeriesWriter('wave', mesh, format='pvd') as writer:
+        for t in times:
+            writer.writeStep(t, pointFields={'u' : u(t)},
+                             cellFields={'speed' : speed(t)})
+    steps = readPVD('wave.pvd')
+    ok = ok and [t for t, name in steps]==times
+    for t, name in steps:
+        data = readVTU(name)
+        ok = ok and (np.array_equal(data.elems, mesh.elems)
+            and np.allclose(data.pointData['u'], u(t), atol=1.0e-6)
+            and np.allclose(data.cellData['speed'], speed(t), atol=1.0e-6))
+    print('pvd: %d bytes per step, read back %s'
+        % (os.path.getsize(steps[0][1]), ok))
+
+    if not ok:
+        raise RuntimeError('VTKTimeSeriesWriter round trip failed')
@@ -1,12 +1,60 @@
-
 from LoadableMesh2D import *
 from XMLHeader import *
+import numpy as np
+import base64
+import io
+import zlib
+import Timers
+
+# --------------------------------------------------------------------------
+# Writer for VTK's XML unstructured grid (.vtu) format.
+#
+# Data arrays can be written in one of three modes:
+# --- 'ascii': human-readable text (the default)
+# --- 'binary': base64-encoded data inline in each DataArray element
+# --- 'appended': raw bytes collected in an AppendedData section at the end
+#     of the file. Raw bytes are written through the underlying binary
+#     buffer of the file, so the file must be a real file opened in text
+#     mode (as with open(name, 'w')). For in-memory text streams without
+#     a buffer, the appended data is base64 encoded instead.
+#
+# In the binary and appended modes, setting compress=True compresses the
+# data with zlib in blocks, following VTK's vtkZLibDataCompressor scheme.
+# Floating point data (point coordinates and fields) is written as Float32
+# unless floatType='Float64' is given.
+#
+# Point fields are added with addField() and cell fields with
+# addCellField(). If a dictionary is given as the cache argument, the
+# encoded points and cells are stored in it the first time they're written
+# and reused by any writer sharing the same cache, so a mesh that doesn't
+# change is only encoded once. The cache must only be shared between
+# writers for the same mesh with the same mode and options.
+#
+# With Timers enabled, each section of the file is timed, and the bytes
+# written, arrays encoded, and cache hits are counted.
+# --------------------------------------------------------------------------
 
 class VTKWriter:
 
-    def __init__(self, file):
+    # Size of the uncompressed blocks used with compression
+    blockSize = 32768
+
+    def __init__(self, file, mode='ascii', compress=False, floatType='Float32',
+                 cache=None):
+        if mode not in ('ascii', 'binary', 'appended'):
+            raise ValueError('unknown VTK output mode "%s"' % mode)
+        if compress and mode=='ascii':
+            raise ValueError('compression requires binary or appended mode')
+        if floatType not in ('Float32', 'Float64'):
+            raise ValueError('unknown VTK float type "%s"' % floatType)
+
         self.file = file
         self.fields = {}
+        self.cellFields = {}
+        self.cache = cache
+        self.mode = mode
+        self.compress = compress
+        self.floatType = floatType
 
     def addMesh(self, mesh):
         self.mesh = mesh
@@ -14,11 +62,33 @@ class VTKWriter:
     def addField(self, name, vec):
         self.fields[name] = vec
 
+    def addCellField(self, name, vec):
+        self.cellFields[name] = vec
+
+    @Timers.timed('VTKWriter')
     def write(self):
 
+        if Timers.enabled and hasattr(self.file, 'tell'):
+            startPos = self.file.tell()
+        else:
+            startPos = None
+
+        # Data for the AppendedData section, and the running byte offset.
+        # Raw data needs access to the file's binary buffer.
+        self.appended = []
+        self.appendedOffset = 0
+        self.rawAppended = hasattr(self.file, 'buffer')
+
         head = XMLHeader('VTKFile')
         head.addAttribute('type', 'UnstructuredGrid')
-        head.addAttribute('version', '0.1')
+        if self.mode=='ascii':
+            head.addAttribute('version', '0.1')
+        else:
+            head.addAttribute('version', '1.0')
+            head.addAttribute('byte_order', 'LittleEndian')
+            head.addAttribute('header_type', 'UInt64')
+            if self.compress:
+                head.addAttribute('compressor', 'vtkZLibDataCompressor')
         head.writeHeader(self.file)
 
         ug = XMLHeader('UnstructuredGrid')
@@ -30,31 +100,43 @@ class VTKWriter:
 
         pc.writeHeader(self.file)
 
-        self.writePoints()
-        self.writeCells()
-        self.writePointData()
-        self.writeCellData()
+        with Timers.timer('points'):
+            self.writePoints()
+        with Timers.timer('cells'):
+            self.writeCells()
+        with Timers.timer('point data'):
+            self.writePointData()
+        with Timers.timer('cell data'):
+            self.writeCellData()
 
         pc.writeFooter(self.file)
 
         ug.writeFooter(self.file)
+
+        if self.mode=='appended':
+            with Timers.timer('appended data'):
+                self.writeAppendedData()
+
         head.writeFooter(self.file)
 
+        if startPos is not None:
+            Timers.count('vtk.bytesWritten', self.file.tell() - startPos)
+
     def writePoints(self):
 
         pts = XMLHeader('Points')
         pts.writeHeader(self.file)
 
+        numVerts = len(self.mesh.verts)
+        xyz = np.zeros((numVerts, 3))
+        if numVerts>0:
+            xyz[:,0:2] = np.asarray(self.mesh.verts, dtype=np.float64)
+
         data = XMLHeader('DataArray')
         data.addAttribute('NumberOfComponents', '3')
-        data.addAttribute('type', 'Float32')
-        data.addAttribute('format', 'ascii')
-        data.writeHeader(self.file)
-
-        for p in self.mesh.verts:
-            self.file.write('%g %g 0.0\n' % p)
+        self.writeDataArray(data, self.floatType, xyz,
+            asciiFormat=self.asciiFloatFormat(3), key='points')
 
-        data.writeFooter(self.file)
         pts.writeFooter(self.file)
 
     def writeCells(self):
@@ -62,42 +144,26 @@ class VTKWriter:
         cells = XMLHeader('Cells')
         cells.writeHeader(self.file)
 
+        numCells = len(self.mesh.elems)
+        elems = np.asarray(self.mesh.elems, dtype=np.int32).reshape(numCells, 3)
+
         conn = XMLHeader('DataArray')
         conn.addAttribute('Name', 'connectivity')
-        conn.addAttribute('type', 'Int32')
-        conn.addAttribute('format', 'ascii')
-        conn.writeHeader(self.file)
-
-        for e in self.mesh.elems:
-            self.file.write('%d %d %d\n' % e)
-
-        conn.writeFooter(self.file)
+        self.writeDataArray(conn, 'Int32', elems, asciiFormat='%d %d %d',
+            key='connectivity')
 
         offsets = XMLHeader('DataArray')
-        offsets.addAttribute('type', 'Int32')
         offsets.addAttribute('Name', 'offsets')
-        offsets.addAttribute('format', 'ascii')
-        offsets.writeHeader(self.file)
-
-        count=0
-        numCells = len(self.mesh.elems)
-        for c in range(numCells):
-            count += 3
-            self.file.write('%d\n' % count)
-
-
-        offsets.writeFooter(self.file)
+        self.writeDataArray(offsets, 'Int32',
+            3*np.arange(1, numCells+1, dtype=np.int32), asciiFormat='%d',
+            key='offsets')
 
         types = XMLHeader('DataArray')
-        types.addAttribute('type', 'UInt8')
         types.addAttribute('Name', 'types')
-        types.addAttribute('format', 'ascii')
-        types.writeHeader(self.file)
-
-        for c in range(numCells):
-            self.file.write('5\n') # code for triangle elements
+        # 5 is the VTK code for triangle elements
+        self.writeDataArray(types, 'UInt8', np.full(numCells, 5, dtype=np.uint8),
+            asciiFormat='%d', key='types')
 
-        types.writeFooter(self.file)
         cells.writeFooter(self.file)
 
     def writePointData(self):
@@ -111,43 +177,230 @@ class VTKWriter:
         for name,field in self.fields.items():
 
             xml = XMLHeader('DataArray');
-            xml.addAttribute('type', 'Float32')
             xml.addAttribute('Name', name)
-            xml.addAttribute('format', 'ascii')
-            xml.writeHeader(self.file)
-
-            for f in field:
-                self.file.write('%g\n' % f)
-
-            xml.writeFooter(self.file)
-
+            self.writeDataArray(xml, self.floatType,
+                np.asarray(field, dtype=np.float64),
+                asciiFormat=self.asciiFloatFormat(1))
 
         pd.writeFooter(self.file)
 
     def writeCellData(self):
 
         cd = XMLHeader('CellData')
+        if len(self.cellFields)>0:
+            cd.addAttribute('Scalars', list(self.cellFields.keys())[0])
         cd.writeHeader(self.file)
+
+        for name,field in self.cellFields.items():
+
+            xml = XMLHeader('DataArray');
+            xml.addAttribute('Name', name)
+            self.writeDataArray(xml, self.floatType,
+                np.asarray(field, dtype=np.float64),
+                asciiFormat=self.asciiFloatFormat(1))
+
         cd.writeFooter(self.file)
 
+    # ---- Functions past this point are for internal use
+
+    # Format for writing a row of floats in ascii. Float64 output is written
+    # with enough digits to round-trip exactly.
+    def asciiFloatFormat(self, numComponents):
+        if self.floatType=='Float64':
+            fmt = '%.17g'
+        else:
+            fmt = '%g'
+        if numComponents==3:
+            # The z coordinate is always zero
+            return '%s %s 0.0' % (fmt, fmt)
+        return fmt
+
+    # NumPy dtype corresponding to a VTK type name
+    def numpyType(self, vtkType):
+        return {'Float32' : '<f4', 'Float64' : '<f8', 'Int32' : '<i4',
+                'Int64' : '<i8', 'UInt8' : 'u1'}[vtkType]
+
+    # Write a complete DataArray element. The XMLHeader should already
+    # have its name and number of components; the type and format attributes
+    # and the data are added here. If a key is given and the writer has a
+    # cache, the encoded data is looked up in or stored in the cache.
+    def writeDataArray(self, xml, vtkType, array, asciiFormat, key=None):
+
+        xml.addAttribute('type', vtkType)
+
+        useCache = self.cache is not None and key is not None
+        if useCache:
+            cacheKey = (key, self.mode, self.compress, vtkType,
+                        self.mode=='appended' and self.rawAppended)
+            encoded = self.cache.get(cacheKey)
+            if encoded is None:
+                encoded = self.encodeArray(vtkType, array, asciiFormat)
+                self.cache[cacheKey] = encoded
+            else:
+                Timers.count('vtk.cacheHits')
+
+        if self.mode=='ascii':
+            xml.addAttribute('format', 'ascii')
+            xml.writeHeader(self.file)
+            if useCache:
+                self.file.write(encoded)
+            else:
+                self.writeAscii(self.file, array, asciiFormat)
+            xml.writeFooter(self.file)
+            return
+
+        if not useCache:
+            encoded = self.encodeArray(vtkType, array, asciiFormat)
+
+        if self.mode=='binary':
+            xml.addAttribute('format', 'binary')
+            xml.writeHeader(self.file)
+            self.file.write(encoded)
+            self.file.write('\n')
+            xml.writeFooter(self.file)
+        else:
+            xml.addAttribute('format', 'appended')
+            xml.addAttribute('offset', self.appendedOffset)
+            xml.writeHeader(self.file)
+            xml.writeFooter(self.file)
+            self.appended.append(encoded)
+            self.appendedOffset += len(encoded)
+
+    # Encode an array for the current mode: text for ascii, a base64 string
+    # for binary, and a block of bytes for the appended section
+    def encodeArray(self, vtkType, array, asciiFormat):
+        Timers.count('vtk.arraysEncoded')
+        if self.mode=='ascii':
+            text = io.StringIO()
+            self.writeAscii(text, array, asciiFormat)
+            return text.getvalue()
+
+        data = np.ascontiguousarray(array, dtype=self.numpyType(vtkType))
+        data = data.tobytes()
+
+        if self.mode=='binary':
+            return self.encodeBase64(data)
+        if self.rawAppended:
+            return self.packRaw(data)
+        return self.encodeBase64(data).encode('ascii')
+
+    def writeAscii(self, file, array, asciiFormat):
+        if array.ndim==2 and asciiFormat.endswith(' 0.0'):
+            # The z coordinate is written by the format itself
+            array = array[:,0:2]
+        if len(array)>0:
+            np.savetxt(file, array, fmt=asciiFormat)
+
+    # Write the AppendedData section holding the data for all arrays
+    def writeAppendedData(self):
+        ad = XMLHeader('AppendedData')
+        if self.rawAppended:
+            ad.addAttribute('encoding', 'raw')
+        else:
+            ad.addAttribute('encoding', 'base64')
+        ad.writeHeader(self.file)
+        self.file.write('_')
+        if self.rawAppended:
+            # Raw bytes go directly to the file's binary buffer
+            self.file.flush()
+            for block in self.appended:
+                self.file.buffer.write(block)
+            self.file.buffer.flush()
+        else:
+            for block in self.appended:
+                self.file.write(block.decode('ascii'))
+        self.file.write('\n')
+        ad.writeFooter(self.file)
+        self.appended = []
+
+    # Split data into zlib-compressed blocks. Returns the VTK compression
+    # header [numBlocks, blockSize, lastBlockSize, compressedSize_0, ...]
+    # and the list of compressed blocks.
+    def compressBlocks(self, data):
+        n = len(data)
+        bs = self.blockSize
+        numBlocks = (n + bs - 1)//bs
+        blocks = [zlib.compress(data[i*bs:(i+1)*bs]) for i in range(numBlocks)]
+        lastBlockSize = n - (numBlocks-1)*bs if numBlocks>0 else 0
+        header = np.array([numBlocks, bs, lastBlockSize]
+            + [len(b) for b in blocks], dtype='<u8')
+        return header.tobytes(), blocks
+
+    # Header and data as raw bytes, for the appended section
+    def packRaw(self, data):
+        if self.compress:
+            header, blocks = self.compressBlocks(data)
+            return header + b''.join(blocks)
+        return np.array([len(data)], dtype='<u8').tobytes() + data
+
+    # Header and data encoded in base64. Without compression, the header and
+    # data are encoded together; with compression, VTK expects the header
+    # and the data to be encoded separately.
+    def encodeBase64(self, data):
+        if self.compress:
+            header, blocks = self.compressBlocks(data)
+            return (base64.b64encode(header)
+                + base64.b64encode(b''.join(blocks))).decode('ascii')
+        header = np.array([len(data)], dtype='<u8').tobytes()
+        return base64.b64encode(header + data).decode('ascii')
+
 
 
 if __name__=='__main__':
 
     from TriangleMeshReader import *
+    from VTKReader import readVTU
     import numpy as np
 
-    reader = TriangleMeshReader('../etc/Meshes/OneHole/oneHole.1')
+    reader = TriangleMeshReader('TestMeshes/oneHole.1')
     mesh = reader.getMesh()
-
-    vec = np.zeros(len(mesh.verts))
-    for i,p in enumerate(mesh.verts):
-        vec[i] = p[0]*p[1]
-
-
-
-    file = open('test.vtu', 'w')
-    writer = VTKWriter(file)
+    verts = np.asarray(mesh.verts)
+    elems = np.asarray(mesh.elems)
+
+    vec = verts[:,0]*verts[:,1]
+    elemIndex = np.arange(len(elems))
+
+    # Write each mode, with and without compression, and check that the
+    # file reads back to the same mesh and fields
+    ok = True
+    for mode, compress in (('ascii', False), ('binary', False),
+                           ('binary', True), ('appended', False),
+                           ('appended', True)):
+        for floatType in ('Float32', 'Float64'):
+            name = 'test-%s%s-%s.vtu' % (mode, '-z' if compress else '',
+                                         floatType)
+            with open(name, 'w') as file:
+                writer = VTKWriter(file, mode=mode, compress=compress,
+                    floatType=floatType)
+                writer.addMesh(mesh)
+                writer.addField('test', vec)
+                writer.addCellField('elemIndex', elemIndex)
+                writer.write()
+
+            data = readVTU(name)
+            tol = 1.0e-6 if floatType=='Float32' else 1.0e-15
+            same = (np.array_equal(data.elems, elems)
+                and np.allclose(data.points[:,0:2], verts, rtol=tol, atol=0)
+                and np.all(data.points[:,2]==0.0)
+                and np.allclose(data.pointData['test'], vec, rtol=tol,
+                                atol=tol)
+                and np.array_equal(data.cellData['elemIndex'], elemIndex))
+            ok = ok and same
+            print('%-36s read back %s' % (name, same))
+
+    # Appended data is base64 encoded when the file has no binary buffer
+    text = io.StringIO()
+    writer = VTKWriter(text, mode='appended', compress=True)
     writer.addMesh(mesh)
     writer.addField('test', vec)
     writer.write()
+    with open('test-appended-base64.vtu', 'w') as file:
+        file.write(text.getvalue())
+    data = readVTU('test-appended-base64.vtu')
+    same = (np.array_equal(data.elems, elems)
+        and np.allclose(data.pointData['test'], vec, rtol=1.0e-6, atol=1.0e-6))
+    ok = ok and same
+    print('%-36s read back %s' % ('test-appended-base64.vtu', same))
+
+    if not ok:
+        raise RuntimeError('VTKWriter round trip failed')
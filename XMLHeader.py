@@ -0,0 +1,47 @@
+from xml.sax.saxutils import quoteattr
+
+# --------------------------------------------------------------------------
+# Opening and closing tags of an XML element, for the writers that stream
+# XML to a file (VTKWriter and friends).
+#
+# Attributes are added with addAttribute() and written, in the order they
+# were added, by writeHeader(). Attribute values can be any object; they're
+# converted with str() and quoted and escaped as XML requires.
+# writeFooter() writes the closing tag. The element's content is whatever
+# the caller writes to the file between the two.
+# --------------------------------------------------------------------------
+
+class XMLHeader:
+
+    def __init__(self, name):
+        self.name = name
+        self.attributes = []
+
+    def addAttribute(self, key, value):
+        self.attributes.append((key, value))
+
+    def writeHeader(self, file):
+        file.write('<%s>\n' % self.openTag())
+
+    def writeFooter(self, file):
+        file.write('</%s>\n' % self.name)
+
+    # The opening tag's contents: the name and the attributes
+    def openTag(self):
+        attrs = ''.join([' %s=%s' % (key, quoteattr(str(value)))
+                         for key, value in self.attributes])
+        return self.name + attrs
+
+
+# ---------------------------------------------------------------------------
+# Test code
+
+if __name__=='__main__':
+
+    import sys
+
+    xml = XMLHeader('DataArray')
+    xml.addAttribute('Name', 'u & "v" <w>')
+    xml.addAttribute('NumberOfComponents', 3)
+    xml.writeHeader(sys.stdout)
+    xml.writeFooter(sys.stdout)
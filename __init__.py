@@ -1,4 +1,2 @@
-import Tab
 import Timers
-import Debug
 import XMLHeader